@@ -12,13 +12,20 @@ from six import PY2
 from xdg import XDG_CONFIG_HOME
 from werkzeug.middleware.proxy_fix import ProxyFix
 
+from aliquis.digest import create_activation_digest
 from aliquis.extensions import babel, celery, csrf, ldap_manager, login_manager
+from aliquis.hashing import HashingError, create_password_hasher
+from aliquis.ratelimit import RateLimitExceeded, create_rate_limiter
+from aliquis.storage import create_people_backend
 from aliquis.views import (
     blueprints,
     home as home_view,
+    metrics as metrics_view,
     forbidden as forbidden_handler,
     page_not_found as page_not_found_handler,
     internal_error as internal_error_handler,
+    service_unavailable as service_unavailable_handler,
+    too_many_requests as too_many_requests_handler,
 )
 
 
@@ -37,7 +44,9 @@ class VueFlask(Flask):
 def create_app(config):
     local_configs = []
     local_configs.append(config.get_map('aliquis'))
-    local_configs.append(config.get_map('ldap'))
+    for section in ('ldap', 'sql'):  # Only the section of the storage backend is needed
+        if config.has_section(section):
+            local_configs.append(config.get_map(section))
     local_configs.append(config.get_map('celery'))
     local_configs.append(config.get_map('mail-sendgrid'))
     local_configs.append(config.get_map('babel'))
@@ -49,31 +58,49 @@ def create_app(config):
     langs = app.config.get('BABEL_LANGUAGES', 'fr')
     app.config['BABEL_LANGUAGES'] = list(map(lambda s: s.strip(), langs.split(',')))
     app.config['BABEL_TRANSLATION_DIRECTORIES'] = 'i18n'
-    app.config['LDAP_READONLY'] = False
-    # XXX: Since we use ldap3 ObjectDef (which needs a LDAP class), we make this option computed
-    user_ldap_filter = app.config.get('LDAP_USER_OBJECT_FILTER')
-    user_ldap_class = app.config['LDAP_USER_CLASS']
-    if user_ldap_filter is None:
-        app.config['LDAP_USER_OBJECT_FILTER'] = '(objectClass={0})'.format(user_ldap_class)
-    elif 'objectClass' not in user_ldap_filter:
-        app.config['LDAP_USER_OBJECT_FILTER'] = '(&(objectClass={0}){1})'.format(user_ldap_class,
-                                                                                 user_ldap_filter)
-    else:
-        assert user_ldap_class in user_ldap_filter, ('Looks like there is an inconsistency between '
-                                                     'options LDAP_USER_OBJECT_FILTER and '
-                                                     'LDAP_USER_CLASS')
+    ldap_storage = app.config.setdefault('STORAGE_BACKEND', 'ldap') == 'ldap'
+    if ldap_storage:
+        app.config['LDAP_READONLY'] = False
+        # flask-ldap3-login looks people up with its own options
+        app.config.setdefault('LDAP_USER_LOGIN_ATTR',
+                              app.config.get('LDAP_USER_LOGIN_ATTRIBUTE', 'uid'))
+        app.config.setdefault('LDAP_USER_RDN_ATTR',
+                              app.config.get('LDAP_USER_RDN_ATTRIBUTE', 'uid'))
+        # XXX: Since we use ldap3 ObjectDef (which needs a LDAP class), we make this option computed
+        user_ldap_filter = app.config.get('LDAP_USER_OBJECT_FILTER')
+        user_ldap_class = app.config['LDAP_USER_CLASS']
+        if user_ldap_filter is None:
+            app.config['LDAP_USER_OBJECT_FILTER'] = '(objectClass={0})'.format(user_ldap_class)
+        elif 'objectClass' not in user_ldap_filter:
+            app.config['LDAP_USER_OBJECT_FILTER'] = '(&(objectClass={0}){1})'.format(
+                user_ldap_class, user_ldap_filter
+            )
+        else:
+            assert user_ldap_class in user_ldap_filter, ('Looks like there is an inconsistency '
+                                                         'between options LDAP_USER_OBJECT_FILTER '
+                                                         'and LDAP_USER_CLASS')
     for blueprint in blueprints:
         app.register_blueprint(blueprint)
     babel.init_app(app)
     csrf.init_app(app)
-    ldap_manager.init_app(app)
+    if ldap_storage:
+        ldap_manager.init_app(app)
+    app.password_hasher = create_password_hasher(app)
+    app.people_backend = create_people_backend(app)
+    # Directory specific features (bulk import and export) are only available with LDAP storage
+    app.ldap_backend = app.people_backend if ldap_storage else None
+    app.rate_limiter = create_rate_limiter(app)
+    app.activation_digest = create_activation_digest(app)
     login_manager.init_app(app)
     celery.init_app(app)
     # Register views, handlers and cli commands
     app.route('/')(home_view)
+    app.route('/metrics')(metrics_view)
     app.errorhandler(403)(forbidden_handler)
     app.errorhandler(404)(page_not_found_handler)
     app.errorhandler(500)(internal_error_handler)
+    app.errorhandler(HashingError)(service_unavailable_handler)
+    app.errorhandler(RateLimitExceeded)(too_many_requests_handler)
     return app
 
 
@@ -0,0 +1,92 @@
+"""Asyncio front end to the LDAP backend for people."""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+
+
+# Running loop of the calling coroutine (get_event_loop() returns it too before Python 3.7)
+_running_loop = getattr(asyncio, 'get_running_loop', asyncio.get_event_loop)
+
+
+class AsyncLDAPBackend(object):
+    """Give access to an ``LDAPBackend`` from asyncio code.
+
+    Methods are coroutines with the same names and parameters as the ``LDAPBackend`` ones, except
+    that they take no ``ldap_conn`` parameter: ldap3 only provides blocking strategies, so each
+    operation checks out a connection from the backend pool and runs in a thread of an executor
+    sized like the pool. Any number of coroutines can thus await directory operations, while at
+    most ``LDAP_POOL_MAX_SIZE`` operations hit the server at the same time. Lookups use the pool
+    of the read servers and writes the pool of the write servers.
+    """
+
+    def __init__(self, ldap_backend, executor=None):
+        self._backend = ldap_backend
+        self._executor = executor or ThreadPoolExecutor(max_workers=ldap_backend.pool.max_size)
+
+    @property
+    def backend(self):
+        """Return the ``LDAPBackend`` instance wrapped by this backend."""
+        return self._backend
+
+    def close(self):
+        """Wait for pending operations and release executor threads."""
+        self._executor.shutdown(wait=True)
+
+    async def _run(self, method, *args, read=False, **kwargs):
+        """Call the given ``LDAPBackend`` method with a pooled connection (to the read servers if
+        ``read`` is ``True``) in the executor."""
+        loop = _running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(self._call, method, read, *args, **kwargs)
+        )
+
+    def _call(self, method, read, *args, **kwargs):
+        with self._backend.admin_connection(read=read) as ldap_conn:
+            return method(*args, ldap_conn=ldap_conn, **kwargs)
+
+    async def username_exists(self, username):
+        """Return ``True`` if there is a person with the given username in the LDAP directory."""
+        return await self._run(self._backend.username_exists, username, read=True)
+
+    async def email_exists(self, email):
+        """Return ``True`` if there is a person with the given email address in the LDAP
+        directory."""
+        return await self._run(self._backend.email_exists, email, read=True)
+
+    async def existing_attributes(self, **values):
+        """Return the ``set`` of person attribute names (among ``username`` and ``email``) whose
+        given value is already used by a person in the LDAP directory."""
+        return await self._run(self._backend.existing_attributes, **values, read=True)
+
+    async def person_by_username(self, username):
+        """Return a ``Person`` instance with the given username.
+
+        Raise an error if no person is found with this username."""
+        return await self._run(self._backend.person_by_username, username, read=True)
+
+    async def person_by_email(self, email):
+        """Return a ``Person`` instance with the given email address.
+
+        Raise an error if no person is found with this email address."""
+        return await self._run(self._backend.person_by_email, email, read=True)
+
+    async def add_person(self, person, rdn_attr='uid'):
+        """Add the given person in the LDAP directory."""
+        return await self._run(self._backend.add_person, person, rdn_attr=rdn_attr)
+
+    async def update_person(self, person):
+        """Update the given person in the LDAP directory."""
+        return await self._run(self._backend.update_person, person)
+
+    async def is_active(self, user_dn):
+        """Return ``True`` if the person with the given DN is an occupant of the active role."""
+        return await self._run(self._backend.is_active, user_dn, read=True)
+
+    async def activate(self, user_dn):
+        """Make the person with the given DN an occupant of the active role."""
+        return await self._run(self._backend.activate, user_dn)
+
+    async def deactivate(self, user_dn):
+        """Remove the person with the given DN from the occupants of the active role."""
+        return await self._run(self._backend.deactivate, user_dn)
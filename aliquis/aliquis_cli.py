@@ -1,12 +1,20 @@
 """Aliquis command line commands."""
 
+import csv
+import gzip
+import io
 import os
 import subprocess
+import sys
 
 from babel.messages.frontend import CommandLineInterface as BabelCLI
 import click
 
 from aliquis import create_app, read_config
+from aliquis.bulk import (EXPORT_FORMATS, IMPORT_FORMATS, export_people as _export_people,
+                          import_people as _import_people, read_rows)
+from aliquis.hashing import HASH_SCHEMES, calibrate as _calibrate, configurable_schemes
+from aliquis.ldap import LDAP_ATTR_MAPPING
 import aliquis
 
 
@@ -87,3 +95,106 @@ def build_js_client():
                            'run',
                            'build'])
     click.echo('-> Vue.js client succesfully built.')
+
+
+@app.cli.command()
+@click.option('--scheme', type=click.Choice(configurable_schemes()), default=None,
+              help='Password hashing scheme (the configured one by default).')
+@click.option('--target-ms', type=int, default=250,
+              help='Time hashing a password should take on this host, in milliseconds.')
+@click.option('--samples', type=int, default=5,
+              help='Number of hashes timed for each tried parameter.')
+def calibrate(scheme, target_ms, samples):
+    """Find the cost parameters of a password hashing scheme making a hash take about the
+    target time on this host, and print the matching configuration options."""
+    scheme = scheme or app.config['PASSWORD_HASH_SCHEME']
+    if not HASH_SCHEMES[scheme].available:
+        raise click.UsageError('the {0} scheme needs a library which is not installed'.format(
+            scheme
+        ))
+    click.echo('-> Calibrating {0} for {1} ms...'.format(scheme, target_ms), err=True)
+    params = _calibrate(scheme, target_ms / 1000.0, samples=samples)
+    click.echo('PASSWORD_HASH_SCHEME = {0}'.format(scheme))
+    for param, (option, _) in HASH_SCHEMES[scheme].options.items():
+        click.echo('{0} = {1}'.format(option, params[param]))
+
+
+def _ldap_backend():
+    """Return the LDAP backend of the app, or exit if people are not stored in LDAP."""
+    if app.ldap_backend is None:
+        raise click.UsageError('this command needs people to be stored in LDAP (STORAGE_BACKEND '
+                               'option)')
+    return app.ldap_backend
+
+
+@app.cli.command(name='import-people')
+@click.argument('source', type=click.File('r'))
+@click.option('--format', 'fmt', type=click.Choice(IMPORT_FORMATS), default=None,
+              help='Format of SOURCE (guessed from its extension by default).')
+@click.option('--report', type=click.File('w'), default='-',
+              help='CSV file where to write the result of each row (standard output by default).')
+@click.option('--batch-size', type=int, default=None,
+              help='Number of people checked with each LDAP search.')
+@click.option('--workers', type=int, default=None,
+              help='Number of LDAP connections used to add people.')
+@click.option('--processes', type=int, default=None,
+              help='Number of processes hashing passwords (one per CPU by default).')
+def import_people(source, fmt, report, batch_size, workers, processes):
+    """Add people read from SOURCE, a CSV or JSON lines file (``-`` for standard input) whose
+    keys are person attribute names, into the LDAP directory."""
+    if fmt is None:
+        fmt = os.path.splitext(source.name)[1].lstrip('.').lower()
+        if fmt not in IMPORT_FORMATS:
+            raise click.BadParameter('cannot guess format, use --format', param_hint='SOURCE')
+    writer = csv.writer(report)
+    writer.writerow(['line', 'username', 'status', 'message'])
+    counts = dict()
+    for result in _import_people(_ldap_backend(), read_rows(source, fmt), processes=processes,
+                                 batch_size=batch_size, workers=workers):
+        writer.writerow(result)
+        counts[result.status] = counts.get(result.status, 0) + 1
+    click.echo('-> {0}'.format(', '.join('{0} {1}'.format(count, status)
+                                         for status, count in sorted(counts.items())) or
+                               'Nothing to import'),
+               err=True)
+
+
+@app.cli.command(name='export-people')
+@click.argument('output', type=click.Path(dir_okay=False, allow_dash=True), default='-')
+@click.option('--format', 'fmt', type=click.Choice(EXPORT_FORMATS), default='ldif',
+              help='Output format.')
+@click.option('--gzip', 'compress', is_flag=True, default=False,
+              help='Compress output with gzip (default if OUTPUT ends with .gz).')
+@click.option('--attributes', default=None,
+              help='Comma separated person attributes to export (all by default).')
+@click.option('--since', type=click.DateTime(), default=None,
+              help='Only export people modified since this date (UTC).')
+@click.option('--page-size', type=int, default=None,
+              help='Number of people fetched with each LDAP request.')
+def export_people(output, fmt, compress, attributes, since, page_size):
+    """Write people of the LDAP directory to OUTPUT (standard output by default), as LDIF or JSON
+    lines, without holding them all in memory."""
+    ldap_backend = _ldap_backend()
+    if attributes is not None:
+        attributes = [attr.strip() for attr in attributes.split(',') if attr.strip()]
+        unknown = set(attributes) - set(LDAP_ATTR_MAPPING)
+        if unknown:
+            raise click.BadParameter('unknown attributes: {0}'.format(', '.join(sorted(unknown))),
+                                     param_hint='--attributes')
+    compress = compress or output.endswith('.gz')
+    raw = sys.stdout.buffer if output == '-' else open(output, 'wb')
+    binary = gzip.GzipFile(fileobj=raw, mode='wb') if compress else raw
+    stream = io.TextIOWrapper(binary, encoding='utf-8', newline='\n')
+    try:
+        count = _export_people(ldap_backend, stream, fmt, attributes=attributes, since=since,
+                               page_size=page_size)
+    finally:
+        stream.flush()
+        stream.detach()  # Closing the wrapper would close standard output
+        if compress:
+            binary.close()
+        if raw is sys.stdout.buffer:
+            raw.flush()
+        else:
+            raw.close()
+    click.echo('-> {0} people exported.'.format(count), err=True)
@@ -33,18 +33,41 @@ def send_email_confirm_email(person_dict, token_url, when='sign-up'):
 
 @celery.task
 def send_activation_notification(person_dict):
+    """Notify the account manager of the activation of the given person, right away or in the
+    next digest of activations if enabled."""
+    digest = getattr(current_app, 'activation_digest', None)
+    if digest is not None:
+        digest.add(person_dict)
+    else:
+        send_activation_digest([person_dict])
+
+
+@celery.task
+def flush_activation_digest():
+    """Notify the account manager of the activations waiting in the digest, if any."""
+    digest = getattr(current_app, 'activation_digest', None)
+    if digest is not None:
+        digest.flush()
+
+
+def send_activation_digest(people):
+    """Notify the account manager of the activation of the given people (``dict``), in a single
+    mail."""
     lang = str(get_locale() or 'fr')[:2]
     templates = dict(
         (ftype,
          'sign/notif-account-activated.{lang}.{ftype}'.format(lang=lang, ftype=ftype))
         for ftype in ('html', 'txt')
     )
-    subject = _("%(display_name)s has created or reactivated his/her ANA account",
-                display_name=person_dict['display_name'])
+    if len(people) == 1:
+        subject = _("%(display_name)s has created or reactivated his/her ANA account",
+                    display_name=people[0]['display_name'])
+    else:
+        subject = _("%(num)s ANA accounts have been created or reactivated", num=len(people))
     send_sendgrid_email(
         recipient=Contact(current_app.config['NOTIFICATION_TO_NAME'],
                           current_app.config['NOTIFICATION_TO_EMAIL']),
         subject=subject,
-        html_content=render_template(templates['html'], **person_dict),
-        txt_content=render_template(templates['txt'], **person_dict)
+        html_content=render_template(templates['html'], people=people),
+        txt_content=render_template(templates['txt'], people=people)
     )
@@ -0,0 +1,48 @@
+"""Probabilistic set of strings, to answer most membership questions without the LDAP server."""
+
+import hashlib
+import math
+import struct
+import threading
+
+
+class BloomFilter(object):
+    """A Bloom filter of strings.
+
+    A value which was added is always reported as a member, while a value which was not added is
+    reported as a member with probability ``error_rate`` at most, as long as no more than
+    ``capacity`` values were added. Values cannot be removed.
+    """
+
+    def __init__(self, capacity=100000, error_rate=0.01):
+        if capacity < 1 or not 0 < error_rate < 1:
+            raise ValueError('Invalid Bloom filter parameters: capacity={0}, '
+                             'error_rate={1}'.format(capacity, error_rate))
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hash_count = max(1, int(round(self.size / float(capacity) * math.log(2))))
+        self._bits = bytearray((self.size + 7) // 8)
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def _positions(self, value):
+        """Return the bit positions of the given value (double hashing of a single digest)."""
+        digest = hashlib.blake2b(value.encode('utf-8'), digest_size=16).digest()
+        h1, h2 = struct.unpack('<QQ', digest)
+        h2 |= 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    def add(self, value):
+        """Add the given value to the filter."""
+        positions = self._positions(value)
+        with self._lock:
+            for pos in positions:
+                self._bits[pos >> 3] |= 1 << (pos & 7)
+            self.count += 1
+
+    def __contains__(self, value):
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(value))
+
+    def __len__(self):
+        return self.count
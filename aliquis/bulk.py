@@ -0,0 +1,211 @@
+"""Bulk import and export of people."""
+
+from base64 import b64encode
+from collections import deque, namedtuple
+import csv
+from datetime import timezone
+import functools
+import json
+import os
+
+from ldap3.core.exceptions import LDAPEntryAlreadyExistsResult, LDAPOperationResult
+from ldap3.protocol.rfc2849 import safe_ldif_string
+
+from aliquis.hashing import HASH_SCHEMES, PasswordHasher, _current_hasher, identify_scheme
+from aliquis.ldap import LDAP_ATTR_MAPPING, _chunks, _person_from_ldap_entry
+from aliquis.metrics import call_site
+from aliquis.person import person as new_person
+
+
+ImportResult = namedtuple('ImportResult', ['line', 'username', 'status', 'message'])
+
+IMPORT_FORMATS = ('csv', 'jsonl')
+
+EXPORT_FORMATS = ('ldif', 'jsonl')
+
+# Attributes needed to build a Person instance, hence always requested on export
+REQUIRED_ATTRIBUTES = ('first_name', 'surname', 'username')
+
+# Number of rows sent at once to each process hashing passwords
+HASH_CHUNK_SIZE = 64
+
+
+def read_rows(stream, fmt):
+    """Yield ``(line number, row)`` tuples read from the given text stream, in the given format
+    (``csv`` or ``jsonl``), one row at a time.
+
+    A row is a ``dict`` whose keys are ``Person`` attribute names. CSV streams must start with a
+    header line and blank JSON lines are skipped."""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    elif fmt == 'jsonl':
+        for line_num, line in enumerate(stream, 1):
+            if line.strip():
+                yield line_num, json.loads(line)
+    else:
+        raise ValueError(u'Unknown import format: {0}'.format(fmt))
+
+
+def _person_from_row(scheme_name, params, numbered_row):
+    """Return a ``(line number, person, error message)`` tuple for the given numbered row, its
+    clear text password being hashed with the given scheme (name) and parameters.
+
+    This is where passwords are hashed, so that it runs in worker processes. The scheme is given
+    explicitly, since worker processes must not use the hasher of an app (which would start
+    processes of its own)."""
+    line_num, row = numbered_row
+    values = dict((attr, value) for attr, value in row.items()
+                  if attr in LDAP_ATTR_MAPPING and value not in (None, ''))
+    try:
+        password = values.get('password')
+        if password is not None and identify_scheme(str(password)) is None:
+            values['password'] = HASH_SCHEMES[scheme_name].hash(str(password), **params)
+        return line_num, new_person(**values), None
+    except (TypeError, ValueError) as err:
+        return line_num, None, str(err)
+
+
+def people_from_rows(numbered_rows, processes=None):
+    """Yield a ``(line number, person, error message)`` tuple for each of the given numbered rows,
+    in the same order, ``person`` being ``None`` if the row is invalid.
+
+    Rows are turned into ``Person`` instances (and passwords hashed with the scheme and parameters
+    of the password hasher of the current app, if any) by ``processes`` worker processes (one per
+    CPU by default, none if 1), a bounded number of rows at a time."""
+    processes = processes or os.cpu_count() or 1
+    app_hasher = _current_hasher()
+    from_row = functools.partial(_person_from_row, app_hasher.scheme.name,
+                                 dict(app_hasher.params))
+    with PasswordHasher(processes=0 if processes == 1 else processes) as hasher:
+        for chunk in _chunks(numbered_rows, HASH_CHUNK_SIZE * processes):
+            for result in hasher.map(from_row, chunk, chunksize=HASH_CHUNK_SIZE):
+                yield result
+
+
+def _error_message(error):
+    """Return a short message describing the given LDAP error."""
+    if isinstance(error, LDAPOperationResult):
+        return error.message or error.description or str(error)
+    return str(error)
+
+
+def import_people(ldap_backend, numbered_rows, processes=None, batch_size=None, workers=None):
+    """Add people described by the given numbered rows (see ``read_rows()``) in the LDAP directory
+    of the given ``LDAPBackend``.
+
+    Yield an ``ImportResult`` for each row, whose status is ``added``, ``invalid`` (the row does
+    not describe a valid person), ``exists`` (username or email address already used) or
+    ``error``."""
+    pending = deque()  # Line numbers of valid rows given to the backend
+    invalid = deque()
+
+    def valid_people():
+        for line_num, person, message in people_from_rows(numbered_rows, processes):
+            if person is None:
+                invalid.append(ImportResult(line_num, None, 'invalid', message))
+            else:
+                pending.append(line_num)
+                yield person
+
+    for person, error in ldap_backend.add_people(valid_people(), batch_size=batch_size,
+                                                 workers=workers):
+        while invalid:
+            yield invalid.popleft()
+        if error is None:
+            status = 'added'
+        elif isinstance(error, LDAPEntryAlreadyExistsResult):
+            status = 'exists'
+        else:
+            status = 'error'
+        message = '' if error is None else _error_message(error)
+        yield ImportResult(pending.popleft(), person.username, status, message)
+    while invalid:
+        yield invalid.popleft()
+
+
+def _generalized_time(moment):
+    """Return the given ``datetime`` as an LDAP generalized time (naive values are UTC)."""
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc)
+    return moment.strftime('%Y%m%d%H%M%SZ')
+
+
+def iter_people(ldap_backend, ldap_conn, attributes=None, since=None, page_size=None):
+    """Yield a ``(DN, person)`` tuple for each person of the LDAP directory of the given
+    ``LDAPBackend``, one page of entries at a time.
+
+    If given, ``attributes`` are the names of the person attributes to fetch (attributes needed to
+    build a person are always fetched) and ``since`` is a ``datetime`` before which unmodified
+    people are skipped."""
+    attributes = list(LDAP_ATTR_MAPPING) if attributes is None else attributes
+    ldap_attrs = sorted(set(LDAP_ATTR_MAPPING[attr]
+                            for attr in list(REQUIRED_ATTRIBUTES) + list(attributes)))
+    ldap_filter = None
+    if since is not None:
+        ldap_filter = '(modifyTimestamp>={0})'.format(_generalized_time(since))
+    for entry in ldap_backend.entries(ldap_conn, ldap_backend._person_class,
+                                      ldap_backend._people_basedn, ldap_filter,
+                                      page_size=page_size, attributes=ldap_attrs):
+        yield entry.entry_dn, _person_from_ldap_entry(entry)
+
+
+def _person_values(person, attributes):
+    """Return a ``dict`` of the given attributes of the given person which have a value."""
+    values = dict()
+    for attr in attributes:
+        value = getattr(person, attr, None)
+        if value is not None:
+            values[attr] = value
+    return values
+
+
+def _ldif_line(ldap_attr, value):
+    """Return the LDIF line for the given attribute value, base64 encoding it if needed."""
+    value = value.encode('utf-8')
+    if safe_ldif_string(value):
+        return u'{0}: {1}\n'.format(ldap_attr, value.decode('ascii'))
+    return u'{0}:: {1}\n'.format(ldap_attr, b64encode(value).decode('ascii'))
+
+
+def _write_ldif(stream, dn, person, attributes, object_class):
+    """Write the given person as an LDIF record."""
+    stream.write(_ldif_line('dn', dn))
+    stream.write(_ldif_line('objectClass', object_class))
+    stream.write(_ldif_line('cn', u'{0} {1}'.format(person.first_name, person.surname)))
+    for attr, value in sorted(_person_values(person, attributes).items()):
+        if attr == 'password':
+            value = u'{{CRYPT}}{0}'.format(value)
+        for single_value in value if isinstance(value, list) else [value]:
+            stream.write(_ldif_line(LDAP_ATTR_MAPPING[attr], single_value))
+    stream.write(u'\n')
+
+
+def _write_json_line(stream, dn, person, attributes, object_class):
+    """Write the given person as a JSON line, in the format read by ``import_people()``."""
+    stream.write(json.dumps(_person_values(person, attributes), ensure_ascii=False,
+                            sort_keys=True))
+    stream.write(u'\n')
+
+
+@call_site
+def export_people(ldap_backend, stream, fmt, attributes=None, since=None, page_size=None):
+    """Write people of the LDAP directory of the given ``LDAPBackend`` to the given text stream in
+    the given format (``ldif`` or ``jsonl``), and return the number of written people.
+
+    People are written as they are fetched, one page at a time, so that memory use does not
+    depend on the directory size. JSON lines can be imported back with ``import_people()``. See
+    ``iter_people()`` for ``attributes`` and ``since``."""
+    writers = {'ldif': _write_ldif, 'jsonl': _write_json_line}
+    if fmt not in writers:
+        raise ValueError(u'Unknown export format: {0}'.format(fmt))
+    attributes = list(LDAP_ATTR_MAPPING) if attributes is None else attributes
+    if fmt == 'ldif':
+        stream.write(u'version: 1\n\n')
+    count = 0
+    with ldap_backend.admin_connection() as ldap_conn:
+        for dn, person in iter_people(ldap_backend, ldap_conn, attributes, since, page_size):
+            writers[fmt](stream, dn, person, attributes, ldap_backend._person_class)
+            count += 1
+    return count
@@ -0,0 +1,79 @@
+"""In-process caches shared by the requests served by a worker."""
+
+from collections import OrderedDict
+import threading
+import time
+
+
+class LRUCache(object):
+    """A thread-safe cache bounded by entry count.
+
+    When full, the least recently used entry is evicted. Entries also expire ``ttl`` seconds after
+    being set. A ``maxsize`` of 0 disables the cache.
+
+    Hits, misses, evictions (entries dropped to make room) and expirations are counted and
+    available through the ``stats`` property.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expiration time, value), least recently used first
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        """Return the value cached for the given key, or ``default`` if the key is not cached or
+        has expired."""
+        with self._lock:
+            try:
+                expires, value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Cache the given value for the given key."""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, key):
+        """Remove the given key from the cache if it is cached."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def stats(self):
+        """Return a ``dict`` with cache counters and current size."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'size': len(self._entries),
+        }
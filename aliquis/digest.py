@@ -0,0 +1,150 @@
+"""Digests of account activations, notified to the account manager in a single mail."""
+
+from configparser import ParsingError
+import json
+import logging
+import threading
+
+import redis
+
+
+# Digest storages, by name
+DIGEST_STORAGES = ('memory', 'redis')
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryDigestStore(object):
+    """Activations waiting to be notified, kept by the current process."""
+
+    def __init__(self):
+        self._items = []
+        self._lock = threading.Lock()
+
+    def add(self, item):
+        """Add the given item (a JSON serializable ``dict``) and return the number of waiting
+        items."""
+        with self._lock:
+            self._items.append(item)
+            return len(self._items)
+
+    def take_all(self):
+        """Remove the waiting items and return them, oldest first."""
+        with self._lock:
+            items, self._items = self._items, []
+        return items
+
+    def put_back(self, items):
+        """Put the given items, taken but not notified, back before the waiting ones."""
+        with self._lock:
+            self._items[:0] = items
+
+
+class RedisDigestStore(object):
+    """Activations waiting to be notified, kept in a list of the Redis server at the given URL
+    (e.g. the Celery broker), shared by all processes."""
+
+    def __init__(self, url, key='aliquis:activation-digest'):
+        self.key = key
+        self._redis = redis.Redis.from_url(url, socket_timeout=5)
+
+    def add(self, item):
+        """Add the given item (a JSON serializable ``dict``) and return the number of waiting
+        items."""
+        return self._redis.rpush(self.key, json.dumps(item))
+
+    def take_all(self):
+        """Remove the waiting items and return them, oldest first."""
+        pipeline = self._redis.pipeline(transaction=True)
+        pipeline.lrange(self.key, 0, -1)
+        pipeline.delete(self.key)
+        items, _ = pipeline.execute()
+        return [json.loads(item) for item in items]
+
+    def put_back(self, items):
+        """Put the given items, taken but not notified, back before the waiting ones."""
+        if items:
+            self._redis.lpush(self.key, *[json.dumps(item) for item in reversed(items)])
+
+
+class ActivationDigest(object):
+    """Gather activations to notify them with ``send``, a callable taking the list of the
+    activated people (as ``dict``), at most ``interval`` seconds after the first of them or as soon
+    as ``size`` of them are waiting.
+
+    ``schedule`` is a callable taking a delay in seconds, after which ``flush()`` must be called.
+    """
+
+    def __init__(self, store, send, schedule, interval=300, size=100):
+        self.store = store
+        self.send = send
+        self.schedule = schedule
+        self.interval = interval
+        self.size = size
+
+    def add(self, person_dict):
+        """Add the given activated person to the digest."""
+        waiting = self.store.add(person_dict)
+        if waiting >= self.size:
+            self.schedule(0)
+        elif waiting == 1:
+            self.schedule(self.interval)
+
+    def flush(self):
+        """Notify the waiting activations, if any.
+
+        If they cannot be sent, they are put back in the digest and another flush is scheduled
+        after the interval, then the error is raised."""
+        people = self.store.take_all()
+        if people:
+            try:
+                self.send(people)
+            except Exception:
+                self.store.put_back(people)
+                self.schedule(self.interval)
+                raise
+
+
+def _timer_schedule(app, digest):
+    """Return a callable flushing the given digest of the given app in a thread of the current
+    process, after a given delay."""
+    def flush():
+        with app.app_context():
+            try:
+                digest.flush()
+            except Exception:
+                logger.exception('Cannot send the digest of account activations')
+
+    def schedule(delay):
+        timer = threading.Timer(delay, flush)
+        timer.daemon = True
+        timer.start()
+    return schedule
+
+
+def create_activation_digest(app):
+    """Return the digest of activations of the given Flask application, configured by its
+    ``NOTIFICATION_DIGEST_*`` options, or ``None`` if activations are notified one by one."""
+    # Tasks import the app package, hence late imports
+    from aliquis.background_tasks import flush_activation_digest, send_activation_digest
+    config = app.config
+    interval = config.setdefault('NOTIFICATION_DIGEST_INTERVAL', 0)
+    size = config.setdefault('NOTIFICATION_DIGEST_SIZE', 100)
+    storage = config.setdefault('NOTIFICATION_DIGEST_STORAGE', 'memory')
+    if not interval:
+        return None
+    if storage == 'memory':
+        digest = ActivationDigest(MemoryDigestStore(), send_activation_digest, None, interval,
+                                  size)
+        digest.schedule = _timer_schedule(app, digest)
+    elif storage == 'redis':
+        store = RedisDigestStore(config.setdefault('NOTIFICATION_DIGEST_REDIS_URL',
+                                                   config.get('CELERY_BROKER_URL')))
+        digest = ActivationDigest(
+            store, send_activation_digest,
+            lambda delay: flush_activation_digest.apply_async(countdown=delay), interval, size
+        )
+    else:
+        raise ParsingError("Invalid value for option 'NOTIFICATION_DIGEST_STORAGE' in "
+                           'configuration. Expected: {values}'.format(values=DIGEST_STORAGES))
+    return digest
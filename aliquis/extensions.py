@@ -7,10 +7,27 @@ from flask_ldap3_login import LDAP3LoginManager
 from flask_login import LoginManager
 from flask_wtf.csrf import CSRFProtect
 
+
+class LDAPLoginManager(LDAP3LoginManager):
+    """flask-ldap3-login manager whose own connections (e.g. to bind people logging in) are
+    instrumented like the connections of the LDAP backend."""
+
+    def _make_connection(self, bind_user=None, bind_password=None, contextualise=True, app=None,
+                         **kwargs):
+        connection = super(LDAPLoginManager, self)._make_connection(
+            bind_user=bind_user, bind_password=bind_password, contextualise=contextualise, app=app,
+            **kwargs
+        )
+        metrics = getattr(getattr(app or current_app, 'ldap_backend', None), 'metrics', None)
+        if metrics is not None:
+            metrics.instrument(connection)
+        return connection
+
+
 babel = Babel()
 celery = Celery()
 csrf = CSRFProtect()
-ldap_manager = LDAP3LoginManager()
+ldap_manager = LDAPLoginManager()
 login_manager = LoginManager()
 
 
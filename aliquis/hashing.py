@@ -0,0 +1,513 @@
+"""Hashing of passwords, with pluggable schemes, off the threads serving requests."""
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from configparser import ParsingError
+from crypt import crypt
+from hmac import compare_digest as compare_hash
+import functools
+import logging
+import os
+import random
+import re
+import string
+import threading
+import time
+
+from flask import current_app, has_app_context
+
+try:
+    import bcrypt
+except ImportError:  # Optional dependency
+    bcrypt = None
+
+try:
+    from argon2 import PasswordHasher as Argon2Hasher, Type as Argon2Type
+    from argon2.exceptions import InvalidHash as Argon2InvalidHash, VerificationError
+except ImportError:  # Optional dependency
+    Argon2Hasher = None
+
+
+# Characters of crypt() salts
+SALT_CHARS = string.ascii_letters + string.digits + './'
+
+_random = random.SystemRandom()
+
+logger = logging.getLogger(__name__)
+
+
+class HashingError(Exception):
+    """Base class of the errors raised when a password cannot be hashed in time."""
+
+
+class HasherBusyError(HashingError):
+    """Raised when too many passwords are already waiting to be hashed."""
+
+
+class HashingTimeoutError(HashingError):
+    """Raised when a password is not hashed before the timeout of the hasher."""
+
+
+class HashScheme(object):
+    """A password hashing scheme, whose cost is tuned by parameters.
+
+    ``options`` maps each parameter name to the configuration option setting it and its default
+    value. ``prefixes`` are the prefixes of the hashes of the scheme.
+    """
+
+    name = None
+    prefixes = ()
+    options = OrderedDict()
+    crypt_hashes = True  # Whether ``crypt()`` implementations may check hashes of the scheme
+
+    @property
+    def available(self):
+        """``True`` if the libraries needed by the scheme are installed."""
+        return True
+
+    def identify(self, hashed):
+        """Return ``True`` if the given hash was made with this scheme."""
+        return hashed.startswith(self.prefixes)
+
+    def hash(self, password, **params):
+        """Return a hash of the given clear text password, with a random salt."""
+        raise NotImplementedError
+
+    def verify(self, password, hashed):
+        """Return ``True`` if the given clear text password matches the given hash."""
+        raise NotImplementedError
+
+    def params(self, hashed):
+        """Return the ``dict`` of parameters the given hash was made with."""
+        raise NotImplementedError
+
+    def calibrate(self, target, timer):
+        """Return the ``dict`` of parameters making a hash take about ``target`` seconds, as
+        measured by ``timer``, a callable taking parameters and returning seconds."""
+        raise NotImplementedError
+
+    def _calibrate_linear(self, param, target, timer, probe, minimum, maximum):
+        """Calibrate a parameter the hashing time is proportional to, with a probe then a
+        correction."""
+        value = probe
+        for _ in range(2):
+            value = int(min(max(value * target / timer({param: value}), minimum), maximum))
+        return {param: value}
+
+
+class SHA512CryptScheme(HashScheme):
+    """SHA-512 ``crypt()`` (``$6$``), whose cost is its number of rounds."""
+
+    name = 'sha512_crypt'
+    prefixes = ('$6$',)
+    options = OrderedDict([('rounds', ('PASSWORD_HASH_ROUNDS', 5000))])
+
+    MIN_ROUNDS = 1000
+    MAX_ROUNDS = 999999999
+    DEFAULT_ROUNDS = 5000  # Of hashes whose salt does not tell
+    SALT_LENGTH = 16
+
+    _ROUNDS_REGEXP = re.compile(r'^\$6\$rounds=(\d+)\$')
+
+    def hash(self, password, rounds=DEFAULT_ROUNDS):
+        if not self.MIN_ROUNDS <= rounds <= self.MAX_ROUNDS:
+            raise ValueError('Invalid number of rounds: {0}'.format(rounds))
+        # Built by hand, since mksalt() only takes a number of rounds from Python 3.7
+        salt = ''.join(_random.choice(SALT_CHARS) for _ in range(self.SALT_LENGTH))
+        return crypt(password, '$6$rounds={0}${1}$'.format(rounds, salt))
+
+    def verify(self, password, hashed):
+        return compare_hash(hashed.encode('utf-8'),
+                            (crypt(password, hashed) or '').encode('utf-8'))
+
+    def params(self, hashed):
+        match = self._ROUNDS_REGEXP.match(hashed)
+        return {'rounds': int(match.group(1)) if match else self.DEFAULT_ROUNDS}
+
+    def calibrate(self, target, timer):
+        return self._calibrate_linear('rounds', target, timer, 50000, self.MIN_ROUNDS,
+                                      self.MAX_ROUNDS)
+
+
+class CryptScheme(SHA512CryptScheme):
+    """Other ``crypt()`` hashes (e.g. MD5 or SHA-256 ones), only verified, to be upgraded."""
+
+    name = 'crypt'
+    prefixes = ()
+    options = OrderedDict()
+
+    _CRYPT_REGEXP = re.compile(r'^\$\d\$[^$]+\$')
+
+    def identify(self, hashed):
+        return self._CRYPT_REGEXP.match(hashed) is not None
+
+    def hash(self, password, **params):
+        raise ValueError('Passwords cannot be hashed with the crypt scheme')
+
+    def params(self, hashed):
+        return {}
+
+
+class BcryptScheme(HashScheme):
+    """bcrypt (``$2b$``), whose cost is the base 2 logarithm of its number of rounds.
+
+    It needs the ``bcrypt`` package."""
+
+    name = 'bcrypt'
+    prefixes = ('$2a$', '$2b$', '$2y$')
+    options = OrderedDict([('cost', ('PASSWORD_HASH_BCRYPT_COST', 12))])
+
+    MIN_COST = 4
+    MAX_COST = 31
+
+    @property
+    def available(self):
+        return bcrypt is not None
+
+    def hash(self, password, cost=12):
+        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=cost)).decode('ascii')
+
+    def verify(self, password, hashed):
+        try:
+            return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('ascii'))
+        except ValueError:  # Malformed hash
+            return False
+
+    def params(self, hashed):
+        return {'cost': int(hashed.split('$')[2])}
+
+    def calibrate(self, target, timer):
+        # Each cost step doubles the hashing time: take the highest cost within the target
+        cost = self.MIN_COST
+        while cost < self.MAX_COST and timer({'cost': cost + 1}) <= target:
+            cost += 1
+        return {'cost': cost}
+
+
+class Argon2idScheme(HashScheme):
+    """Argon2id (``$argon2id$``), whose cost is its number of passes (time cost), memory (in KiB)
+    and parallelism.
+
+    It needs the ``argon2-cffi`` package."""
+
+    name = 'argon2id'
+    prefixes = ('$argon2id$',)
+    crypt_hashes = False
+    options = OrderedDict([
+        ('time_cost', ('PASSWORD_HASH_ARGON2_TIME_COST', 3)),
+        ('memory_cost', ('PASSWORD_HASH_ARGON2_MEMORY_COST', 65536)),
+        ('parallelism', ('PASSWORD_HASH_ARGON2_PARALLELISM', 4)),
+    ])
+
+    _PARAMS_REGEXP = re.compile(r'^\$argon2id\$(?:v=\d+\$)?m=(\d+),t=(\d+),p=(\d+)\$')
+
+    @property
+    def available(self):
+        return Argon2Hasher is not None
+
+    def hash(self, password, time_cost=3, memory_cost=65536, parallelism=4):
+        return Argon2Hasher(time_cost=time_cost, memory_cost=memory_cost,
+                            parallelism=parallelism, type=Argon2Type.ID).hash(password)
+
+    def verify(self, password, hashed):
+        try:
+            return Argon2Hasher().verify(hashed, password)
+        except (VerificationError, Argon2InvalidHash):
+            return False
+
+    def params(self, hashed):
+        match = self._PARAMS_REGEXP.match(hashed)
+        if match is None:
+            return {}
+        memory_cost, time_cost, parallelism = (int(value) for value in match.groups())
+        return {'time_cost': time_cost, 'memory_cost': memory_cost, 'parallelism': parallelism}
+
+    def calibrate(self, target, timer):
+        # Memory and parallelism keep their defaults, the number of passes is tuned
+        defaults = dict((param, default) for param, (_, default) in self.options.items())
+        params = self._calibrate_linear(
+            'time_cost', target, lambda params: timer(dict(defaults, **params)), 3, 1, 1000
+        )
+        return dict(defaults, **params)
+
+
+# Known schemes by name, in the order hashes are identified with
+HASH_SCHEMES = OrderedDict()
+
+
+def register_scheme(scheme):
+    """Make the given ``HashScheme`` instance available to hash and verify passwords."""
+    HASH_SCHEMES[scheme.name] = scheme
+    if CryptScheme.name in HASH_SCHEMES:
+        HASH_SCHEMES.move_to_end(CryptScheme.name)  # The catch-all scheme comes last
+
+
+for _scheme in (SHA512CryptScheme(), BcryptScheme(), Argon2idScheme(), CryptScheme()):
+    register_scheme(_scheme)
+
+
+def identify_scheme(hashed):
+    """Return the ``HashScheme`` the given hash was made with, or ``None`` if the given value is
+    not a known hash."""
+    for scheme in HASH_SCHEMES.values():
+        if scheme.identify(hashed):
+            return scheme
+    return None
+
+
+# Whether the current process is a worker process of a hasher, which hashes passwords itself
+_in_worker = False
+
+
+def _run_in_worker(func, *args):
+    """Return ``func(*args)``, flagging the current process as a worker process of a hasher (run
+    by worker processes).
+
+    The flag is set by each task rather than by a pool initializer, which Python 3.6 lacks."""
+    global _in_worker
+    _in_worker = True
+    return func(*args)
+
+
+def _hash(scheme_name, password, params):
+    """Return a hash of the given password with the given scheme and parameters (run by worker
+    processes)."""
+    return HASH_SCHEMES[scheme_name].hash(password, **params)
+
+
+def _verify(password, hashed):
+    """Return ``True`` if the given clear text password matches the given hash (run by worker
+    processes)."""
+    scheme = identify_scheme(hashed)
+    if scheme is None:
+        return False
+    if not scheme.available:
+        logger.warning('Cannot verify a password hashed with %s: missing library', scheme.name)
+        return False
+    return scheme.verify(password, hashed)
+
+
+class PasswordHasher(object):
+    """Hash passwords with the given scheme (name) and parameters (the defaults of the scheme by
+    default) in a pool of ``processes`` worker processes (one per CPU by default), so that hashing
+    passwords neither blocks the threads serving requests nor holds the GIL.
+
+    At most ``max_pending`` passwords (four per process by default) are queued or being hashed at
+    once: beyond, ``HasherBusyError`` is raised right away rather than making requests pile up.
+    Callers wait at most ``timeout`` seconds for a hash, then get a ``HashingTimeoutError``.
+
+    With 0 processes, or when called from a worker process of a hasher, passwords are hashed by the
+    calling thread. Processes are started on first use, so that a
+    hasher created before its process forks (e.g. by a preforking server) is not shared.
+    """
+
+    def __init__(self, processes=None, max_pending=None, timeout=5, scheme='sha512_crypt',
+                 params=None):
+        self.scheme = HASH_SCHEMES[scheme]
+        self.params = dict((param, default)
+                           for param, (_, default) in self.scheme.options.items())
+        self.params.update(params or {})
+        self.processes = (os.cpu_count() or 1) if processes is None else processes
+        self.max_pending = max_pending or 4 * max(self.processes, 1)
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+    @property
+    def inline(self):
+        """``True`` if passwords are hashed by the calling thread."""
+        return self.processes == 0 or _in_worker
+
+    @property
+    def executor(self):
+        """Return the pool of worker processes of the current process, started on first use."""
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.processes)
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def _run(self, func, *args):
+        """Return ``func(*args)``, computed by a worker process."""
+        if self.inline:
+            return func(*args)
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusyError('{0} passwords are already being hashed'.format(
+                self.max_pending
+            ))
+        try:
+            future = self.executor.submit(_run_in_worker, func, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        # The slot is given back once the hash is done, even if the caller stopped waiting
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise HashingTimeoutError('Password not hashed after {0} seconds'.format(
+                self.timeout
+            ))
+
+    def hash(self, password):
+        """Return a hash of the given clear text password, with the scheme and parameters of the
+        hasher."""
+        return self._run(_hash, self.scheme.name, password, self.params)
+
+    def verify(self, password, hashed):
+        """Return ``True`` if the given clear text password matches the given hash, whatever its
+        scheme."""
+        return self._run(_verify, password, hashed)
+
+    def needs_update(self, hashed):
+        """Return ``True`` if the given hash was made with another scheme or other parameters
+        than the ones of the hasher, so that it should be replaced by a new hash of the password
+        the next time it is known (e.g. at login)."""
+        if not hashed:
+            return False
+        scheme = identify_scheme(hashed)
+        if scheme is not self.scheme:
+            return True
+        params = scheme.params(hashed)
+        return any(params.get(param) != value for param, value in self.params.items())
+
+    def map(self, func, iterable, chunksize=1):
+        """Return an iterator of ``func(item)`` for each of the given items, in order, computed by
+        the worker processes ``chunksize`` items at a time.
+
+        This is meant for bulk work whose size is bounded by the caller, hence it is not limited
+        by ``max_pending``."""
+        if self.inline:
+            return map(func, iterable)
+        return self.executor.map(functools.partial(_run_in_worker, func), iterable,
+                                 chunksize=chunksize)
+
+    def shutdown(self, wait=True):
+        """Stop the worker processes (they are started again if needed)."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None and self._executor_pid == os.getpid():
+            executor.shutdown(wait=wait)
+
+
+def create_password_hasher(app):
+    """Return the password hasher of the given Flask application, configured by its
+    ``PASSWORD_HASH_*`` options."""
+    app.config.setdefault('PASSWORD_HASH_SCHEME', 'sha512_crypt')
+    app.config.setdefault('PASSWORD_HASH_PROCESSES', None)
+    app.config.setdefault('PASSWORD_HASH_QUEUE_SIZE', None)
+    app.config.setdefault('PASSWORD_HASH_TIMEOUT', 5)
+    name = app.config['PASSWORD_HASH_SCHEME']
+    scheme = HASH_SCHEMES.get(name)
+    if scheme is None or not scheme.options:
+        raise ParsingError("Invalid value for option 'PASSWORD_HASH_SCHEME' in configuration. "
+                           'Expected: {values}'.format(values=configurable_schemes()))
+    if not scheme.available:
+        raise ParsingError("Password hashing scheme '{0}' needs a library which is not "
+                           'installed'.format(name))
+    params = dict((param, app.config.setdefault(option, default))
+                  for param, (option, default) in scheme.options.items())
+    if app.config.get('STORAGE_BACKEND', 'ldap') == 'ldap':
+        # The directory checks {CRYPT} hashes at bind: a hash it cannot check locks its person out
+        if not scheme.crypt_hashes or not crypt_checks(scheme, params):
+            raise ParsingError("Password hashing scheme '{0}' is not supported by crypt(), which "
+                               'checks passwords stored in LDAP'.format(name))
+    return PasswordHasher(processes=app.config['PASSWORD_HASH_PROCESSES'],
+                          max_pending=app.config['PASSWORD_HASH_QUEUE_SIZE'],
+                          timeout=app.config['PASSWORD_HASH_TIMEOUT'], scheme=name, params=params)
+
+
+def crypt_checks(scheme, params):
+    """Return ``True`` if the ``crypt()`` of this host checks hashes of the given scheme made with
+    the given parameters."""
+    hashed = scheme.hash('aliquis', **params)
+    return crypt('aliquis', hashed) == hashed
+
+
+def configurable_schemes():
+    """Return the names of the schemes new passwords can be hashed with."""
+    return tuple(name for name, scheme in HASH_SCHEMES.items() if scheme.options)
+
+
+_inline_hasher = PasswordHasher(processes=0)
+
+
+def _current_hasher():
+    """Return the password hasher of the current app if any, else one hashing inline with
+    default parameters."""
+    hasher = getattr(current_app, 'password_hasher', None) if has_app_context() else None
+    return hasher if hasher is not None else _inline_hasher
+
+
+def hash_password(password):
+    """Return a hash of the given clear text password, made by the password hasher of the current
+    app if any."""
+    return _current_hasher().hash(password)
+
+
+def verify_password(password, hashed):
+    """Return ``True`` if the given clear text password matches the given hash, checked by the
+    password hasher of the current app if any."""
+    if not password or not hashed:
+        return False
+    return _current_hasher().verify(password, hashed)
+
+
+def calibrate(scheme_name, target, samples=5):
+    """Return the parameters of the given scheme making a hash take about ``target`` seconds on
+    this host (the median of ``samples`` hashes)."""
+    scheme = HASH_SCHEMES[scheme_name]
+
+    def timer(params):
+        durations = []
+        for _ in range(samples):
+            start = time.perf_counter()
+            scheme.hash('calibration', **params)
+            durations.append(time.perf_counter() - start)
+        return sorted(durations)[len(durations) // 2]
+
+    return scheme.calibrate(target, timer)
+
+
+def upgrade_password_in_background(app, username, password):
+    """Replace, in a background thread, the stored hash of the password of the person with the
+    given username by a new one if it uses an outdated scheme or parameters.
+
+    This is meant to be called once the person is authenticated with the given clear text
+    password. Return the thread."""
+    thread = threading.Thread(target=_upgrade_password, args=(app, username, password))
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def _upgrade_password(app, username, password):
+    """Replace the stored hash of the password of the person with the given username, if it
+    uses an outdated scheme or parameters.
+
+    Only the hash is written, and only if it is still the one read, so that neither a password
+    changed meanwhile nor other attributes are overwritten with stale values."""
+    with app.app_context():
+        try:
+            backend = app.people_backend
+            person = backend.get_person(username)
+            try:
+                hashed = person.password if person is not None else None
+            except AttributeError:  # No password
+                hashed = None
+            if not app.password_hasher.needs_update(hashed):
+                return
+            if not backend.replace_password_hash(username, hashed,
+                                                 app.password_hasher.hash(password)):
+                logger.info('Password of %s changed meanwhile, hash not upgraded', username)
+        except Exception:
+            logger.exception('Cannot upgrade the password hash of %s', username)
@@ -1,14 +1,30 @@
 """LDAP backend for people."""
 
+from concurrent.futures import ThreadPoolExecutor
 from configparser import ParsingError
 from contextlib import contextmanager
+import functools
+import logging
 import ssl
+import threading
+import time
 
-from ldap3 import ALL, Connection, MOCK_SYNC, OFFLINE_SLAPD_2_4, ObjectDef, Reader, Server, Writer
-from ldap3.core.exceptions import (LDAPCursorError, LDAPEntryAlreadyExistsResult,
-                                   LDAPNoSuchObjectResult)
+from flask import g, has_app_context, has_request_context, session
+from ldap3 import (ALL, ALL_ATTRIBUTES, Connection, MODIFY_ADD, MODIFY_DELETE, MOCK_SYNC,
+                   NO_ATTRIBUTES, OFFLINE_SLAPD_2_4, ObjectDef, Reader, Server, ServerPool, Writer)
+from ldap3.core.exceptions import (LDAPBindError, LDAPCursorError, LDAPEntryAlreadyExistsResult,
+                                   LDAPException, LDAPNoSuchObjectResult, LDAPOperationResult)
+from ldap3.core.results import (RESULT_ATTRIBUTE_OR_VALUE_EXISTS, RESULT_NO_SUCH_ATTRIBUTE,
+                                RESULT_NO_SUCH_OBJECT, RESULT_SUCCESS)
+from ldap3.utils.conv import escape_filter_chars
+from ldap3.utils.dn import escape_rdn
 
+from aliquis.bloom import BloomFilter
+from aliquis.cache import LRUCache
+from aliquis.ldap_pool import LDAPConnectionPool
+from aliquis.metrics import LDAPMetrics, call_site
 from aliquis.person import person as new_person
+from aliquis.storage import NoSuchPersonError, PeopleBackend, PersonAlreadyExistsError
 
 
 _OPT_MAPPING = {
@@ -30,6 +46,109 @@ LDAP_ATTR_MAPPING = {
 
 LDAP_ATTR_REV_MAPPING = dict((v, k) for k, v in LDAP_ATTR_MAPPING.items())
 
+# LDAP attributes requested by person lookups
+PERSON_ATTRIBUTES = sorted(LDAP_ATTR_MAPPING.values())
+
+PAGED_RESULTS_OID = '1.2.840.113556.1.4.319'
+
+# Session key holding the time until which reads of the session go to the write servers
+MASTER_PIN_SESSION_KEY = 'aliquis_ldap_master_until'
+
+# ObjectDef instances shared by all cursors of the process, keyed by (server, class, schema version)
+_OBJECT_DEFS = dict()
+_OBJECT_DEFS_LOCK = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+
+def _schema_version(schema):
+    """Return a hashable value identifying the version of the given server schema."""
+    if schema is None:
+        return None
+    version = schema.modify_time_stamp
+    return tuple(version) if isinstance(version, list) else version
+
+
+def object_def(search_class, ldap_conn):
+    """Return the ``ldap3.ObjectDef`` instance for the given LDAP class.
+
+    Definitions are built once per process for each server, class and schema version, so that
+    cursors do not walk the server schema on each request. A new schema version (as given by the
+    ``modifyTimestamp`` of the schema entry) makes the definition built again."""
+    server = ldap_conn.server
+    key = (server.name, search_class.lower(), _schema_version(server.schema))
+    definition = _OBJECT_DEFS.get(key)
+    if definition is not None:
+        return definition
+    definition = ObjectDef(search_class, ldap_conn)
+    with _OBJECT_DEFS_LOCK:
+        for old_key in [k for k in _OBJECT_DEFS if k[:2] == key[:2] and k != key]:
+            del _OBJECT_DEFS[old_key]
+        return _OBJECT_DEFS.setdefault(key, definition)
+
+
+def _operation_error(result):
+    """Return an ``LDAPOperationResult`` exception describing the given failed operation result."""
+    return LDAPOperationResult(result=result['result'], description=result['description'],
+                               dn=result['dn'], message=result['message'],
+                               response_type=result['type'])
+
+
+def _hosts(value):
+    """Return the list of hosts given in the given option value (comma separated string or
+    list)."""
+    if isinstance(value, str):
+        value = value.split(',')
+    return [host.strip() for host in value or [] if host.strip()]
+
+
+def ldap_server(hosts, port, use_ssl, get_info, strategy='ROUND_ROBIN'):
+    """Return an ``ldap3.Server`` for the given host, or an ``ldap3.ServerPool`` choosing among
+    the given hosts with the given strategy (``ROUND_ROBIN``, ``FIRST`` or ``RANDOM``).
+
+    Hosts are names or URLs, optionally with a port. The pool skips an unreachable server for a
+    minute."""
+    servers = [Server(host, port=port, use_ssl=use_ssl, get_info=get_info) for host in hosts]
+    if len(servers) == 1:
+        return servers[0]
+    return ServerPool(servers, pool_strategy=strategy.upper(), active=1, exhaust=60)
+
+
+def _taken_key(attr, value):
+    """Return the key of the given person attribute value in the filter of used values."""
+    return u'{0}:{1}'.format(attr, value.lower())
+
+
+def _chunks(iterable, size):
+    """Yield lists of at most ``size`` consecutive items from the given iterable."""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def invalidate_object_defs(server_name=None):
+    """Forget cached ``ldap3.ObjectDef`` instances of the given server (e.g.
+    ``ldap://localhost:389``), or of all servers if ``server_name`` is ``None``.
+
+    Call this after changing the schema of a server."""
+    with _OBJECT_DEFS_LOCK:
+        for key in [k for k in _OBJECT_DEFS if server_name is None or k[0] == server_name]:
+            del _OBJECT_DEFS[key]
+
+
+def _paged_cookie(result):
+    """Return the Simple Paged Results cookie of the given search result, or ``None`` if this
+    was the last page."""
+    control = result.get('controls', dict()).get(PAGED_RESULTS_OID)
+    if control is None:
+        return None
+    return control['value']['cookie'] or None
+
 
 def _person_from_ldap_entry(entry):
     """Return a ``Person`` instance from the given LDAP entry."""
@@ -39,6 +158,8 @@ def _person_from_ldap_entry(entry):
             ldap_value = getattr(entry, ldap_attr)
         except LDAPCursorError:
             continue
+        if ldap_value.value is None:
+            continue
         if attr == 'password':
             person_dict[attr] = ldap_value.value.decode('utf-8').replace('{CRYPT}', '')
         else:
@@ -46,14 +167,45 @@ def _person_from_ldap_entry(entry):
     return new_person(**person_dict)
 
 
-class LDAPBackend(object):
+def _person_from_user_info(user_info):
+    """Return a ``Person`` instance from the given user entry, as returned by
+    flask-ldap3-login."""
+    person_dict = dict()
+    for ldap_attr, attr in LDAP_ATTR_REV_MAPPING.items():
+        ldap_value = user_info.get(ldap_attr)
+        if isinstance(ldap_value, list):
+            ldap_value = ldap_value[0] if ldap_value else None  # Requested but without value
+        if ldap_value is None:
+            continue
+        if attr == 'password':
+            if isinstance(ldap_value, bytes):
+                ldap_value = ldap_value.decode('utf-8')
+            ldap_value = ldap_value.replace('{CRYPT}', '')
+        person_dict[attr] = ldap_value
+    return new_person(**person_dict)
+
+
+def _person_attributes(person):
+    """Return a ``dict`` of the LDAP attributes of a new entry of the given person."""
+    attributes = dict()
+    for attr, ldap_attr in LDAP_ATTR_MAPPING.items():
+        value = getattr(person, attr, None)
+        if value is not None:
+            if attr == 'password':
+                value = '{{CRYPT}}{0}'.format(value)
+            attributes[ldap_attr] = value
+    attributes['cn'] = u'{0} {1}'.format(person.first_name, person.surname)
+    return attributes
+
+
+class LDAPBackend(PeopleBackend):
     """Store person information in an LDAP directory."""
 
     def __init__(self, app, fake=False):
         self.fake = fake
         self._app = app
         for opt, mapping in _OPT_MAPPING.items():
-            if opt in app.config:
+            if opt in app.config and app.config[opt] not in mapping.values():
                 try:
                     app.config[opt] = mapping[app.config[opt]]
                 except KeyError:
@@ -64,11 +216,38 @@ class LDAPBackend(object):
         app.config.setdefault('LDAP_HOST', 'localhost')
         app.config.setdefault('LDAP_PORT', 389)
         app.config.setdefault('LDAP_REQUIRE_CERT', ssl.CERT_REQUIRED)
+        app.config.setdefault('LDAP_POOL_MIN_SIZE', 1)
+        app.config.setdefault('LDAP_POOL_MAX_SIZE', 10)
+        app.config.setdefault('LDAP_POOL_TIMEOUT', 5)
+        app.config.setdefault('LDAP_POOL_MAX_IDLE', 300)
+        app.config.setdefault('LDAP_POOL_PROBE_AFTER', 30)
+        app.config.setdefault('LDAP_USER_CACHE_SIZE', 1024)
+        app.config.setdefault('LDAP_USER_CACHE_TTL', 5)
+        app.config.setdefault('LDAP_PAGE_SIZE', 500)
+        app.config.setdefault('LDAP_IMPORT_BATCH_SIZE', 100)
+        app.config.setdefault('LDAP_TAKEN_FILTER_CAPACITY', 100000)
+        app.config.setdefault('LDAP_TAKEN_FILTER_ERROR_RATE', 0.01)
+        app.config.setdefault('LDAP_TAKEN_FILTER_TTL', 600)
+        app.config.setdefault('LDAP_GRANTS_TTL', 300)
+        app.config.setdefault('LDAP_METRICS', False)
+        app.config.setdefault('LDAP_SLOW_OPERATION_SECONDS', None)
+        if app.config.get('LDAP_GET_USER_ATTRIBUTES', ALL_ATTRIBUTES) == ALL_ATTRIBUTES:
+            # Do not let flask-ldap3-login fetch photos, certificates, etc. with user entries
+            app.config['LDAP_GET_USER_ATTRIBUTES'] = sorted(set(
+                PERSON_ATTRIBUTES + [app.config.get('LDAP_USER_LOGIN_ATTRIBUTE', 'uid'),
+                                     app.config.get('LDAP_USER_RDN_ATTRIBUTE', 'uid')]
+            ))
         self._people_basedn = '{0},{1}'.format(app.config['LDAP_USER_DN'],
                                                app.config['LDAP_BASE_DN'])
         self._person_class = app.config['LDAP_USER_CLASS']
+        self._roles_basedn = '{0},{1}'.format(app.config.get('LDAP_PERMISSION_DN'),
+                                              app.config['LDAP_BASE_DN'])
+        self._active_role_dn = None
+        app.config.setdefault('LDAP_WRITE_HOSTS', app.config['LDAP_HOST'])
+        app.config.setdefault('LDAP_READ_HOSTS', '')
+        app.config.setdefault('LDAP_READ_POOL_STRATEGY', 'ROUND_ROBIN')
+        app.config.setdefault('LDAP_MASTER_PIN_SECONDS', 5)
         srv_params = {
-            'host': self._app.config['LDAP_HOST'],
             'port': self._app.config['LDAP_PORT'],
             'use_ssl': self._app.config.get('LDAP_USE_SSL', True),
         }
@@ -76,47 +255,245 @@ class LDAPBackend(object):
             srv_params['get_info'] = ALL
         else:
             srv_params['get_info'] = OFFLINE_SLAPD_2_4
-        self.srv = Server(**srv_params)
+        read_hosts = _hosts(app.config['LDAP_READ_HOSTS'])
+        if fake is False:
+            # Several write hosts are a master and its fail-over servers, so use the first one
+            self.srv = ldap_server(_hosts(app.config['LDAP_WRITE_HOSTS']), strategy='FIRST',
+                                   **srv_params)
+            self.read_srv = (ldap_server(read_hosts, strategy=app.config['LDAP_READ_POOL_STRATEGY'],
+                                         **srv_params)
+                             if read_hosts else self.srv)
+        else:
+            # A fake directory lives in its server object, shared by reads and writes
+            self.srv = self.read_srv = Server(app.config['LDAP_HOST'], **srv_params)
+        pool_params = {
+            'min_size': app.config['LDAP_POOL_MIN_SIZE'],
+            'max_size': app.config['LDAP_POOL_MAX_SIZE'],
+            'timeout': app.config['LDAP_POOL_TIMEOUT'],
+            'max_idle': app.config['LDAP_POOL_MAX_IDLE'],
+            'probe_after': app.config['LDAP_POOL_PROBE_AFTER'],
+        }
+        # Operations are timed if metrics are exposed, slow operations logged or load shed
+        slow_seconds = app.config['LDAP_SLOW_OPERATION_SECONDS'] or None
+        timed = (app.config['LDAP_METRICS'] or slow_seconds is not None or
+                 app.config.get('RATE_LIMIT_SHED_LDAP_LATENCY'))
+        self.metrics = LDAPMetrics(slow_seconds) if timed else None
+        self.pool = LDAPConnectionPool(self._new_admin_connection, **pool_params)
+        if read_hosts:
+            self.read_pool = LDAPConnectionPool(
+                functools.partial(self._new_admin_connection, self.read_srv), **pool_params
+            )
+        else:
+            self.read_pool = self.pool
+        # Each process has its own cache, only evicted on writes made by this process: entries
+        # written by other processes (or in the directory) are seen after LDAP_USER_CACHE_TTL
+        # seconds at most. This also bounds how long an entry read from a lagging read server is
+        # served, which is why the TTL should not exceed LDAP_MASTER_PIN_SECONDS
+        self.user_cache = LRUCache(maxsize=app.config['LDAP_USER_CACHE_SIZE'],
+                                   ttl=app.config['LDAP_USER_CACHE_TTL'])
+        self._taken_filter = None
+        self._taken_filter_expires = 0
+        self._taken_filter_lock = threading.Lock()
+        self._taken_pending = None  # Values remembered while the filter is being rebuilt
+        self._taken_pending_lock = threading.Lock()
+        self._grants_index = None  # Occupant DN (lower cased) -> grants
+        self._grants_index_expires = 0
+        self._grants_index_lock = threading.Lock()
+        app.teardown_appcontext(self._release_connection)
 
     @property
     def app(self):
         """Return the Flask application instance tied to the backend."""
         return self._app
 
-    def admin_connection(self):
-        """Connect to LDAP server specified in application config and return the corresponding
-        ``ldap3.Connection`` instance.
+    @property
+    def connection(self):
+        """Return a pooled admin connection to the write servers tied to the current application
+        context.
 
-        This can be used as a context manager.
+        The connection is checked out on first access and given back to the pool when the
+        application context is torn down.
+        """
+        conn = g.get('aliquis_ldap_connection')
+        if conn is None:
+            conn = g.aliquis_ldap_connection = self.pool.checkout()
+        return conn
 
-        If ``fake`` parameter is ``True``, connection will use the ``ldap3.MOCK_SYNC`` strategy.
+    @property
+    def read_connection(self):
+        """Return a pooled admin connection to the read servers tied to the current application
+        context.
+
+        This is the write connection if no read server is configured, or if the current session
+        is pinned to the write servers (see ``pin_to_master()``).
+        """
+        if self.reads_from_master:
+            return self.connection
+        conn = g.get('aliquis_ldap_read_connection')
+        if conn is None:
+            conn = g.aliquis_ldap_read_connection = self.read_pool.checkout()
+        return conn
+
+    def _release_connection(self, exception):
+        """Give the connections of the current application context back to their pool."""
+        conn = g.pop('aliquis_ldap_connection', None)
+        if conn is not None:
+            self.pool.checkin(conn)
+        conn = g.pop('aliquis_ldap_read_connection', None)
+        if conn is not None:
+            self.read_pool.checkin(conn)
+
+    def pin_to_master(self):
+        """Send reads of the current application context, and of the current session for
+        ``LDAP_MASTER_PIN_SECONDS`` seconds, to the write servers.
+
+        This must be called each time the directory is written, so that a user reads its own
+        writes even if read servers lag behind."""
+        if not has_app_context():
+            return
+        g.aliquis_ldap_pinned = True
+        if has_request_context():
+            session[MASTER_PIN_SESSION_KEY] = (time.time() +
+                                               self._app.config['LDAP_MASTER_PIN_SECONDS'])
+
+    @property
+    def pinned_to_master(self):
+        """Return ``True`` if reads of the current application context go to the write
+        servers."""
+        if not has_app_context():
+            return False
+        if g.get('aliquis_ldap_pinned'):
+            return True
+        return has_request_context() and session.get(MASTER_PIN_SESSION_KEY, 0) > time.time()
+
+    @property
+    def reads_from_master(self):
+        """Return ``True`` if reads of the current application context go to the write servers,
+        either because no read server is configured or because the session is pinned to them."""
+        return self.read_pool is self.pool or self.pinned_to_master
+
+    @property
+    def identity_map(self):
+        """Return the identity map of the current application context.
+
+        This is a ``dict`` of ``dict`` memoizing, for the life of the request, user entries as
+        returned by flask-ldap3-login by username (``'username'`` key) and by DN (``'dn'`` key), and
+        activation status by DN (``'active'`` key).
+        """
+        identity_map = g.get('aliquis_ldap_identity_map')
+        if identity_map is None:
+            identity_map = g.aliquis_ldap_identity_map = {
+                'username': dict(),
+                'dn': dict(),
+                'active': dict(),
+            }
+        return identity_map
+
+    @call_site
+    def user_info_for_username(self, username):
+        """Return the user entry with the given username as a ``dict``, or ``None`` if there is
+        no such user.
+
+        Entries are memoized in the identity map of the current application context, and existing
+        entries are also kept across requests in the user cache of the backend. Sessions pinned to
+        the write servers do not read the cache, so that they read their own writes."""
+        users = self.identity_map
+        if username not in users['username']:
+            user_info = None if self.pinned_to_master else self.user_cache.get(username)
+            if user_info is None:
+                user_info = self._app.ldap3_login_manager.get_user_info_for_username(
+                    username, _connection=self.read_connection
+                )
+                if user_info is not None:
+                    self.user_cache.set(username, user_info)
+            users['username'][username] = user_info
+            if user_info is not None:
+                users['dn'][user_info['dn']] = user_info
+        return users['username'][username]
+
+    @call_site
+    def user_info(self, dn):
+        """Return the user entry with the given DN as a ``dict``, or ``None`` if there is no such
+        user.
+
+        Entries are memoized in the identity map of the current application context."""
+        users = self.identity_map
+        if dn not in users['dn']:
+            users['dn'][dn] = self._app.ldap3_login_manager.get_user_info(
+                dn, _connection=self.read_connection
+            )
+        return users['dn'][dn]
+
+    def forget_user_info(self, username):
+        """Evict the user with the given username from the user cache and from the identity map
+        of the current application context.
+
+        This must be called each time a user entry is written."""
+        self.user_cache.discard(username)
+        if not has_app_context():
+            return
+        users = self.identity_map
+        users['username'].pop(username, None)
+        login_attr = self._app.config['LDAP_USER_LOGIN_ATTRIBUTE']
+        for dn, user_info in list(users['dn'].items()):
+            login = user_info.get(login_attr) if user_info is not None else None
+            if (user_info is None or login == username or
+                    (isinstance(login, list) and username in login)):
+                del users['dn'][dn]
+
+    def _new_admin_connection(self, server=None):
+        """Connect to the given LDAP server (write servers by default) and return the
+        corresponding bound ``ldap3.Connection`` instance.
+
+        If ``fake`` parameter is ``True``, connection will use the ``ldap3.MOCK_SYNC`` strategy
+        and the bind user is created in the fake directory.
         """
         conn_params = {
-            'server': self.srv,
-            'auto_bind': True,
+            'server': server or self.srv,
             'user': self._app.config['LDAP_BIND_USER_DN'],
             'password': self._app.config['LDAP_BIND_USER_PASSWORD'],
             'check_names': True,
         }
         if self.fake is True:
             conn_params['client_strategy'] = MOCK_SYNC
-        return Connection(**conn_params)
+        conn = Connection(**conn_params)
+        if self.metrics is not None:
+            self.metrics.instrument(conn)
+        if self.fake is True:
+            conn.strategy.add_entry(conn_params['user'],
+                                    {'userPassword': conn_params['password']})
+        if not conn.bind():
+            raise LDAPBindError('Unable to bind as {0}: {1}'.format(
+                conn_params['user'], conn.result.get('description')
+            ))
+        return conn
+
+    def admin_connection(self, read=False):
+        """Return a context manager checking out a bound ``ldap3.Connection`` instance from the
+        connection pool of the write servers (of the read servers if ``read`` is ``True``) and
+        giving it back on exit.
+
+        If ``fake`` parameter is ``True``, connection will use the ``ldap3.MOCK_SYNC`` strategy.
+        """
+        return (self.read_pool if read else self.pool).connection()
 
     @contextmanager
-    def read_cursor(self, ldap_conn, search_class, base_dn, ldap_filter=None):
+    def read_cursor(self, ldap_conn, search_class, base_dn, ldap_filter=None, attributes=None):
         """Return a new ``ldap3.Reader`` cursor for browsing an LDAP tree described by the given
         parameters.
 
-        This can be used as a context manager.
+        Only the given LDAP ``attributes`` are fetched if given, all attributes of the class
+        otherwise. This can be used as a context manager.
         """
-        object_def = ObjectDef(search_class, ldap_conn)
         cur_params = {
             'connection': ldap_conn,
-            'object_def': object_def,
+            'object_def': object_def(search_class, ldap_conn),
             'base': base_dn,
         }
         if ldap_filter is not None:
             cur_params['query'] = ldap_filter
+        if attributes is not None:
+            cur_params['attributes'] = attributes
         yield Reader(**cur_params)
 
     @contextmanager
@@ -127,10 +504,9 @@ class LDAPBackend(object):
 
         This can be used as a context manager.
         """
-        object_def = ObjectDef(search_class, ldap_conn)
         cur_params = {
             'connection': ldap_conn,
-            'object_def': object_def,
+            'object_def': object_def(search_class, ldap_conn),
             'base': base_dn,
         }
         if ldap_filter is not None:
@@ -151,39 +527,215 @@ class LDAPBackend(object):
         yield wcur
         wcur.commit()
 
-    def entries(self, ldap_conn, search_class, base_dn, ldap_filter=None):
-        """Yield each LDAP entry (``ldap3.Entry`` instance) matching the given search parameters."""
+    def entries(self, ldap_conn, search_class, base_dn, ldap_filter=None, page_size=None,
+                attributes=None):
+        """Yield each LDAP entry (``ldap3.Entry`` instance) matching the given search parameters.
+
+        Entries are fetched with the Simple Paged Results control, ``page_size`` entries at a time
+        (``LDAP_PAGE_SIZE`` option by default), and yielded as pages arrive, so that only one page
+        is held in memory. Closing the generator before the last page abandons the search on the
+        server.
+
+        Only the given LDAP ``attributes`` are requested if given, all attributes of the class
+        otherwise."""
         with self.read_cursor(ldap_conn, search_class, base_dn, ldap_filter) as cur:
-            cur.search()
-            for entry in cur:
-                yield entry
+            search_params = {
+                'search_base': base_dn,
+                'search_filter': cur.query_filter,
+                'attributes': list(cur.attributes) if attributes is None else list(attributes),
+                'paged_size': page_size or self._app.config['LDAP_PAGE_SIZE'],
+            }
+        cookie = None
+        try:
+            while True:
+                ldap_conn.search(paged_cookie=cookie, **search_params)
+                page = ldap_conn.entries
+                cookie = _paged_cookie(ldap_conn.result)
+                for entry in page:
+                    yield entry
+                if not cookie:
+                    break
+        finally:
+            if cookie:
+                # Tell the server we are done with this search (RFC 2696)
+                search_params['paged_size'] = 0
+                try:
+                    ldap_conn.search(paged_cookie=cookie, **search_params)
+                except LDAPException:
+                    pass
 
+    @call_site
     def attribute_exists(self, ldap_conn, search_class, base_dn, attr, value):
         """Return ``True`` if there is an entry with the given class, the given attribute and the
-        given value in the LDAP directory."""
-        with self.read_cursor(ldap_conn, search_class, base_dn,
-                              '{attr}:={value}'.format(attr=attr, value=value)) as cur:
-            cur.search()
-            l = len(cur)
-        return bool(l)
+        given value in the LDAP directory.
 
+        No attribute is fetched from the server, only DNs of matching entries."""
+        if not value:
+            return False
+        ldap_conn.search(base_dn, '(&(objectClass={cls})({attr}={value}))'.format(
+            cls=search_class, attr=attr, value=escape_filter_chars(value)
+        ), attributes=NO_ATTRIBUTES)
+        return any(entry.get('type', 'searchResEntry') == 'searchResEntry'
+                   for entry in ldap_conn.response)
+
+    @call_site
     def username_exists(self, username, ldap_conn):
         """Return ``True`` if there is a person with the given username in the LDAP directory."""
         return self.attribute_exists(ldap_conn, self._person_class, self._people_basedn,
                                      'uid', username)
 
+    @call_site
     def email_exists(self, email, ldap_conn):
         """Return ``True`` if there is a person with the given email address in the LDAP
         directory."""
         return self.attribute_exists(ldap_conn, self._person_class, self._people_basedn,
                                      'mail', email)
 
+    @call_site
+    def existing_attributes(self, ldap_conn, **values):
+        """Return the ``set`` of person attribute names (among ``username`` and ``email``)
+        whose given value is already used by a person in the LDAP directory.
+
+        All values are checked with a single search. For example::
+
+            backend.existing_attributes(ldap_conn, username='jdoe', email='jdoe@example.org')
+        """
+        found = self.existing_values(ldap_conn, **dict((attr, [value])
+                                                       for attr, value in values.items()))
+        return set(attr for attr, attr_values in found.items() if attr_values)
+
+    @call_site
+    def existing_values(self, ldap_conn, **values):
+        """Return a ``dict`` mapping each given person attribute name (among ``username`` and
+        ``email``) to the ``set`` of its given values which are already used by a person in the
+        LDAP directory.
+
+        Values are given as lists and found values are lower cased. All values are checked with a
+        single search. For example::
+
+            backend.existing_values(ldap_conn, username=['jdoe', 'asmith'], email=['x@example.org'])
+        """
+        values = dict((attr, set(value.lower() for value in attr_values if value))
+                      for attr, attr_values in values.items())
+        existing = dict((attr, set()) for attr in values)
+        conds = ''.join('({ldap_attr}={value})'.format(ldap_attr=LDAP_ATTR_MAPPING[attr],
+                                                       value=escape_filter_chars(value))
+                        for attr, attr_values in sorted(values.items())
+                        for value in sorted(attr_values))
+        if not conds:
+            return existing
+        ldap_filter = '(&(objectClass={cls})(|{conds}))'.format(cls=self._person_class,
+                                                                conds=conds)
+        ldap_conn.search(self._people_basedn, ldap_filter,
+                         attributes=[LDAP_ATTR_MAPPING[attr] for attr in values])
+        for entry in ldap_conn.response:
+            if entry.get('type', 'searchResEntry') != 'searchResEntry':
+                continue
+            for attr, attr_values in values.items():
+                entry_values = entry['attributes'].get(LDAP_ATTR_MAPPING[attr], [])
+                if not isinstance(entry_values, list):
+                    entry_values = [entry_values]
+                existing[attr].update(attr_values.intersection(v.lower() for v in entry_values))
+        return existing
+
+    def taken_filter(self):
+        """Return the Bloom filter of usernames and email addresses used in the LDAP directory, or
+        ``None`` until it is first built.
+
+        The filter is built with a paged scan of people in a background thread, started on first
+        call. Once it is older than ``LDAP_TAKEN_FILTER_TTL`` seconds (so that people added by
+        other processes are taken into account), it is rebuilt the same way and the old one is
+        used meanwhile."""
+        taken = self._taken_filter
+        if time.monotonic() >= self._taken_filter_expires and self._taken_filter_lock.acquire(
+                False):
+            thread = threading.Thread(target=self._rebuild_taken_filter_in_background)
+            thread.daemon = True
+            thread.start()
+        return taken
+
+    def _rebuild_taken_filter_in_background(self):
+        """Rebuild the filter of used values with a pooled connection, then release the lock
+        acquired by the caller."""
+        try:
+            with self.admin_connection(read=True) as ldap_conn:
+                self._rebuild_taken_filter(ldap_conn)
+        except Exception:
+            # Keep the old filter (if any) and try again a bit later
+            logger.exception('Cannot build the filter of used usernames and email addresses')
+            self._taken_filter_expires = time.monotonic() + 60
+        finally:
+            self._taken_filter_lock.release()
+
+    @call_site
+    def _rebuild_taken_filter(self, ldap_conn):
+        """Build the filter of used values with a paged scan of people.
+
+        Must be called with the filter lock held."""
+        config = self._app.config
+        with self._taken_pending_lock:
+            self._taken_pending = []
+        try:
+            capacity = config['LDAP_TAKEN_FILTER_CAPACITY']
+            if self._taken_filter is not None:
+                capacity = max(capacity, 2 * len(self._taken_filter))
+            taken = BloomFilter(capacity, config['LDAP_TAKEN_FILTER_ERROR_RATE'])
+            for entry in self.entries(ldap_conn, self._person_class, self._people_basedn,
+                                      attributes=[LDAP_ATTR_MAPPING['username'],
+                                                  LDAP_ATTR_MAPPING['email']]):
+                entry_values = entry.entry_attributes_as_dict
+                for attr in ('username', 'email'):
+                    for value in entry_values.get(LDAP_ATTR_MAPPING[attr], []):
+                        taken.add(_taken_key(attr, value))
+        finally:
+            with self._taken_pending_lock:
+                pending, self._taken_pending = self._taken_pending, None
+        for key in pending:
+            taken.add(key)
+        self._taken_filter = taken
+        self._taken_filter_expires = time.monotonic() + config['LDAP_TAKEN_FILTER_TTL']
+
+    def remember_taken(self, person):
+        """Add the username and email address of the given person to the filter of used values.
+
+        This must be called each time a person is added or its email address changed."""
+        keys = [_taken_key(attr, getattr(person, attr)) for attr in ('username', 'email')
+                if getattr(person, attr)]
+        with self._taken_pending_lock:
+            if self._taken_pending is not None:
+                self._taken_pending.extend(keys)
+        taken = self._taken_filter
+        if taken is not None:
+            for key in keys:
+                taken.add(key)
+
+    @call_site
+    def is_taken(self, attr, value, ldap_conn):
+        """Return ``True`` if the given value of the given person attribute (``username`` or
+        ``email``) is already used by a person in the LDAP directory.
+
+        Most free values are answered by the filter of used values, without any LDAP request.
+        Possibly used values are checked with a search, and so are all values until the filter is
+        first built.
+
+        The filter misses values used by people added by other processes since it was built
+        (``LDAP_TAKEN_FILTER_TTL`` seconds at most), which are thus told free: adding a person
+        checks its values against the directory anyway."""
+        taken = self.taken_filter()
+        if taken is None:
+            return self.attribute_exists(ldap_conn, self._person_class, self._people_basedn,
+                                         LDAP_ATTR_MAPPING[attr], value)
+        if _taken_key(attr, value) not in taken:
+            return False
+        return attr in self.existing_attributes(ldap_conn, **{attr: value})
+
+    @call_site
     def person_by_username(self, username, ldap_conn):
         """Return a ``Person`` instance with the given username.
 
         Raise an error if no person is found with this username."""
         with self.read_cursor(ldap_conn, self._person_class, self._people_basedn,
-                              'uid:={0}'.format(username)) as cur:
+                              'uid:={0}'.format(username), PERSON_ATTRIBUTES) as cur:
             cur.search()
             assert len(cur) <= 1, ('Problem in your database: more than one user with username '
                                    "'{0}'".format(username))
@@ -193,12 +745,13 @@ class LDAPBackend(object):
             entry = cur[0]
         return _person_from_ldap_entry(entry)
 
+    @call_site
     def person_by_email(self, email, ldap_conn):
         """Return a ``Person`` instance with the given email address.
 
         Raise an error if no person is found with this email address."""
         with self.read_cursor(ldap_conn, self._person_class, self._people_basedn,
-                              'mail:={0}'.format(email)) as cur:
+                              'mail:={0}'.format(email), PERSON_ATTRIBUTES) as cur:
             cur.search()
             assert len(cur) <= 1, ('Problem in your database: more than one user with email '
                                    "address '{0}'".format(email))
@@ -208,33 +761,237 @@ class LDAPBackend(object):
             entry = cur[0]
         return _person_from_ldap_entry(entry)
 
+    @call_site
+    def active_role_dn(self, ldap_conn):
+        """Return the DN of the role whose occupants are the activated people.
+
+        The role is searched once and its DN is then kept by the backend.
+
+        Raise an error if there is no such role."""
+        if self._active_role_dn is None:
+            config = self._app.config
+            ldap_conn.search(self._roles_basedn,
+                             '(&(objectClass={0})(cn={1}))'.format(config['LDAP_PERMISSION_CLASS'],
+                                                                   config['LDAP_ACTIVE_PERM_NAME']),
+                             attributes=NO_ATTRIBUTES)
+            assert len(ldap_conn.response) <= 1, ('Problem in your database: more than one active '
+                                                  'role')
+            if len(ldap_conn.response) == 0:
+                raise LDAPNoSuchObjectResult('No active role')
+            self._active_role_dn = ldap_conn.response[0]['dn']
+        return self._active_role_dn
+
+    @call_site
+    def is_active(self, user_dn, ldap_conn):
+        """Return ``True`` if the person with the given DN is an occupant of the active role.
+
+        This is a single LDAP compare operation, whatever the number of activated people."""
+        attr = self._app.config['LDAP_PERMISSION_ATTRIBUTE']
+        result = ldap_conn.compare(self.active_role_dn(ldap_conn), attr, user_dn)
+        if not result and ldap_conn.result['description'] == 'noSuchObject':
+            # The active role has moved since we found it
+            self._active_role_dn = None
+            result = ldap_conn.compare(self.active_role_dn(ldap_conn), attr, user_dn)
+        return result
+
+    @call_site
+    def activate(self, user_dn, ldap_conn):
+        """Make the person with the given DN an occupant of the active role.
+
+        This is a single modification adding the DN to the role. Activating an already active
+        person succeeds without changing anything."""
+        self._modify_active_role(MODIFY_ADD, user_dn, ldap_conn)
+
+    @call_site
+    def deactivate(self, user_dn, ldap_conn):
+        """Remove the person with the given DN from the occupants of the active role.
+
+        This is a single modification deleting the DN from the role. Deactivating an inactive
+        person succeeds without changing anything."""
+        self._modify_active_role(MODIFY_DELETE, user_dn, ldap_conn)
+
+    def _modify_active_role(self, operation, user_dn, ldap_conn):
+        """Add (or delete, depending on ``operation``) the given DN to (from) the occupants of
+        the active role."""
+        attr = self._app.config['LDAP_PERMISSION_ATTRIBUTE']
+        ldap_conn.modify(self.active_role_dn(ldap_conn), {attr: [(operation, [user_dn])]})
+        if ldap_conn.result['result'] == RESULT_NO_SUCH_OBJECT:
+            # The active role has moved since we found it
+            self._active_role_dn = None
+            ldap_conn.modify(self.active_role_dn(ldap_conn), {attr: [(operation, [user_dn])]})
+        if ldap_conn.result['result'] not in (RESULT_SUCCESS, RESULT_ATTRIBUTE_OR_VALUE_EXISTS,
+                                              RESULT_NO_SUCH_ATTRIBUTE):
+            raise _operation_error(ldap_conn.result)
+        self.pin_to_master()
+
+    @call_site
+    def active_dns(self, user_dns, ldap_conn):
+        """Return the ``set`` of DNs, among the given ones, of people who are occupants of the
+        active role.
+
+        This is a compare operation per DN over the given connection, so that the cost depends on
+        the number of given DNs rather than on the number of activated people."""
+        return set(dn for dn in user_dns if self.is_active(dn, ldap_conn))
+
+    @call_site
+    def grants_index(self, ldap_conn):
+        """Return a ``dict`` mapping lower cased DNs of role occupants to the tuple of grants
+        (descriptions of their roles, the active role excepted).
+
+        The index is built with a single search of roles and kept for ``LDAP_GRANTS_TTL`` seconds:
+        roles are not written by the backend (the active role aside, which is left out), so
+        changes made to them in the directory are seen once the index expires."""
+        index = self._grants_index
+        if index is not None and time.monotonic() < self._grants_index_expires:
+            return index
+        with self._grants_index_lock:
+            if self._grants_index is None or time.monotonic() >= self._grants_index_expires:
+                config = self._app.config
+                perm_attr = config['LDAP_PERMISSION_ATTRIBUTE']
+                ldap_filter = '(!(cn={0}))'.format(
+                    escape_filter_chars(config['LDAP_ACTIVE_PERM_NAME'])
+                )
+                grants = dict()
+                for entry in self.entries(ldap_conn, config['LDAP_PERMISSION_CLASS'],
+                                          self._roles_basedn, ldap_filter,
+                                          attributes=[perm_attr, 'description']):
+                    values = entry.entry_attributes_as_dict
+                    descriptions = [d for d in values.get('description', []) if d is not None]
+                    for occupant in values.get(perm_attr, []):
+                        grants.setdefault(occupant.lower(), []).extend(descriptions)
+                self._grants_index = dict((dn, tuple(descriptions))
+                                          for dn, descriptions in grants.items())
+                self._grants_index_expires = time.monotonic() + config['LDAP_GRANTS_TTL']
+            return self._grants_index
+
+    @call_site
+    def grants(self, user_dn, ldap_conn):
+        """Return the tuple of grants (descriptions of roles) of the person with the given DN."""
+        return self.grants_index(ldap_conn).get(user_dn.lower(), ())
+
+    @call_site
+    def user_dns(self, usernames, ldap_conn):
+        """Return a ``dict`` mapping each of the given usernames to the DN of the corresponding
+        person, usernames of unknown people being left out.
+
+        All people are searched at once."""
+        login_attr = self._app.config['LDAP_USER_LOGIN_ATTRIBUTE']
+        usernames = set(username for username in usernames if username)
+        if not usernames:
+            return dict()
+        conds = ''.join('({attr}={value})'.format(attr=login_attr,
+                                                  value=escape_filter_chars(username))
+                        for username in sorted(usernames))
+        ldap_conn.search(self._people_basedn,
+                         '(&(objectClass={cls})(|{conds}))'.format(cls=self._person_class,
+                                                                   conds=conds),
+                         attributes=[login_attr])
+        by_lower = dict((username.lower(), username) for username in usernames)
+        dns = dict()
+        for entry in ldap_conn.response:
+            if entry.get('type', 'searchResEntry') != 'searchResEntry':
+                continue
+            values = entry['attributes'].get(login_attr, [])
+            for value in values if isinstance(values, list) else [values]:
+                if value.lower() in by_lower:
+                    dns[by_lower[value.lower()]] = entry['dn']
+        return dns
+
+    @call_site
     def add_person(self, person, ldap_conn, rdn_attr='uid'):
         """Add the given person in the LDAP directory."""
         # Check that username and email does not exists already
-        for attr, attr_exists in (('username', self.username_exists), ('email', self.email_exists)):
-            value = getattr(person, attr, None)
-            if value is not None:
-                if attr_exists(value, ldap_conn):
-                    raise LDAPEntryAlreadyExistsResult('There is already a person with {attr} '
-                                                       '{value}'.format(attr=attr, value=value))
+        existing = self.existing_attributes(ldap_conn, username=person.username,
+                                            email=person.email)
+        for attr in ('username', 'email'):
+            if attr in existing:
+                raise LDAPEntryAlreadyExistsResult('There is already a person with {attr} '
+                                                   '{value}'.format(attr=attr,
+                                                                    value=getattr(person, attr)))
         rdn_value = getattr(person, LDAP_ATTR_REV_MAPPING[rdn_attr])
         rdn = '{attr}={value}'.format(attr=rdn_attr, value=rdn_value)
         # Build and save the new entry
         with self.add_cursor(ldap_conn, self._person_class, self._people_basedn) as wcur:
             ldap_person = wcur.new('{rdn},{base_dn}'.format(rdn=rdn, base_dn=self._people_basedn))
-            for attr in LDAP_ATTR_MAPPING:
-                value = getattr(person, attr, None)
-                if value is not None:
-                    if attr == 'password':
-                        value = '{{CRYPT}}{0}'.format(value)
-                    setattr(ldap_person, LDAP_ATTR_MAPPING[attr], value)
-            ldap_person.cn = u'{0} {1}'.format(person.first_name, person.surname)
+            for ldap_attr, value in _person_attributes(person).items():
+                setattr(ldap_person, ldap_attr, value)
+        self.forget_user_info(person.username)
+        self.remember_taken(person)
+        self.pin_to_master()
+
+    def add_people(self, people, batch_size=None, workers=None, rdn_attr='uid'):
+        """Add the given people in the LDAP directory.
+
+        Yield a ``(person, error)`` tuple for each given person, in the same order, ``error``
+        being ``None`` if the person was added or the exception explaining why it was not.
+
+        People are consumed ``batch_size`` at a time (``LDAP_IMPORT_BATCH_SIZE`` option by
+        default), so that any iterable, even a huge one, can be given. Usernames and email
+        addresses of a batch are checked with a single search, then people are added by
+        ``workers`` threads (pool maximum size by default), each one with its own pooled
+        connection.
+        """
+        batch_size = batch_size or self._app.config['LDAP_IMPORT_BATCH_SIZE']
+        workers = workers or self.pool.max_size
+        seen = dict(username=set(), email=set())  # Values used by previous people of the import
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for batch in _chunks(people, batch_size):
+                with self.admin_connection() as ldap_conn:
+                    existing = self.existing_values(
+                        ldap_conn,
+                        username=[person.username for person in batch],
+                        email=[person.email for person in batch],
+                    )
+                results = []
+                for person in batch:
+                    error = None
+                    for attr in ('username', 'email'):
+                        value = getattr(person, attr)
+                        if value and (value.lower() in existing[attr] or
+                                      value.lower() in seen[attr]):
+                            error = LDAPEntryAlreadyExistsResult(
+                                description='entryAlreadyExists',
+                                message='There is already a person with {attr} {value}'.format(
+                                    attr=attr, value=value),
+                            )
+                            break
+                    if error is None:
+                        for attr in ('username', 'email'):
+                            if getattr(person, attr):
+                                seen[attr].add(getattr(person, attr).lower())
+                        results.append(executor.submit(self._add_entry, person, rdn_attr))
+                    else:
+                        results.append(error)
+                for person, result in zip(batch, results):
+                    yield person, result if isinstance(result, Exception) else result.result()
+
+    @call_site
+    def _add_entry(self, person, rdn_attr):
+        """Add the given person in the LDAP directory with a pooled connection, without checking
+        its username and email address.
+
+        Return ``None`` on success, or the exception explaining the failure."""
+        rdn_value = getattr(person, LDAP_ATTR_REV_MAPPING[rdn_attr])
+        dn = '{attr}={value},{base_dn}'.format(attr=rdn_attr, value=escape_rdn(rdn_value),
+                                               base_dn=self._people_basedn)
+        try:
+            with self.admin_connection() as ldap_conn:
+                if not ldap_conn.add(dn, [self._person_class], _person_attributes(person)):
+                    return _operation_error(ldap_conn.result)
+        except LDAPException as err:
+            return err
+        self.forget_user_info(person.username)
+        self.remember_taken(person)
+        return None
 
-    def update_person(self, person, ldap_conn):
-        """Update the given person in the LDAP directory."""
+    @call_site
+    def update_person(self, person, ldap_conn, update_password=True):
+        """Update the given person in the LDAP directory, its password only if
+        ``update_password`` is ``True``."""
         # Find the person by its ursername or email
         with self.read_cursor(ldap_conn, self._person_class, self._people_basedn,
-                              'uid:={username}'.format(username=person.username)) as cur:
+                              'uid:={username}'.format(username=person.username),
+                              PERSON_ATTRIBUTES) as cur:
             cur.search()
             assert len(cur) <= 1, ('Problem in your database: more than one user with username '
                                    "'{1}'".format(person.username))
@@ -245,8 +1002,10 @@ class LDAPBackend(object):
                 entry = wcur[0]
                 for attr, ldap_attr in LDAP_ATTR_MAPPING.items():
                     value = getattr(person, attr, None)
-                    if value is None:
+                    if value is None or (attr == 'password' and not update_password):
                         continue
+                    if attr == 'password':
+                        value = '{{CRYPT}}{0}'.format(value)
                     try:
                         ldap_value = getattr(entry, ldap_attr)
                     except LDAPCursorError:
@@ -254,3 +1013,175 @@ class LDAPBackend(object):
                     else:
                         if ldap_value.value != value:
                             setattr(entry, ldap_attr, value)
+        self.forget_user_info(person.username)
+        self.remember_taken(person)
+        self.pin_to_master()
+
+    @call_site
+    def get_person(self, username):
+        user_info = self.user_info_for_username(username)
+        return _person_from_user_info(user_info) if user_info is not None else None
+
+    @call_site
+    def get_person_by_email(self, email):
+        ldap_manager = self._app.ldap3_login_manager
+        entry = ldap_manager.get_object(
+            dn=ldap_manager.full_user_search_dn,
+            filter='(&(mail={0}){1})'.format(escape_filter_chars(email),
+                                             self._app.config['LDAP_USER_OBJECT_FILTER']),
+            attributes=NO_ATTRIBUTES,
+            _connection=self.read_connection
+        )
+        if entry is None:
+            return None
+        return _person_from_user_info(self.user_info(entry['dn']))
+
+    @call_site
+    def authenticate(self, username, password):
+        """Return the ``Person`` instance with the given username if the given password is its
+        password, else ``None``.
+
+        The check is a bind of the person to the directory. When people are named by their login
+        attribute (``LDAP_USER_RDN_ATTRIBUTE`` is ``LDAP_USER_LOGIN_ATTRIBUTE``), the bind DN is
+        built from the username and the entry is read once bound, else the entry is searched
+        first. Either way, the entry is kept in the identity map of the current application
+        context, so that the rest of the login does not look it up again."""
+        if not password:
+            return None  # A bind without password would be an unauthenticated one
+        user_dn = self.user_dn_for_username(username)
+        user_info = None
+        if user_dn is None:
+            user_info = self.user_info_for_username(username)
+            if user_info is None:
+                return None
+            user_dn = user_info['dn']
+        if not self.bind_as(user_dn, password):
+            return None
+        if user_info is None:
+            user_info = self.user_info(user_dn)
+            if user_info is None:
+                return None
+            self.identity_map['username'][username] = user_info
+            self.user_cache.set(username, user_info)
+        return _person_from_user_info(user_info)
+
+    def user_dn_for_username(self, username):
+        """Return the DN of the person with the given username if it can be built without a
+        search, else ``None``."""
+        config = self._app.config
+        rdn_attr = config.get('LDAP_USER_RDN_ATTRIBUTE', 'uid')
+        if (config.get('LDAP_ALWAYS_SEARCH_BIND') or
+                rdn_attr != config.get('LDAP_USER_LOGIN_ATTRIBUTE', 'uid')):
+            return None
+        return '{attr}={value},{base_dn}'.format(attr=rdn_attr, value=escape_rdn(username),
+                                                 base_dn=self._people_basedn)
+
+    @call_site
+    def bind_as(self, user_dn, password):
+        """Return ``True`` if the given password is the one of the person with the given DN.
+
+        This is a single bind, with a short lived connection to the read servers (to the write
+        servers if the current session is pinned to them)."""
+        conn_params = {
+            'server': self.srv if self.pinned_to_master else self.read_srv,
+            'user': user_dn,
+            'password': password,
+            'check_names': True,
+        }
+        if self.fake is True:
+            conn_params['client_strategy'] = MOCK_SYNC
+        conn = Connection(**conn_params)
+        if self.metrics is not None:
+            self.metrics.instrument(conn)
+        try:
+            return conn.bind()
+        except LDAPException:
+            return False
+        finally:
+            conn.unbind()
+
+    @call_site
+    def used_attributes(self, **values):
+        return self.existing_attributes(self.read_connection, **values)
+
+    @call_site
+    def is_available(self, attr, value):
+        return not self.is_taken(attr, value, self.read_connection)
+
+    @call_site
+    def create_person(self, person):
+        try:
+            self.add_person(person, self.connection,
+                            rdn_attr=self._app.config['LDAP_USER_RDN_ATTRIBUTE'])
+        except LDAPEntryAlreadyExistsResult as err:
+            raise PersonAlreadyExistsError(str(err))
+
+    @call_site
+    def save_person(self, person, update_password=False):
+        try:
+            self.update_person(person, self.connection, update_password=update_password)
+        except LDAPNoSuchObjectResult as err:
+            raise NoSuchPersonError(str(err))
+
+    @call_site
+    def replace_password_hash(self, username, old_hash, new_hash):
+        """Replace the stored password hash of the person with the given username by
+        ``new_hash``, only if it is still ``old_hash``.
+
+        This is a single modification deleting the old value and adding the new one, which the
+        directory refuses as a whole if the old value is gone."""
+        user_info = self.user_info_for_username(username)
+        if user_info is None:
+            return False
+        ldap_conn = self.connection
+        ldap_conn.modify(user_info['dn'], {LDAP_ATTR_MAPPING['password']: [
+            (MODIFY_DELETE, ['{{CRYPT}}{0}'.format(old_hash)]),
+            (MODIFY_ADD, ['{{CRYPT}}{0}'.format(new_hash)]),
+        ]})
+        result = ldap_conn.result['result']
+        if result in (RESULT_NO_SUCH_ATTRIBUTE, RESULT_NO_SUCH_OBJECT):
+            return False
+        if result != RESULT_SUCCESS:
+            raise _operation_error(ldap_conn.result)
+        self.forget_user_info(username)
+        self.pin_to_master()
+        return True
+
+    @call_site
+    def person_is_active(self, username):
+        """Return ``True`` if the person with the given username is an occupant of the active role.
+
+        The status is memoized in the identity map of the current application context."""
+        user_dn = self.user_info_for_username(username)['dn']
+        activations = self.identity_map['active']
+        if user_dn not in activations:
+            activations[user_dn] = self.is_active(user_dn, self.read_connection)
+        return activations[user_dn]
+
+    @call_site
+    def activate_person(self, username):
+        user_dn = self.user_info_for_username(username)['dn']
+        self.activate(user_dn, self.connection)
+        self.forget_user_info(username)
+        self.identity_map['active'][user_dn] = True
+
+    @call_site
+    def deactivate_person(self, username):
+        user_dn = self.user_info_for_username(username)['dn']
+        self.deactivate(user_dn, self.connection)
+        self.forget_user_info(username)
+        self.identity_map['active'][user_dn] = False
+
+    @call_site
+    def person_grants(self, username):
+        user_info = self.user_info_for_username(username)
+        if user_info is None:
+            return ()
+        return self.grants(user_info['dn'], self.read_connection)
+
+    @call_site
+    def people_grants(self, usernames):
+        ldap_conn = self.read_connection
+        dns = self.user_dns(usernames, ldap_conn)
+        return dict((username, self.grants(dns[username], ldap_conn) if username in dns else None)
+                    for username in usernames)
@@ -0,0 +1,176 @@
+"""Pool of bound LDAP connections shared by the LDAP backend."""
+
+from contextlib import contextmanager
+import threading
+import time
+
+from ldap3 import BASE
+from ldap3.core.exceptions import LDAPCommunicationError, LDAPException, LDAPExceptionError
+
+
+class LDAPPoolTimeoutError(LDAPExceptionError):
+    """Raised when no pooled connection becomes available before the checkout timeout."""
+
+
+class LDAPConnectionPool(object):
+    """A bounded pool of bound ``ldap3.Connection`` instances.
+
+    ``factory`` is a callable taking no argument and returning a new bound connection. The pool
+    never holds more than ``max_size`` connections and keeps at least ``min_size`` of them once it
+    has been used. Connections left idle for more than ``max_idle`` seconds are closed (down to
+    ``min_size``), and connections idle for more than ``probe_after`` seconds are probed before
+    being handed out again: a dead connection (e.g. after a server restart) is replaced by a newly
+    bound one.
+    """
+
+    def __init__(self, factory, min_size=1, max_size=10, timeout=5, max_idle=300, probe_after=30):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError('Invalid pool size: min={0}, max={1}'.format(min_size, max_size))
+        self._factory = factory
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.probe_after = probe_after
+        self._idle = []  # (connection, last release time), most recently released last
+        self._size = 0
+        self._cond = threading.Condition()
+
+    @property
+    def size(self):
+        """Number of connections currently opened by the pool (idle or checked out)."""
+        return self._size
+
+    @property
+    def idle(self):
+        """Number of idle connections waiting in the pool."""
+        return len(self._idle)
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection, yield it and give it back to the pool.
+
+        If the block raises a communication error, the connection is discarded instead of being
+        returned to the pool.
+        """
+        conn = self.checkout()
+        try:
+            yield conn
+        except LDAPCommunicationError:
+            self.discard(conn)
+            raise
+        except BaseException:
+            self.checkin(conn)
+            raise
+        else:
+            self.checkin(conn)
+
+    def checkout(self, timeout=None):
+        """Return a live bound connection from the pool.
+
+        Wait at most ``timeout`` seconds (pool default if ``None``) for a connection to be released
+        if the pool is exhausted, then raise ``LDAPPoolTimeoutError``.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._reap()
+            while not self._idle and self._size >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise LDAPPoolTimeoutError('No LDAP connection available after {0} '
+                                               'seconds'.format(timeout))
+                self._cond.wait(remaining)
+            if self._idle:
+                conn, released = self._idle.pop()
+            else:
+                conn, released = None, None
+                self._size += 1
+        if conn is None:
+            conn = self._open()
+            self._fill()
+        elif time.monotonic() - released >= self.probe_after and not self._is_alive(conn):
+            self._close(conn)
+            conn = self._open()
+        return conn
+
+    def checkin(self, conn):
+        """Give the given connection back to the pool."""
+        if conn.closed or not conn.bound:
+            self.discard(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._reap()
+            self._cond.notify()
+
+    def discard(self, conn):
+        """Close the given checked out connection and forget about it."""
+        self._close(conn)
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def clear(self):
+        """Close all idle connections."""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._close(conn)
+
+    def _open(self):
+        """Return a new connection from the factory, releasing its slot in the pool on error."""
+        try:
+            return self._factory()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def _fill(self):
+        """Open idle connections until the pool holds at least ``min_size`` connections."""
+        while True:
+            with self._cond:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                conn = self._open()
+            except LDAPException:
+                return
+            self.checkin(conn)
+
+    def _reap(self):
+        """Close connections idle for too long, keeping at least ``min_size`` connections.
+
+        Must be called with the pool lock held."""
+        now = time.monotonic()
+        while (self._idle and self._size > self.min_size and
+               now - self._idle[0][1] >= self.max_idle):
+            conn, _ = self._idle.pop(0)
+            self._size -= 1
+            self._close(conn)
+
+    @staticmethod
+    def _is_alive(conn):
+        """Return ``True`` if the given connection still answers the server.
+
+        The probe is a base search on the bind DN which requests no attribute."""
+        if conn.closed or not conn.bound:
+            return False
+        try:
+            conn.search(conn.user, '(objectClass=*)', search_scope=BASE, attributes=['1.1'])
+        except LDAPException:
+            return False
+        return not conn.closed
+
+    @staticmethod
+    def _close(conn):
+        """Unbind the given connection, ignoring errors from an already dead connection."""
+        try:
+            conn.unbind()
+        except LDAPException:
+            pass
@@ -0,0 +1,212 @@
+"""Instrumentation of LDAP operations: counts, errors and latency histograms."""
+
+import functools
+import logging
+import os
+import threading
+import time
+
+from ldap3.core.results import RESULT_COMPARE_FALSE, RESULT_COMPARE_TRUE, RESULT_SUCCESS
+
+
+# Instrumented methods of ``ldap3.Connection``
+OPERATIONS = ('bind', 'search', 'compare', 'add', 'modify', 'delete', 'modify_dn')
+
+# Upper bounds (in seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                   5.0, 10.0)
+
+# Weight of the latest operation in the recent latency (exponentially weighted moving average)
+RECENT_LATENCY_WEIGHT = 0.1
+
+# Call site of operations run outside of any function decorated with ``call_site``
+UNKNOWN_CALL_SITE = 'unknown'
+
+_SUCCESS_RESULTS = (RESULT_SUCCESS, RESULT_COMPARE_FALSE, RESULT_COMPARE_TRUE)
+
+# Names of the decorated functions running in the current thread, outermost first
+_call_sites = threading.local()
+
+logger = logging.getLogger(__name__)
+
+
+def call_site(func):
+    """Decorator naming LDAP operations run by the decorated function after it.
+
+    The outermost decorated function wins, so that operations are accounted to the entry point
+    which triggered them (e.g. ``load_user`` rather than the backend methods it calls)."""
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        stack = _call_site_stack()
+        stack.append(name)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            stack.pop()
+    return wrapper
+
+
+def _call_site_stack():
+    """Return the stack of call sites of the current thread."""
+    stack = getattr(_call_sites, 'stack', None)
+    if stack is None:
+        stack = _call_sites.stack = []
+    return stack
+
+
+def current_call_site():
+    """Return the name of the call site of LDAP operations run now."""
+    stack = _call_site_stack()
+    return stack[0] if stack else UNKNOWN_CALL_SITE
+
+
+class _Series(object):
+    """Count, error count and latency histogram of one operation type at one call site."""
+
+    __slots__ = ('count', 'errors', 'total', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)  # Not cumulative
+
+
+class LDAPMetrics(object):
+    """Thread-safe registry of LDAP operation metrics, by operation type and call site.
+
+    Operations slower than ``slow_seconds`` seconds (if not ``None``) are logged as warnings.
+    ``recent_latency`` is a moving average of the latency of the last operations, whatever their
+    type (``None`` until an operation is recorded).
+    """
+
+    def __init__(self, slow_seconds=None):
+        self.slow_seconds = slow_seconds
+        self.recent_latency = None
+        self._series = dict()
+        self._lock = threading.Lock()
+
+    def observe(self, operation, site, seconds, error=False, target=None):
+        """Record an operation of the given type, run from the given call site, which took the
+        given number of seconds."""
+        index = len(LATENCY_BUCKETS)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                index = i
+                break
+        with self._lock:
+            series = self._series.get((operation, site))
+            if series is None:
+                series = self._series[(operation, site)] = _Series()
+            series.count += 1
+            series.total += seconds
+            if error:
+                series.errors += 1
+            if index < len(LATENCY_BUCKETS):
+                series.buckets[index] += 1
+            if self.recent_latency is None:
+                self.recent_latency = seconds
+            else:
+                self.recent_latency += RECENT_LATENCY_WEIGHT * (seconds - self.recent_latency)
+        if self.slow_seconds is not None and seconds >= self.slow_seconds:
+            logger.warning('Slow LDAP %s from %s on %s: %.3f s%s', operation, site, target,
+                           seconds, ' (failed)' if error else '')
+
+    def snapshot(self):
+        """Return a ``dict`` mapping ``(operation, call site)`` tuples to ``dict`` with
+        ``count``, ``errors``, ``sum`` and ``buckets`` (cumulative counts by upper bound) keys."""
+        with self._lock:
+            series = [(key, s.count, s.errors, s.total, list(s.buckets))
+                      for key, s in self._series.items()]
+        result = dict()
+        for key, count, errors, total, buckets in series:
+            cumulative = []
+            running = 0
+            for bound, bucket in zip(LATENCY_BUCKETS, buckets):
+                running += bucket
+                cumulative.append((bound, running))
+            result[key] = {'count': count, 'errors': errors, 'sum': total, 'buckets': cumulative}
+        return result
+
+    def reset(self):
+        """Forget all recorded operations."""
+        with self._lock:
+            self._series = dict()
+            self.recent_latency = None
+
+    def render(self):
+        """Return the metrics in the Prometheus text exposition format.
+
+        Metrics are the ones of the current process only, so series are labelled by process ID:
+        with several worker processes, each scrape gets the metrics of whichever one serves it."""
+        snapshot = sorted(self.snapshot().items())
+        lines = [
+            '# HELP aliquis_ldap_operations_total LDAP operations.',
+            '# TYPE aliquis_ldap_operations_total counter',
+        ]
+        lines.extend('aliquis_ldap_operations_total{{{0}}} {1}'.format(_labels(key), s['count'])
+                     for key, s in snapshot)
+        lines.extend([
+            '# HELP aliquis_ldap_operation_errors_total LDAP operations which failed.',
+            '# TYPE aliquis_ldap_operation_errors_total counter',
+        ])
+        lines.extend('aliquis_ldap_operation_errors_total{{{0}}} {1}'.format(
+            _labels(key), s['errors']
+        ) for key, s in snapshot)
+        lines.extend([
+            '# HELP aliquis_ldap_operation_duration_seconds Latency of LDAP operations.',
+            '# TYPE aliquis_ldap_operation_duration_seconds histogram',
+        ])
+        for key, s in snapshot:
+            labels = _labels(key)
+            for bound, count in s['buckets']:
+                lines.append('aliquis_ldap_operation_duration_seconds_bucket{{{0},le="{1}"}} '
+                             '{2}'.format(labels, repr(bound), count))
+            lines.append('aliquis_ldap_operation_duration_seconds_bucket{{{0},le="+Inf"}} '
+                         '{1}'.format(labels, s['count']))
+            lines.append('aliquis_ldap_operation_duration_seconds_sum{{{0}}} {1}'.format(
+                labels, repr(s['sum'])
+            ))
+            lines.append('aliquis_ldap_operation_duration_seconds_count{{{0}}} {1}'.format(
+                labels, s['count']
+            ))
+        return '\n'.join(lines) + '\n'
+
+    def instrument(self, conn):
+        """Time the operations of the given ``ldap3.Connection`` instance, and return it."""
+        for operation in OPERATIONS:
+            setattr(conn, operation, self._timed(conn, operation, getattr(conn, operation)))
+        return conn
+
+    def _timed(self, conn, operation, method):
+        """Return the given connection method, recording each of its calls."""
+        @functools.wraps(method)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            error = True
+            try:
+                result = method(*args, **kwargs)
+                code = (conn.result or dict()).get('result', RESULT_SUCCESS)
+                error = code not in _SUCCESS_RESULTS
+                return result
+            finally:
+                target = args[0] if args and operation != 'bind' else conn.user
+                self.observe(operation, current_call_site(), time.perf_counter() - start, error,
+                             target)
+        return timed
+
+
+def _labels(key):
+    """Return the Prometheus labels of the given ``(operation, call site)`` tuple, in the current
+    process."""
+    operation, site = key
+    return 'operation="{0}",call_site="{1}",pid="{2}"'.format(
+        _escape(operation), _escape(site), os.getpid()
+    )
+
+
+def _escape(value):
+    """Escape the given label value for the Prometheus text format."""
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
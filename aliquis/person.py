@@ -1,23 +1,14 @@
 """Classes and functions to deal with people account information."""
 
-from crypt import crypt
-from hmac import compare_digest as compare_hash
 import re
 
 from flask import current_app
 from flask_login import AnonymousUserMixin
-from six import PY3, text_type, binary_type
+from six import text_type, binary_type
 
-if PY3:
-    from crypt import mksalt, METHOD_SHA512
-else:
-    from base64 import b64encode
-    from os import urandom
+from aliquis.hashing import hash_password, identify_scheme, verify_password
 
 
-# Regexp to check if a string is already hashed using system's crypt()
-CRYPT_REGEXP = re.compile(r'(\$\d\$[^$]+\$)')  # XXX: Doesn't work with bcrypt
-
 # Regexp to check if a string is a valid username
 USERNAME_REGEXP = re.compile(r'^[a-zA-Z][a-zA-Z0-9_.]+$')
 
@@ -88,26 +79,15 @@ class Person(object):
         value = _text_value(value, allow_empty=False)
         if value is None:
             raise ValueError('Password cannot be empty')
-        if CRYPT_REGEXP.match(value):  # value is already hashed
+        if identify_scheme(value) is not None:  # value is already hashed
             self._password = binary_type(value.encode('utf-8'))
         else:  # value is clear text
-            self._password = binary_type(crypt(value, _sha512_salt()).encode('utf-8'))
+            self._password = binary_type(hash_password(value).encode('utf-8'))
 
     @property
     def is_active(self):
         """Return ``True`` if account for this person has been activated."""
-        config = current_app.config
-        user_info = current_app.ldap3_login_manager.get_user_info_for_username(self.username)
-        active_perm = current_app.ldap3_login_manager.get_object(
-            '{0},{1}'.format(config['LDAP_PERMISSION_DN'], config['LDAP_BASE_DN']),
-            '(&(objectClass={0})(cn={1}))'.format(config['LDAP_PERMISSION_CLASS'],
-                                                  config['LDAP_ACTIVE_PERM_NAME']),
-            [config['LDAP_PERMISSION_ATTRIBUTE']]
-        )
-        if user_info['dn'] in active_perm[config['LDAP_PERMISSION_ATTRIBUTE']]:
-            return True
-        else:
-            return False
+        return current_app.people_backend.person_is_active(self.username)
 
     @property
     def is_authenticated(self):
@@ -128,11 +108,10 @@ class Person(object):
         if isinstance(value, binary_type):
             value = value.decode('utf-8')
         value = _text_value(value)
-        if CRYPT_REGEXP.match(value):  # value is already hashed
+        if identify_scheme(value) is not None:  # value is already hashed
             return self._password.decode('utf-8') == value
         else:  # value is clear text
-            salt = CRYPT_REGEXP.match(self._password.decode('utf-8')).group(1)
-            return compare_hash(self._password, binary_type(crypt(value, salt).encode('utf-8')))
+            return verify_password(value, self._password.decode('utf-8'))
 
     def as_json(self):
         res = dict((k, getattr(self, k, None)) for k in ('first_name', 'surname', 'display_name',
@@ -149,14 +128,6 @@ class Person(object):
                 self.username == other.username and self.email == other.email)
 
 
-def _sha512_salt():
-    """Return a random SHA-512 salt suitable for the ``crypt.crypt`` function."""
-    if PY3:
-        return mksalt(METHOD_SHA512)
-    else:
-        return u'$6${0}$'.format(b64encode(urandom(8)).decode('utf-8'))
-
-
 def _text_value(x, default=u'', allow_empty=True):
     """Return ``x`` unicode value or the default value if ``x`` is ``None``.
 
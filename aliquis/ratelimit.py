@@ -0,0 +1,209 @@
+"""Rate limiting of the endpoints which are costly for the directory and the mail quota."""
+
+from collections import OrderedDict
+from configparser import ParsingError
+from functools import wraps
+import logging
+import random
+import threading
+import time
+
+from flask import current_app, request
+import redis
+
+
+# Rate limit storages, by name
+RATE_LIMIT_STORAGES = ('memory', 'redis')
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a request is refused, either because a bucket it takes a token from is empty or
+    to shed load. ``retry_after`` is the number of seconds to wait before trying again."""
+
+    def __init__(self, message, retry_after=1):
+        super(RateLimitExceeded, self).__init__(message)
+        self.retry_after = retry_after
+
+
+class MemoryBucketStore(object):
+    """Thread-safe token buckets of the current process.
+
+    At most ``maxsize`` buckets are kept, the least recently used being forgotten first (which
+    amounts to refilling them)."""
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()  # key -> (tokens, update time), least recently used first
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate):
+        """Take a token from the bucket with the given key, holding at most ``capacity`` tokens
+        and refilled with ``rate`` tokens per second.
+
+        Return 0 if a token was taken, else the number of seconds until one is available."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            wait = 0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+# Take a token from the bucket of KEYS[1]: ARGV are its capacity, its rate and the current time
+_TAKE_SCRIPT = """
+local capacity, rate, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens, updated = tonumber(bucket[1]), tonumber(bucket[2])
+if tokens == nil then
+    tokens, updated = capacity, now
+end
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000))
+return tostring(wait)
+"""
+
+
+class RedisBucketStore(object):
+    """Token buckets shared by all the processes using the Redis server at the given URL.
+
+    Each token is taken atomically by a script run by the server. Buckets expire once they would
+    be full again. If the server cannot be reached, requests are let through."""
+
+    def __init__(self, url, prefix='aliquis:ratelimit:'):
+        self.prefix = prefix
+        self._redis = redis.Redis.from_url(url, socket_timeout=1)
+        self._take = self._redis.register_script(_TAKE_SCRIPT)
+
+    def take(self, key, capacity, rate):
+        """Take a token from the bucket with the given key, holding at most ``capacity`` tokens
+        and refilled with ``rate`` tokens per second.
+
+        Return 0 if a token was taken, else the number of seconds until one is available."""
+        try:
+            return float(self._take(keys=[self.prefix + key], args=[capacity, rate, time.time()]))
+        except redis.RedisError as err:
+            logger.warning('Cannot take a token from rate limit bucket %s: %s', key, err)
+            return 0
+
+
+class RateLimiter(object):
+    """Refuse requests beyond what the directory and the mail quota can take.
+
+    Each limited request takes a token from the bucket of its client IP address, then from the
+    bucket of the account it is about (if any). Buckets of a kind hold at most ``burst`` tokens and
+    are refilled with ``per_minute`` tokens per minute, given as ``(burst, per_minute)`` tuples.
+
+    If ``shed_latency`` is given and ``latency`` (a callable returning the recent latency of the
+    directory in seconds, or ``None``) is beyond it, requests are refused before taking any token,
+    in proportion of the excess latency: at twice the threshold, half of them are. The ones let
+    through keep measuring the latency, so that shedding stops once the directory has recovered.
+    """
+
+    def __init__(self, store, ip_limit=(20, 10), account_limit=(5, 2), shed_latency=None,
+                 latency=None):
+        self.store = store
+        self.ip_limit = ip_limit
+        self.account_limit = account_limit
+        self.shed_latency = shed_latency
+        self.latency = latency
+
+    def should_shed(self):
+        """Return ``True`` if a request should be refused right away, to shed load."""
+        if not self.shed_latency or self.latency is None:
+            return False
+        latency = self.latency()
+        if latency is None or latency <= self.shed_latency:
+            return False
+        return random.random() >= self.shed_latency / latency
+
+    def check(self, scope, address, account=None):
+        """Take tokens for a request of the given scope (e.g. the endpoint) from the given IP
+        address about the given account, or raise ``RateLimitExceeded``."""
+        if self.should_shed():
+            raise RateLimitExceeded('Load shed while the directory is slow')
+        buckets = [('ip', address, self.ip_limit)]
+        if account:
+            buckets.append(('account', account, self.account_limit))
+        for kind, value, (burst, per_minute) in buckets:
+            wait = self.store.take('{0}:{1}:{2}'.format(scope, kind, value), burst,
+                                   per_minute / 60.0)
+            if wait:
+                raise RateLimitExceeded('Too many requests for {0} {1}'.format(kind, value),
+                                        retry_after=wait)
+
+
+def create_rate_limiter(app):
+    """Return the rate limiter of the given Flask application, configured by its
+    ``RATE_LIMIT_*`` options, or ``None`` if rate limiting is disabled."""
+    config = app.config
+    if not config.setdefault('RATE_LIMIT_ENABLED', False):
+        return None
+    storage = config.setdefault('RATE_LIMIT_STORAGE', 'memory')
+    if storage == 'memory':
+        store = MemoryBucketStore(config.setdefault('RATE_LIMIT_MEMORY_SIZE', 100000))
+    elif storage == 'redis':
+        store = RedisBucketStore(config.setdefault('RATE_LIMIT_REDIS_URL',
+                                                   config.get('CELERY_BROKER_URL')))
+    else:
+        raise ParsingError("Invalid value for option 'RATE_LIMIT_STORAGE' in configuration. "
+                           'Expected: {values}'.format(values=RATE_LIMIT_STORAGES))
+    ldap_backend = getattr(app, 'ldap_backend', None)
+    metrics = ldap_backend.metrics if ldap_backend is not None else None
+    return RateLimiter(
+        store,
+        ip_limit=(config.setdefault('RATE_LIMIT_IP_BURST', 20),
+                  config.setdefault('RATE_LIMIT_IP_PER_MINUTE', 10)),
+        account_limit=(config.setdefault('RATE_LIMIT_ACCOUNT_BURST', 5),
+                       config.setdefault('RATE_LIMIT_ACCOUNT_PER_MINUTE', 2)),
+        shed_latency=config.setdefault('RATE_LIMIT_SHED_LDAP_LATENCY', None),
+        latency=(lambda: metrics.recent_latency) if metrics is not None else None,
+    )
+
+
+def rate_limited(account=None, methods=None, account_by_address=False):
+    """Decorator toward view functions, whose requests (only the ones with the given HTTP methods
+    if given) are refused beyond the limits of the rate limiter of the app.
+
+    ``account`` is a callable returning the account the current request is about, if any (e.g. a
+    username read from the submitted form). With ``account_by_address``, each client address has
+    its own bucket for an account, so that requests of others cannot empty it (e.g. to lock someone
+    out of login)."""
+    def decorator(func):
+        @wraps(func)
+        def decorated_view(*args, **kwargs):
+            limiter = getattr(current_app, 'rate_limiter', None)
+            if limiter is not None and (methods is None or request.method in methods):
+                key = account() if account is not None else None
+                key = key.strip().lower() if key else None
+                if key and account_by_address:
+                    key = '{0}/{1}'.format(request.remote_addr, key)
+                limiter.check(request.endpoint, request.remote_addr, key)
+            return func(*args, **kwargs)
+        return decorated_view
+    return decorator
+
+
+def form_field(name):
+    """Return a callable returning the value of the given field of the submitted form."""
+    return lambda: request.form.get(name)
+
+
+def view_arg(name):
+    """Return a callable returning the value of the given argument of the URL rule."""
+    return lambda: (request.view_args or dict()).get(name)
@@ -0,0 +1,331 @@
+"""SQL backend for people."""
+
+from contextlib import contextmanager
+import sqlite3
+import threading
+import time
+import uuid
+
+from flask import g
+
+from aliquis.hashing import verify_password
+from aliquis.person import person as new_person
+from aliquis.storage import NoSuchPersonError, PeopleBackend, PersonAlreadyExistsError, StorageError
+
+
+# Person attributes stored in the table of people, each one in the column of the same name
+PERSON_COLUMNS = ('username', 'email', 'first_name', 'surname', 'display_name', 'password',
+                  'description')
+
+# Usernames and email addresses are indexed (primary key and unique constraint)
+SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS people (
+        username TEXT NOT NULL PRIMARY KEY COLLATE NOCASE,
+        email TEXT UNIQUE COLLATE NOCASE,
+        first_name TEXT NOT NULL,
+        surname TEXT NOT NULL,
+        display_name TEXT,
+        password TEXT,
+        description TEXT,
+        active INTEGER NOT NULL DEFAULT 0
+    )''',
+    '''CREATE TABLE IF NOT EXISTS grants (
+        username TEXT NOT NULL COLLATE NOCASE
+            REFERENCES people (username) ON UPDATE CASCADE ON DELETE CASCADE,
+        name TEXT NOT NULL,
+        PRIMARY KEY (username, name)
+    )''',
+)
+
+
+class SQLPoolTimeoutError(StorageError):
+    """Raised when no pooled connection becomes available before the checkout timeout."""
+
+
+class SQLConnectionPool(object):
+    """A bounded pool of ``sqlite3.Connection`` instances.
+
+    ``factory`` is a callable taking no argument and returning a new connection. The pool never
+    holds more than ``max_size`` connections, which are opened on demand and kept open.
+    """
+
+    def __init__(self, factory, max_size=10, timeout=5):
+        if max_size < 1:
+            raise ValueError('Invalid pool size: max={0}'.format(max_size))
+        self._factory = factory
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle = []
+        self._size = 0
+        self._cond = threading.Condition()
+
+    @property
+    def size(self):
+        """Number of connections currently opened by the pool (idle or checked out)."""
+        return self._size
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection, yield it and give it back to the pool."""
+        conn = self.checkout()
+        try:
+            yield conn
+        finally:
+            self.checkin(conn)
+
+    def checkout(self, timeout=None):
+        """Return a connection from the pool.
+
+        Wait at most ``timeout`` seconds (pool default if ``None``) for a connection to be released
+        if the pool is exhausted, then raise ``SQLPoolTimeoutError``.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while not self._idle and self._size >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise SQLPoolTimeoutError('No SQL connection available after {0} '
+                                              'seconds'.format(timeout))
+                self._cond.wait(remaining)
+            if self._idle:
+                return self._idle.pop()
+            self._size += 1
+        try:
+            return self._factory()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def checkin(self, conn):
+        """Give the given connection back to the pool, rolling back any pending transaction."""
+        if conn.in_transaction:
+            conn.rollback()
+        with self._cond:
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def clear(self):
+        """Close all idle connections."""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            conn.close()
+
+
+class SQLBackend(PeopleBackend):
+    """Store person information in an SQLite database.
+
+    Each request uses a single pooled connection, opened in autocommit mode. An in-memory
+    database (``:memory:``) is shared by the connections of the backend, and lives as long as the
+    backend.
+    """
+
+    def __init__(self, app):
+        self._app = app
+        app.config.setdefault('SQL_POOL_SIZE', 10)
+        app.config.setdefault('SQL_TIMEOUT', 5)
+        database = app.config['SQL_DATABASE']
+        self._memory = database == ':memory:'
+        if self._memory:
+            database = 'file:aliquis-{0}?mode=memory&cache=shared'.format(uuid.uuid4().hex)
+        self._database = database
+        self._uri = database.startswith('file:')
+        self.pool = SQLConnectionPool(self._new_connection, max_size=app.config['SQL_POOL_SIZE'],
+                                      timeout=app.config['SQL_TIMEOUT'])
+        # An in-memory database is dropped when its last connection is closed
+        self._keeper = self._new_connection() if self._memory else None
+        with self.pool.connection() as conn:
+            for statement in SCHEMA:
+                conn.execute(statement)
+        app.teardown_appcontext(self._release_connection)
+
+    @property
+    def app(self):
+        """Return the Flask application instance tied to the backend."""
+        return self._app
+
+    def _new_connection(self):
+        """Return a new connection to the database."""
+        conn = sqlite3.connect(self._database, timeout=self._app.config['SQL_TIMEOUT'],
+                               isolation_level=None, check_same_thread=False, uri=self._uri)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA foreign_keys = ON')
+        if not self._memory:
+            # Readers do not block the writer and conversely
+            conn.execute('PRAGMA journal_mode = WAL')
+        return conn
+
+    @property
+    def connection(self):
+        """Return a pooled connection tied to the current application context.
+
+        The connection is checked out on first access and given back to the pool when the
+        application context is torn down.
+        """
+        conn = g.get('aliquis_sql_connection')
+        if conn is None:
+            conn = g.aliquis_sql_connection = self.pool.checkout()
+        return conn
+
+    def _release_connection(self, exception):
+        """Give the connection of the current application context back to the pool."""
+        conn = g.pop('aliquis_sql_connection', None)
+        if conn is not None:
+            self.pool.checkin(conn)
+
+    def _fetch_person(self, column, value):
+        """Return the row of the person whose given column has the given value, or ``None``."""
+        return self.connection.execute(
+            'SELECT {columns} FROM people WHERE {column} = ?'.format(
+                columns=', '.join(PERSON_COLUMNS), column=column
+            ), (value,)
+        ).fetchone()
+
+    @staticmethod
+    def _person_from_row(row):
+        """Return a ``Person`` instance from the given row of the table of people."""
+        return new_person(**dict((column, row[column]) for column in PERSON_COLUMNS
+                                 if row[column] is not None))
+
+    def get_person(self, username):
+        row = self._fetch_person('username', username)
+        return self._person_from_row(row) if row is not None else None
+
+    def get_person_by_email(self, email):
+        row = self._fetch_person('email', email)
+        return self._person_from_row(row) if row is not None else None
+
+    def authenticate(self, username, password):
+        row = self._fetch_person('username', username)
+        if row is None or not verify_password(password, row['password']):
+            return None
+        return self._person_from_row(row)
+
+    def used_attributes(self, **values):
+        values = dict((attr, value) for attr, value in values.items()
+                      if attr in ('username', 'email') and value)
+        if not values:
+            return set()
+        rows = self.connection.execute(
+            'SELECT username, email FROM people WHERE {0}'.format(
+                ' OR '.join('{0} = ?'.format(attr) for attr in sorted(values))
+            ), [values[attr] for attr in sorted(values)]
+        ).fetchall()
+        return set(attr for attr, value in values.items()
+                   for row in rows if (row[attr] or '').lower() == value.lower())
+
+    def is_available(self, attr, value):
+        if attr not in ('username', 'email'):
+            raise ValueError(u'Unknown person attribute: {0}'.format(attr))
+        if not value:
+            return True
+        return self.connection.execute(
+            'SELECT 1 FROM people WHERE {0} = ? LIMIT 1'.format(attr), (value,)
+        ).fetchone() is None
+
+    def _values(self, person, update_password=True):
+        """Return a ``dict`` of the column values of the given person."""
+        values = dict((column, getattr(person, column, None)) for column in PERSON_COLUMNS
+                      if column != 'password')
+        if update_password:
+            try:
+                values['password'] = person.password
+            except AttributeError:  # No password
+                values['password'] = None
+        return values
+
+    def _already_exists(self, person):
+        """Return the error telling which value of the given person is already used."""
+        used = self.used_attributes(username=person.username, email=person.email)
+        attr = 'username' if 'username' in used or not used else 'email'
+        return PersonAlreadyExistsError('There is already a person with {attr} {value}'.format(
+            attr=attr, value=getattr(person, attr)
+        ))
+
+    def create_person(self, person):
+        values = self._values(person)
+        try:
+            self.connection.execute('INSERT INTO people ({columns}) VALUES ({params})'.format(
+                columns=', '.join(values), params=', '.join('?' * len(values))
+            ), list(values.values()))
+        except sqlite3.IntegrityError:
+            raise self._already_exists(person)
+
+    def save_person(self, person, update_password=False):
+        values = self._values(person, update_password)
+        username = values.pop('username')
+        values = dict((column, value) for column, value in values.items() if value is not None)
+        try:
+            cur = self.connection.execute('UPDATE people SET {0} WHERE username = ?'.format(
+                ', '.join('{0} = ?'.format(column) for column in values)
+            ), list(values.values()) + [username])
+        except sqlite3.IntegrityError:
+            raise self._already_exists(person)
+        if cur.rowcount == 0:
+            raise NoSuchPersonError("No person with username '{0}' in "
+                                    'database'.format(username))
+
+    def replace_password_hash(self, username, old_hash, new_hash):
+        cur = self.connection.execute(
+            'UPDATE people SET password = ? WHERE username = ? AND password = ?',
+            (new_hash, username, old_hash)
+        )
+        return cur.rowcount > 0
+
+    def person_is_active(self, username):
+        row = self.connection.execute('SELECT active FROM people WHERE username = ?',
+                                      (username,)).fetchone()
+        return row is not None and bool(row['active'])
+
+    def _set_active(self, username, active):
+        """Set the activation flag of the person with the given username."""
+        cur = self.connection.execute('UPDATE people SET active = ? WHERE username = ?',
+                                      (int(active), username))
+        if cur.rowcount == 0:
+            raise NoSuchPersonError("No person with username '{0}' in "
+                                    'database'.format(username))
+
+    def activate_person(self, username):
+        self._set_active(username, True)
+
+    def deactivate_person(self, username):
+        self._set_active(username, False)
+
+    def add_grant(self, username, name):
+        """Grant the access described by the given name to the person with the given username."""
+        self.connection.execute('INSERT OR IGNORE INTO grants (username, name) VALUES (?, ?)',
+                                (username, name))
+
+    def remove_grant(self, username, name):
+        """Revoke the access described by the given name from the person with the given
+        username."""
+        self.connection.execute('DELETE FROM grants WHERE username = ? AND name = ?',
+                                (username, name))
+
+    def person_grants(self, username):
+        return tuple(row['name'] for row in self.connection.execute(
+            'SELECT name FROM grants WHERE username = ? ORDER BY name', (username,)
+        ))
+
+    def people_grants(self, usernames):
+        usernames = list(usernames)
+        lookup = sorted(set(username for username in usernames if username))
+        grants = dict()
+        if lookup:
+            rows = self.connection.execute(
+                'SELECT people.username, grants.name FROM people LEFT JOIN grants '
+                'ON grants.username = people.username WHERE people.username IN ({0}) '
+                'ORDER BY grants.name'.format(', '.join('?' * len(lookup))), lookup
+            )
+            for row in rows:
+                names = grants.setdefault(row['username'].lower(), [])
+                if row['name'] is not None:
+                    names.append(row['name'])
+        return dict((username, tuple(grants[username.lower()])
+                     if username and username.lower() in grants else None)
+                    for username in usernames)
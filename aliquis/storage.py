@@ -0,0 +1,110 @@
+"""Interface of the backends storing people accounts."""
+
+from configparser import ParsingError
+
+
+STORAGE_BACKENDS = ('ldap', 'sql')
+
+
+class StorageError(Exception):
+    """Base class of the errors raised by people storage backends."""
+
+
+class NoSuchPersonError(StorageError, LookupError):
+    """Raised when a person to update is not in the storage backend."""
+
+
+class PersonAlreadyExistsError(StorageError):
+    """Raised when adding a person whose username or email address is already used."""
+
+
+class PeopleBackend(object):
+    """Store people accounts for the views.
+
+    Methods work in the current application context (backends check out their connections from
+    their own pool), so that views do not depend on the storage technology. People are ``Person``
+    instances and usernames and email addresses are compared case insensitively.
+    """
+
+    def get_person(self, username):
+        """Return the ``Person`` instance with the given username, or ``None`` if there is no
+        such person."""
+        raise NotImplementedError
+
+    def get_person_by_email(self, email):
+        """Return the ``Person`` instance with the given email address, or ``None`` if there is
+        no such person."""
+        raise NotImplementedError
+
+    def authenticate(self, username, password):
+        """Return the ``Person`` instance with the given username if the given clear text password
+        is its password, else ``None``."""
+        raise NotImplementedError
+
+    def used_attributes(self, **values):
+        """Return the ``set`` of person attribute names (among ``username`` and ``email``) whose
+        given value is already used by a person."""
+        raise NotImplementedError
+
+    def is_available(self, attr, value):
+        """Return ``True`` if the given value of the given person attribute (``username`` or
+        ``email``) is not used by any person.
+
+        This is meant to be called at each key stroke, so it should be cheap."""
+        return attr not in self.used_attributes(**{attr: value})
+
+    def create_person(self, person):
+        """Add the given (inactive) person.
+
+        Raise ``PersonAlreadyExistsError`` if its username or email address is already used."""
+        raise NotImplementedError
+
+    def save_person(self, person, update_password=False):
+        """Update the given person, its password only if ``update_password`` is ``True``.
+
+        Raise ``NoSuchPersonError`` if there is no person with its username."""
+        raise NotImplementedError
+
+    def replace_password_hash(self, username, old_hash, new_hash):
+        """Replace the stored password hash of the person with the given username by
+        ``new_hash``, only if it is still ``old_hash`` (so that a password changed meanwhile is
+        kept).
+
+        Return ``True`` if the hash was replaced."""
+        raise NotImplementedError
+
+    def person_is_active(self, username):
+        """Return ``True`` if the account of the person with the given username is activated."""
+        raise NotImplementedError
+
+    def activate_person(self, username):
+        """Activate the account of the person with the given username."""
+        raise NotImplementedError
+
+    def deactivate_person(self, username):
+        """Deactivate the account of the person with the given username."""
+        raise NotImplementedError
+
+    def person_grants(self, username):
+        """Return a tuple of strings, each string describing an access granted to the person with
+        the given username."""
+        raise NotImplementedError
+
+    def people_grants(self, usernames):
+        """Return a ``dict`` mapping each of the given usernames to the tuple of grants of the
+        corresponding person, or to ``None`` if there is no such person."""
+        raise NotImplementedError
+
+
+def create_people_backend(app):
+    """Return the people storage backend selected by the ``STORAGE_BACKEND`` option (``ldap`` by
+    default, or ``sql``) of the given Flask application."""
+    name = app.config.setdefault('STORAGE_BACKEND', 'ldap')
+    if name == 'ldap':
+        from aliquis.ldap import LDAPBackend
+        return LDAPBackend(app)
+    if name == 'sql':
+        from aliquis.sql import SQLBackend
+        return SQLBackend(app)
+    raise ParsingError("Invalid value for option 'STORAGE_BACKEND' in configuration. "
+                       'Expected: {values}'.format(values=STORAGE_BACKENDS))
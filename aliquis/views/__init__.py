@@ -1,4 +1,7 @@
-from flask import redirect, url_for
+import math
+
+from flask import Response, abort, current_app, jsonify, redirect, url_for
+from flask_babel import _
 from flask_login import current_user
 
 from aliquis.views.sign import sign
@@ -15,6 +18,15 @@ def home():
         return redirect(url_for('sign.login'))
 
 
+def metrics():
+    """Expose LDAP operation metrics of the current process in the Prometheus text format, if
+    the ``LDAP_METRICS`` option is enabled."""
+    ldap_backend = current_app.ldap_backend
+    if not current_app.config.get('LDAP_METRICS') or ldap_backend is None:
+        abort(404)
+    return Response(ldap_backend.metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
 def forbidden(e):
     return redirect(url_for('sign.error', code=403))
 
@@ -25,3 +37,17 @@ def page_not_found(e):
 
 def internal_error(e):
     return redirect(url_for('sign.error', code=500))
+
+
+def service_unavailable(e):
+    """Tell that a request was given up because the server is overloaded (e.g. too many
+    passwords are being hashed), for the client to retry later."""
+    return (jsonify({'message': _('The server is overloaded. Please try again in a moment.')}), 503,
+            {'Retry-After': '1'})
+
+
+def too_many_requests(e):
+    """Tell that a request was refused by the rate limiter, for the client to retry once the
+    given delay has passed."""
+    return (jsonify({'message': _('Too many requests. Please try again later.')}), 429,
+            {'Retry-After': str(int(math.ceil(e.retry_after)))})
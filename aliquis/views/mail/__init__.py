@@ -20,4 +20,10 @@ def send_sendgrid_email(recipient, subject, html_content, txt_content):
     config = current_app.config
     api_key = config['SENDGRID_API_KEY']
     sender = Contact(name=config['SENDGRID_SENDER_NAME'], email=config['SENDGRID_SENDER_EMAIL'])
-    sendgrid.send_email(sender, recipient, subject, html_content, txt_content, api_key)
+    api_url = config.get('SENDGRID_API_URL', sendgrid.SENDGRID_API_URL)
+    sendgrid.send_email(sender, recipient, subject, html_content, txt_content, api_key, api_url,
+                        pool_size=config.get('SENDGRID_POOL_SIZE', 10),
+                        connect_timeout=config.get('SENDGRID_CONNECT_TIMEOUT', 3.05),
+                        timeout=config.get('SENDGRID_TIMEOUT', 10),
+                        retries=config.get('SENDGRID_RETRIES', 3),
+                        backoff=config.get('SENDGRID_RETRY_BACKOFF', 0.5))
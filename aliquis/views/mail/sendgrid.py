@@ -1,8 +1,14 @@
 """Functions to send emails with sendgrid."""
 
 import json
+import logging
+import os
+import random
+import threading
+import time
 
 import requests
+from requests.adapters import HTTPAdapter
 
 
 SENDGRID_API_URL = 'https://api.sendgrid.com/v3'
@@ -10,45 +16,136 @@ SENDGRID_POST_HEADERS = {
     'Content-Type': 'application/json; charset=utf-8',
 }
 
+# Statuses of responses after which a mail is sent again
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
 
-def send_email(sender, recipient, subject, html_content, txt_content, api_key):
-    """Send an email with the given information using sendgrid API.
+# Longest wait before sending a mail again (longer Retry-After delays are not waited for)
+MAX_RETRY_DELAY = 30
 
-    ``sender`` and ``recipient`` must be ``Contact`` instances.
+logger = logging.getLogger(__name__)
+
+
+class SendGridClient(object):
+    """Client of the sendgrid API (at ``api_url``), sending mails through a pooled HTTP session.
+
+    Connections are kept alive between mails, at most ``pool_size`` of them being open at once.
+    Requests time out after ``connect_timeout`` seconds while connecting, ``timeout`` seconds while
+    waiting for the response. Mails refused with a 429 or 5xx status, or whose connection failed,
+    are sent again up to ``retries`` times, after a random delay of up to ``backoff`` seconds
+    doubled at each attempt (or the delay asked by a Retry-After header, if longer).
     """
-    post_headers = SENDGRID_POST_HEADERS.copy()
-    post_headers['Authorization'] = 'Bearer {0}'.format(api_key)
-    data = {
-        'content': [
-            {
-                'type': 'text/plain',
-                'value': txt_content,
+
+    def __init__(self, api_key, api_url=SENDGRID_API_URL, pool_size=10, connect_timeout=3.05,
+                 timeout=10, retries=3, backoff=0.5):
+        self.url = '{api_url}/mail/send'.format(api_url=api_url)
+        self.timeout = (connect_timeout, timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        self.session.headers.update(SENDGRID_POST_HEADERS)
+        self.session.headers['Authorization'] = 'Bearer {0}'.format(api_key)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def close(self):
+        """Close the connections of the client."""
+        self.session.close()
+
+    def retry_delay(self, attempt, response=None):
+        """Return the number of seconds to wait before the given retry (0 for the first one),
+        after the given response if any, or ``None`` if it is not worth waiting."""
+        delay = random.uniform(0, self.backoff * 2 ** attempt)
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after is not None and retry_after.isdigit():
+            delay = max(delay, int(retry_after))
+        return delay if delay <= MAX_RETRY_DELAY else None
+
+    def post(self, data):
+        """Post the given JSON document (``bytes``) to the mail sending endpoint, retrying if
+        needed, and return the response. Raise ``requests.RequestException`` on failure."""
+        attempt = 0
+        while True:
+            try:
+                response = self.session.post(self.url, data=data, timeout=self.timeout)
+            except requests.ConnectionError as err:
+                delay = self.retry_delay(attempt) if attempt < self.retries else None
+                if delay is None:
+                    raise
+                logger.warning('Cannot reach sendgrid (%s), retrying in %.2f s', err, delay)
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt >= self.retries:
+                    response.raise_for_status()
+                    return response
+                delay = self.retry_delay(attempt, response)
+                if delay is None:
+                    response.raise_for_status()
+                logger.warning('Sendgrid answered %s, retrying in %.2f s', response.status_code,
+                               delay)
+                response.close()
+            time.sleep(delay)
+            attempt += 1
+
+    def send(self, sender, recipient, subject, html_content, txt_content):
+        """Send an email with the given information.
+
+        ``sender`` and ``recipient`` must be ``Contact`` instances.
+        """
+        data = {
+            'content': [
+                {
+                    'type': 'text/plain',
+                    'value': txt_content,
+                },
+                {
+                    'type': 'text/html',
+                    'value': html_content,
+                }
+            ],
+            'from': {
+                'email': sender.email,
+                'name': sender.name,
+
             },
-            {
-                'type': 'text/html',
-                'value': html_content,
-            }
-        ],
-        'from': {
-            'email': sender.email,
-            'name': sender.name,
-
-        },
-        'personalizations': [
-            {
-                'to': [
-                    {
-                        'email': recipient.email,
-                        'name': recipient.name,
-                    }
-                ],
-            }
-        ],
-        'subject': subject,
-    }
-    response = requests.post(
-        '{api_url}/mail/send'.format(api_url=SENDGRID_API_URL),
-        headers=post_headers,
-        data=json.dumps(data, ensure_ascii=False).encode('utf-8')
-    )
-    response.raise_for_status()
+            'personalizations': [
+                {
+                    'to': [
+                        {
+                            'email': recipient.email,
+                            'name': recipient.name,
+                        }
+                    ],
+                }
+            ],
+            'subject': subject,
+        }
+        self.post(json.dumps(data, ensure_ascii=False).encode('utf-8'))
+
+
+_clients = dict()
+_clients_lock = threading.Lock()
+
+
+def get_client(api_key, api_url=SENDGRID_API_URL, **options):
+    """Return the client of the current process for the given API key, URL and options (see
+    ``SendGridClient``), created on first use.
+
+    Clients are not shared with forked processes (e.g. Celery worker processes), which get their
+    own connections."""
+    key = (os.getpid(), api_key, api_url, tuple(sorted(options.items())))
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = SendGridClient(api_key, api_url, **options)
+        return client
+
+
+def send_email(sender, recipient, subject, html_content, txt_content, api_key,
+               api_url=SENDGRID_API_URL, **options):
+    """Send an email with the given information using sendgrid API (at ``api_url``), through the
+    pooled client of the current process (see ``SendGridClient`` for ``options``).
+
+    ``sender`` and ``recipient`` must be ``Contact`` instances.
+    """
+    get_client(api_key, api_url, **options).send(sender, recipient, subject, html_content,
+                                                 txt_content)
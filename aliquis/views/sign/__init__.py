@@ -1,26 +1,25 @@
 """Aliquis blueprint allowing a user to sign up."""
 
-from contextlib import contextmanager
 from functools import wraps
 import mimetypes
 
 from flask import (Blueprint, abort, current_app, jsonify, make_response, render_template, redirect,
                    request, url_for)
 from flask_babel import _, lazy_gettext as _t, ngettext, get_locale
-from flask_ldap3_login import AuthenticationResponseStatus
-from flask_ldap3_login.forms import LDAPLoginForm
 from flask_login import current_user, login_required, login_user, logout_user
 from flask_login.config import EXEMPT_METHODS as LOGIN_EXEMPT_METHODS
 from flask_wtf import FlaskForm
 from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
-from ldap3 import ObjectDef, Reader, Writer
-from ldap3.core.exceptions import LDAPCursorError, LDAPNoSuchObjectResult
 from six import text_type
 from wtforms import StringField, PasswordField, TextField
 from wtforms.validators import DataRequired, Email, Length, Regexp
 
 from aliquis.extensions import ldap_manager, login_manager
+from aliquis.hashing import upgrade_password_in_background
+from aliquis.ldap import _person_from_user_info
+from aliquis.metrics import call_site
 from aliquis.person import person as new_person, USERNAME_REGEXP
+from aliquis.ratelimit import form_field, rate_limited, view_arg
 from aliquis.background_tasks import send_email_confirm_email, send_activation_notification
 
 
@@ -34,222 +33,12 @@ LDAP_ATTR_MAPPING = {
     'description': 'description',
 }
 
-LDAP_ATTR_REV_MAPPING = dict((v, k) for k, v in LDAP_ATTR_MAPPING.items())
-
 
 sign = Blueprint('sign', __name__,
                  static_folder='templates/static',
                  template_folder='templates')
 
 
-def _person_from_ldap_entry(ldap_dict):
-    """Return a ``Person`` instance from the given LDAP entry."""
-    person_dict = dict()
-    for ldap_attr, attr in LDAP_ATTR_REV_MAPPING.items():
-        try:
-            ldap_value = ldap_dict[ldap_attr]
-        except KeyError:
-            continue
-        ldap_value = ldap_value[0] if isinstance(ldap_value, list) else ldap_value
-        if attr == 'paswword':
-            person_dict[attr] = ldap_value.replace('{CRYPT}', '')
-        else:
-            person_dict[attr] = ldap_value
-    return new_person(**person_dict)
-
-
-def _username_exists(username):
-    """Check if username already exists in LDAP directory related to the Flask app."""
-    return bool(
-        current_app.ldap3_login_manager.get_user_info_for_username(username)
-    )
-
-
-def _email_exists(email):
-    """Check if email address already exists in LDAP directory related to the Flask app."""
-    ldap_manager = current_app.ldap3_login_manager
-    ldap_filter = '(&(mail={0}){1})'.format(email,
-                                            current_app.config['LDAP_USER_OBJECT_FILTER'])
-    return bool(ldap_manager.get_object(
-        dn=ldap_manager.full_user_search_dn,
-        filter=ldap_filter,
-        attributes=current_app.config.get('LDAP_GET_USER_ATTRIBUTES')
-    ))
-
-
-def _person_from_email(email):
-    """Return a ``Person`` instance from the given email address."""
-    ldap_manager = current_app.ldap3_login_manager
-    ldap_filter = '(&(mail={0}){1})'.format(email,
-                                            current_app.config['LDAP_USER_OBJECT_FILTER'])
-    entry = ldap_manager.get_object(
-        dn=ldap_manager.full_user_search_dn,
-        filter=ldap_filter,
-        attributes=current_app.config.get('LDAP_GET_USER_ATTRIBUTES')
-    )
-    if entry is None:
-        raise LDAPNoSuchObjectResult("No person with email '{0}' in "
-                                     'database'.format(email))
-    else:
-        return _person_from_ldap_entry(ldap_manager.get_user_info(entry['dn']))
-
-
-@contextmanager
-def _add_cursor(ldap_conn, search_class, base_dn, ldap_filter=None):
-    """Return a new ``ldap3.Writer`` cursor for adding a new entry in the LDAP directory.
-
-    Added entry must match given parameters.
-
-    This can be used as a context manager.
-    """
-    object_def = ObjectDef(search_class, ldap_conn)
-    cur_params = {
-        'connection': ldap_conn,
-        'object_def': object_def,
-        'base': base_dn,
-    }
-    if ldap_filter is not None:
-        cur_params['query'] = ldap_filter
-    wcur = Writer.from_cursor(Reader(**cur_params))
-    yield wcur
-    wcur.commit()
-
-
-@contextmanager
-def _update_cursor(read_cursor):
-    """Return a new ``ldap3.Writer`` cursor for updating entries in the LDAP directory.
-
-    The given read cursor must contains entries to be updated.
-
-    This can be used as a context manager.
-    """
-    wcur = Writer.from_cursor(read_cursor)
-    yield wcur
-    wcur.commit()
-
-
-@contextmanager
-def _read_cursor(ldap_conn, search_class, base_dn, ldap_filter=None):
-    """Return a new ``ldap3.Reader`` cursor for browsing an LDAP tree described by the given
-    parameters.
-
-    This can be used as a context manager.
-    """
-    object_def = ObjectDef(search_class, ldap_conn)
-    cur_params = {
-        'connection': ldap_conn,
-        'object_def': object_def,
-        'base': base_dn,
-    }
-    if ldap_filter is not None:
-        cur_params['query'] = ldap_filter
-    yield Reader(**cur_params)
-
-
-def _save_person_to_ldap(person, ldap_conn):
-    """Add the given person in the LDAP directory."""
-    config = current_app.config
-    ldap_manager = current_app.ldap3_login_manager
-    user_search_dn = ldap_manager.full_user_search_dn
-    rdn = '{attr}={value}'.format(attr=config['LDAP_USER_RDN_ATTRIBUTE'], value=person.username)
-    with _add_cursor(ldap_conn, config['LDAP_USER_CLASS'], user_search_dn,
-                     config.get('LDAP_USER_OBJECT_FILTER')) as wcur:
-        ldap_person = wcur.new('{rdn},{base_dn}'.format(rdn=rdn, base_dn=user_search_dn))
-        for attr in LDAP_ATTR_MAPPING:
-            value = getattr(person, attr, None)
-            if value is not None:
-                if attr == 'password':
-                    value = '{{CRYPT}}{0}'.format(value)
-                setattr(ldap_person, LDAP_ATTR_MAPPING[attr], value)
-        ldap_person.cn = u'{0} {1}'.format(person.first_name, person.surname)
-
-
-def _update_person_in_ldap(person, ldap_conn, update_password=False):
-    """Update the given person in the LDAP directory."""
-    config = current_app.config
-    ldap_manager = current_app.ldap3_login_manager
-    user_search_dn = ldap_manager.full_user_search_dn
-    # Find the person by its ursername or email
-    with _read_cursor(ldap_conn, config['LDAP_USER_CLASS'], user_search_dn,
-                      'uid:={username}'.format(username=person.username)) as cur:
-        cur.search()
-        assert len(cur) <= 1, ('Problem in your database: more than one user with username '
-                               "'{1}'".format(person.username))
-        if len(cur) == 0:
-            raise LDAPNoSuchObjectResult("No person with username '{0}' in "
-                                         'database'.format(person.username))
-        with _update_cursor(cur) as wcur:
-            entry = wcur[0]
-            for attr, ldap_attr in LDAP_ATTR_MAPPING.items():
-                value = getattr(person, attr, None)
-                if value is None or (attr == 'password' and not update_password):
-                    continue
-                if attr == 'password':
-                    value = '{{CRYPT}}{0}'.format(value)
-                try:
-                    ldap_value = getattr(entry, ldap_attr)
-                except LDAPCursorError:
-                    setattr(entry, ldap_attr, value)
-                else:
-                    if ldap_value.value != value:
-                        setattr(entry, ldap_attr, value)
-
-
-def _activate_ldap_person(person, ldap_conn):
-    """Activate the given LDAP person."""
-    config = current_app.config
-    ldap_manager = current_app.ldap3_login_manager
-    user_dn = ldap_manager.get_user_info_for_username(person.username)['dn']
-    # Find the avtive role
-    with _read_cursor(ldap_conn, config['LDAP_PERMISSION_CLASS'],
-                      ldap_manager.compiled_sub_dn(config['LDAP_PERMISSION_DN']),
-                      'cn:={name}'.format(name=config['LDAP_ACTIVE_PERM_NAME'])) as cur:
-        cur.search()
-        assert len(cur) <= 1, 'Problem in your database: more than one active role'
-        if len(cur) == 0:
-            raise LDAPNoSuchObjectResult('No active role')
-        with _update_cursor(cur) as wcur:
-            active_dns = wcur[0][config['LDAP_PERMISSION_ATTRIBUTE']]
-            if user_dn not in active_dns:
-                active_dns += user_dn
-
-
-def _deactivate_ldap_person(person, ldap_conn):
-    """Deactivate the given LDAP person."""
-    config = current_app.config
-    ldap_manager = current_app.ldap3_login_manager
-    user_dn = ldap_manager.get_user_info_for_username(person.username)['dn']
-    # Find the avtive role
-    with _read_cursor(ldap_conn, config['LDAP_PERMISSION_CLASS'],
-                      ldap_manager.compiled_sub_dn(config['LDAP_PERMISSION_DN']),
-                      'cn:={name}'.format(name=config['LDAP_ACTIVE_PERM_NAME'])) as cur:
-        cur.search()
-        assert len(cur) <= 1, 'Problem in your database: more than one active role'
-        if len(cur) == 0:
-            raise LDAPNoSuchObjectResult('No active role')
-        with _update_cursor(cur) as wcur:
-            active_dns = wcur[0][config['LDAP_PERMISSION_ATTRIBUTE']]
-            if user_dn in active_dns:
-                active_dns -= user_dn
-
-
-def _person_grants(username, ldap_conn):
-    """Return a tuple of strings, each string describing an access granted to the given username."""
-    config = current_app.config
-    ldap_manager = current_app.ldap3_login_manager
-    user_dn = ldap_manager.get_user_info_for_username(username)['dn']
-    # Find the roles
-    with _read_cursor(ldap_conn, config['LDAP_PERMISSION_CLASS'],
-                      ldap_manager.compiled_sub_dn(config['LDAP_PERMISSION_DN']),
-                      '(&({perm_attribute}:={user_dn})(!(cn:={active_perm_name})))'.format(
-                          perm_attribute=config['LDAP_PERMISSION_ATTRIBUTE'],
-                          user_dn=user_dn,
-                          active_perm_name=config['LDAP_ACTIVE_PERM_NAME']
-                      )) as cur:
-        cur.search()
-        return tuple(entry['description'].value for entry in cur)
-
-
 class SignUpForm(FlaskForm):
     """Sign up form for ANA."""
 
@@ -269,22 +58,38 @@ class SignUpForm(FlaskForm):
                             description=_t('What services are you interested in ?'))
 
     def validate(self):
-        result = super(SignUpForm, self).validate()
-        if _username_exists(self.username.data):
+        valid = super(SignUpForm, self).validate()
+        if not valid:
+            return False
+        existing = current_app.people_backend.used_attributes(username=self.username.data,
+                                                              email=self.email.data)
+        if 'username' in existing:
             self.username.errors.append(_t('Username already exists'))
-            result = False
-        if _email_exists(self.email.data):
+        if 'email' in existing:
             self.email.errors.append(_t('Email address already exists'))
-            result = False
-        return result
+        return not existing
+
 
+class LoginForm(FlaskForm):
+    """Login form for ANA.
 
-class LoginForm(LDAPLoginForm):
-    """Login form for ANA."""
+    Once validated, the form ``user`` attribute is the authenticated ``Person``."""
 
     username = StringField(_t('Username'), validators=[DataRequired()])
     password = PasswordField(_t('Password'), validators=[DataRequired()])
 
+    def validate(self):
+        valid = super(LoginForm, self).validate()
+        if not valid:
+            return False
+        self.user = current_app.people_backend.authenticate(self.username.data,
+                                                            self.password.data)
+        if self.user is None:
+            self.username.errors.append('Invalid Username/Password.')
+            self.password.errors.append('Invalid Username/Password.')
+            return False
+        return True
+
 
 class UserForm(FlaskForm):
     """Update user data form."""
@@ -306,12 +111,11 @@ class ChangeEmailForm(FlaskForm):
         valid = super(ChangeEmailForm, self).validate()
         if not valid:
             return False
-        auth_result = current_app.ldap3_login_manager.authenticate(current_user.username,
-                                                                   self.current_password.data)
-        if auth_result.status != AuthenticationResponseStatus.success:
+        backend = current_app.people_backend
+        if backend.authenticate(current_user.username, self.current_password.data) is None:
             self.current_password.errors.append(_t('Wrong password'))
             return False
-        if _email_exists(self.new_email.data):
+        if 'email' in backend.used_attributes(email=self.new_email.data):
             self.new_email.errors.append(_t('Email address already exists'))
             return False
         return True
@@ -327,9 +131,8 @@ class ChangePasswordForm(FlaskForm):
         valid = super(ChangePasswordForm, self).validate()
         if not valid:
             return False
-        auth_result = current_app.ldap3_login_manager.authenticate(current_user.username,
-                                                                   self.current_password.data)
-        if auth_result.status != AuthenticationResponseStatus.success:
+        if current_app.people_backend.authenticate(current_user.username,
+                                                   self.current_password.data) is None:
             self.current_password.errors.append(_t('Wrong password'))
             return False
         return True
@@ -350,7 +153,7 @@ class ForgetForm(FlaskForm):
         valid = super(ForgetForm, self).validate()
         if not valid:
             return False
-        if not _email_exists(self.email.data):
+        if 'email' not in current_app.people_backend.used_attributes(email=self.email.data):
             self.email.errors.append(_t('No user found with this email address'))
             return False
         return True
@@ -375,15 +178,14 @@ def same_user_id_required(func):
 
 @ldap_manager.save_user
 def save_user(dn, username, ldap_dict, memberships):
-    return _person_from_ldap_entry(ldap_dict)
+    return _person_from_user_info(ldap_dict)
 
 
 @login_manager.user_loader
+@call_site
 def load_user(username):
     try:
-        return _person_from_ldap_entry(
-            current_app.ldap3_login_manager.get_user_info_for_username(username)
-        )
+        return current_app.people_backend.get_person(username)
     except Exception:
         return None
 
@@ -397,7 +199,7 @@ def user(user_id):
         person_dict = dict((k, v) for k, v in form.data.items() if k in LDAP_ATTR_MAPPING)
         person_dict['username'] = current_user.username
         p = new_person(**person_dict)
-        _update_person_in_ldap(p, current_app.ldap3_login_manager.connection)
+        current_app.people_backend.save_person(p)
         return jsonify({'id': p.username}), 200
     return render_template('sign/index.html')
 
@@ -406,12 +208,12 @@ def user(user_id):
 @same_user_id_required
 def change_email(user_id):
     """View allowing to change the person's email."""
-    ldap_manager = current_app.ldap3_login_manager
     form = ChangeEmailForm(meta={'locales': [get_locale()]})
     if form.validate_on_submit():
+        backend = current_app.people_backend
         current_user.email = form.new_email.data
-        _update_person_in_ldap(current_user, ldap_manager.connection)
-        _deactivate_ldap_person(current_user, ldap_manager.connection)
+        backend.save_person(current_user)
+        backend.deactivate_person(current_user.username)
         token_serializer = URLSafeTimedSerializer(current_app.config['SECRET_KEY'])
         send_email_confirm_email.delay(
             person_dict=current_user.as_json(),
@@ -443,8 +245,7 @@ def change_password(user_id):
     form = ChangePasswordForm(meta={'locales': [get_locale()]})
     if form.validate_on_submit():
         current_user.password = form.new_password.data
-        _update_person_in_ldap(current_user, current_app.ldap3_login_manager.connection,
-                               update_password=True)
+        current_app.people_backend.save_person(current_user, update_password=True)
         return jsonify({'id': user_id}), 200
     errors = [{
         'field': field.name,
@@ -462,11 +263,12 @@ def change_password(user_id):
 
 
 @sign.route('/forget', methods=['GET', 'POST'])
+@rate_limited(account=form_field('email'), methods=('POST',))
 def forget_password():
     """View allowing to change the person's password."""
     form = ForgetForm(meta={'locales': [get_locale()]})
     if form.validate_on_submit():
-        p = _person_from_email(form.email.data)
+        p = current_app.people_backend.get_person_by_email(form.email.data)
         token_serializer = URLSafeTimedSerializer(current_app.config['SECRET_KEY'])
         send_email_confirm_email.delay(
             person_dict=p.as_json(),
@@ -494,26 +296,54 @@ def forget_password():
 @same_user_id_required
 def api_user(user_id):
     """View showing and updating a person's data."""
-    return jsonify(dict((k, v) for k, v in _person_from_ldap_entry(
-        current_app.ldap3_login_manager.get_user_info_for_username(user_id)
-    ).as_json().items()))
+    return jsonify(current_app.people_backend.get_person(user_id).as_json())
 
 
 @sign.route('/api/grants/<user_id>')
 @same_user_id_required
 def api_grants(user_id):
     """API view returning a person's grant."""
-    return jsonify(list(_person_grants(user_id, current_app.ldap3_login_manager.connection)))
+    return jsonify(list(current_app.people_backend.person_grants(user_id)))
+
+
+@sign.route('/api/grants')
+@login_required
+def api_people_grants():
+    """API view returning grants of many people, given by their username with ``user`` query
+    parameters, as a JSON object whose values are ``null`` for unknown usernames.
+
+    Only people having the grant given by the ``API_GRANTS_READER`` option can use this view."""
+    backend = current_app.people_backend
+    reader_grant = current_app.config.get('API_GRANTS_READER')
+    if not reader_grant or reader_grant not in backend.person_grants(current_user.username):
+        abort(403)
+    grants = backend.people_grants(request.args.getlist('user'))
+    return jsonify(dict((username, list(user_grants) if user_grants is not None else None)
+                        for username, user_grants in grants.items()))
+
+
+@sign.route('/api/available')
+def api_available():
+    """API view telling whether the username and/or email address given as query parameters are
+    still free, for checking them while the sign up form is being filled."""
+    values = dict((attr, request.args[attr].strip()) for attr in ('username', 'email')
+                  if request.args.get(attr, '').strip())
+    if not values:
+        abort(400)
+    backend = current_app.people_backend
+    return jsonify(dict((attr, backend.is_available(attr, value))
+                        for attr, value in values.items()))
 
 
 @sign.route('/sign-up', methods=['GET', 'POST'])
+@rate_limited(account=form_field('email'), methods=('POST',))
 def sign_up():
     if current_user.is_authenticated:
         return redirect(url_for('.user', user_id=current_user.username))
     form = SignUpForm(meta={'locales': [get_locale()]})
     if form.validate_on_submit():
         p = new_person(**dict((k, v) for k, v in form.data.items() if k in LDAP_ATTR_MAPPING))
-        _save_person_to_ldap(p, current_app.ldap3_login_manager.connection)
+        current_app.people_backend.create_person(p)
         token_serializer = URLSafeTimedSerializer(current_app.config['SECRET_KEY'])
         send_email_confirm_email.delay(
             person_dict=p.as_json(),
@@ -537,16 +367,21 @@ def sign_up():
 
 
 @sign.route('/login', methods=['GET', 'POST'])
+@rate_limited(account=form_field('username'), methods=('POST',), account_by_address=True)
 def login():
     if current_user.is_authenticated:
         return redirect(url_for('.user', user_id=current_user.username))
     form = LoginForm(meta={'locales': [get_locale()]})
     if form.validate_on_submit():
-        p = _person_from_ldap_entry(
-            current_app.ldap3_login_manager.get_user_info_for_username(form.username.data)
-        )
-        login_user(p, force=True)
-        return jsonify({'id': form.username}), 200
+        login_user(form.user, force=True)
+        try:
+            hashed = form.user.password
+        except AttributeError:  # Password not known
+            hashed = None
+        if current_app.password_hasher.needs_update(hashed):
+            upgrade_password_in_background(current_app._get_current_object(), form.user.username,
+                                           form.password.data)
+        return jsonify({'id': form.user.username}), 200
     if form.username.errors:
         msg = u'{0}. '.format(_('Login failed'))
         if 'Invalid Username/Password.' in form.username.errors:
@@ -571,10 +406,10 @@ def confirm(token):
 
 
 @sign.route('/api/confirm/<token>')
+@rate_limited(account=view_arg('token'))
 def api_confirm(token):
     """API view for confirming email address."""
     config = current_app.config
-    ldap_manager = current_app.ldap3_login_manager
     token_serializer = URLSafeTimedSerializer(config['SECRET_KEY'])
     try:
         username = token_serializer.loads(token, max_age=3600)
@@ -587,15 +422,13 @@ def api_confirm(token):
         msg_cls = 'is-danger'
         http_code = 403
     else:
-        p = _person_from_ldap_entry(
-            ldap_manager.get_user_info_for_username(username)
-        )
+        p = current_app.people_backend.get_person(username)
         if p.is_active:
             msg = _('This account is already activated. You can log in.')
             msg_cls = 'is-info'
             http_code = 200
         else:
-            _activate_ldap_person(p, ldap_manager.connection)
+            current_app.people_backend.activate_person(p.username)
             msg = _('Thank you for confirming. Your account is now activated and you may now log '
                     'in.')
             msg_cls = 'is-success'
@@ -629,7 +462,6 @@ def reset_password(token):
     http_code = 0
     if form.validate_on_submit():
         config = current_app.config
-        ldap_manager = current_app.ldap3_login_manager
         token_serializer = URLSafeTimedSerializer(config['SECRET_KEY'])
         try:
             username = token_serializer.loads(token, max_age=900)
@@ -645,12 +477,9 @@ def reset_password(token):
             })
             http_code = 403
         else:
-            p = _person_from_ldap_entry(
-                ldap_manager.get_user_info_for_username(username)
-            )
+            p = current_app.people_backend.get_person(username)
             p.password = form.new_password.data
-            _update_person_in_ldap(p, current_app.ldap3_login_manager.connection,
-                                   update_password=True)
+            current_app.people_backend.save_person(p, update_password=True)
             return jsonify({'id': p.username}), 200
     errors.extend([{
         'field': field.name,
@@ -0,0 +1,411 @@
+"""End-to-end load test of the sign blueprint.
+
+The application is created as usual, then its people backend is replaced by a fake directory
+(``ldap3.MOCK_SYNC``, optionally populated with existing people) and mails are sent to a local
+fake SendGrid server, by the requests calling the mail tasks rather than by a Celery worker.
+Virtual users then go concurrently through the whole account life cycle: availability check,
+sign up, confirmation of the email address (with the token of the mail received by the fake
+server), login, profile reading and update, and logout.
+
+Requests go through the WSGI test client by default, or through real sockets to a threaded HTTP
+server with ``--sockets``. For each endpoint, throughput, latency percentiles and the numbers of
+LDAP operations and mails sent per request are reported.
+
+Run it from the repository root with::
+
+    python -m benchmarks.http_load --users 200 --concurrency 8 --output results.json
+"""
+
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from importlib import import_module
+import json
+import platform
+import re
+import threading
+import time
+
+import click
+import requests
+from flask import request
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from aliquis import background_tasks, create_app, read_config
+from aliquis.ldap import LDAPBackend
+from aliquis.metrics import LDAPMetrics
+from benchmarks.ldap_backend import TEST_CONFIG, percentile, populate
+
+
+# Endpoints requested by each virtual user, in this order
+ENDPOINTS = ('sign.api_available', 'sign.sign_up', 'sign.api_confirm', 'sign.login',
+             'sign.api_user', 'sign.user', 'sign.logout')
+
+# The module of the sign blueprint (hidden by the blueprint itself in ``aliquis.views``)
+sign_views = import_module('aliquis.views.sign')
+
+# Celery tasks sending mails, called by the views
+MAIL_TASKS = ('send_email_confirm_email', 'send_activation_notification')
+
+PASSWORD = 'load1234'
+
+_TOKEN_REGEXP = re.compile(r'/confirm/([\w.-]+)')
+
+
+class FakeSendGrid(object):
+    """Local HTTP server accepting the mails sent to the SendGrid API, and keeping them."""
+
+    def __init__(self):
+        self.messages = []
+        self._lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # Keep connections alive, like the real API
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                with fake._lock:
+                    fake.messages.append(json.loads(body.decode('utf-8')))
+                self.send_response(202)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        """Base URL of the fake API, for the ``SENDGRID_API_URL`` option."""
+        return 'http://127.0.0.1:{0}/v3'.format(self._server.server_address[1])
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def token(self, email):
+        """Return the token of the last confirmation link sent to the given email address, or
+        ``None`` if there is none."""
+        with self._lock:
+            messages = list(self.messages)
+        for message in reversed(messages):
+            recipients = [to['email'] for personalization in message['personalizations']
+                          for to in personalization['to']]
+            if email in recipients:
+                match = _TOKEN_REGEXP.search(message['content'][0]['value'])
+                if match is not None:
+                    return match.group(1)
+        return None
+
+
+class RequestCounters(threading.local):
+    """Numbers of LDAP operations and mails of the request handled by the current thread."""
+
+    def __init__(self):
+        self.ldap = 0
+        self.mails = 0
+
+
+class CountingMetrics(LDAPMetrics):
+    """LDAP metrics also counting the operations of the request handled by the current thread."""
+
+    def __init__(self, counters):
+        super(CountingMetrics, self).__init__()
+        self.counters = counters
+
+    def observe(self, *args, **kwargs):
+        self.counters.ldap += 1
+        super(CountingMetrics, self).observe(*args, **kwargs)
+
+
+class FakeDirectoryBackend(LDAPBackend):
+    """LDAP backend on a fake directory, whose operations are counted.
+
+    A fake directory cannot bind people whose passwords are hashed, so passwords are checked by
+    the backend instead."""
+
+    def __init__(self, app, counters):
+        super(FakeDirectoryBackend, self).__init__(app, fake=True)
+        self.metrics = CountingMetrics(counters)
+
+    def authenticate(self, username, password):
+        person = self.get_person(username)
+        if person is None or not person.check_password(password):
+            return None
+        return person
+
+
+class WSGIClient(object):
+    """Client of the application going through the WSGI test client."""
+
+    def __init__(self, app):
+        self._client = app.test_client()
+
+    def request(self, method, path, data=None):
+        response = self._client.open(path, method=method, data=data)
+        return response.status_code, response.get_json(silent=True)
+
+
+class HTTPClient(object):
+    """Client of the application going through real sockets (with keep-alive)."""
+
+    def __init__(self, base_url):
+        self._base_url = base_url
+        self._session = requests.Session()
+
+    def request(self, method, path, data=None):
+        response = self._session.request(method, self._base_url + path, data=data,
+                                         allow_redirects=False)
+        try:
+            return response.status_code, response.json()
+        except ValueError:
+            return response.status_code, None
+
+
+class InlineTask(object):
+    """Stand-in of a Celery task, running it in the application context of its caller."""
+
+    def __init__(self, task):
+        self.run = task.run
+
+    def __call__(self, *args, **kwargs):
+        return self.run(*args, **kwargs)
+
+    def delay(self, *args, **kwargs):
+        return self.run(*args, **kwargs)
+
+
+@contextmanager
+def send_mails_inline(counters):
+    """Send the mails of the views from the request sending them (rather than from a Celery
+    worker), counting the mails sent by the request handled by the current thread."""
+    send = background_tasks.send_sendgrid_email
+    tasks = dict((name, getattr(sign_views, name)) for name in MAIL_TASKS)
+
+    def counting_send(*args, **kwargs):
+        counters.mails += 1
+        return send(*args, **kwargs)
+
+    background_tasks.send_sendgrid_email = counting_send
+    for name, task in tasks.items():
+        setattr(sign_views, name, InlineTask(task))
+    try:
+        yield
+    finally:
+        background_tasks.send_sendgrid_email = send
+        for name, task in tasks.items():
+            setattr(sign_views, name, task)
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    """Request handler which does not log each request."""
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+@contextmanager
+def serve(app):
+    """Serve the given app with a threaded HTTP server on a free local port, and yield its base
+    URL."""
+    server = make_server('127.0.0.1', 0, app, threaded=True,
+                         request_handler=QuietRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield 'http://127.0.0.1:{0}'.format(server.server_port)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@contextmanager
+def _nothing():
+    yield None
+
+
+def setup_app(config, sendgrid_url, people=0):
+    """Return the app to load, storing people in a fake directory populated with ``people``
+    people, and the per request counters of its LDAP operations and mails.
+
+    Server side, the counts of each request are appended to the ``load_test_counts`` list of the
+    app, as ``(endpoint, LDAP operations, mails)`` tuples."""
+    app = create_app(read_config(config or TEST_CONFIG))
+    app.config.update({
+        'SECRET_KEY': 'load test',
+        'WTF_CSRF_ENABLED': False,
+        'SENDGRID_API_URL': sendgrid_url,
+        'NOTIFICATION_TO_NAME': 'Load Test',
+        'NOTIFICATION_TO_EMAIL': 'notifications@load.example.org',
+    })
+    counters = RequestCounters()
+    app.people_backend = app.ldap_backend = FakeDirectoryBackend(app, counters)
+    app.rate_limiter = None  # All the simulated users share the address of the load test
+    populate(app.people_backend, people)
+    app.load_test_counts = []
+    lock = threading.Lock()
+
+    @app.before_request
+    def reset_counters():
+        counters.ldap = counters.mails = 0
+
+    @app.after_request
+    def record_counters(response):
+        with lock:
+            app.load_test_counts.append((request.endpoint, counters.ldap, counters.mails))
+        return response
+
+    return app, counters
+
+
+def user_session(client, sendgrid, name):
+    """Go through the account life cycle of the virtual user with the given name, and return
+    the list of ``(endpoint, seconds, error)`` tuples of its requests."""
+    email = '{0}@load.example.org'.format(name)
+    profile = {'first_name': 'Load', 'surname': name, 'display_name': 'Load ' + name,
+               'description': 'Load test'}
+    sign_up = dict(profile, username=name, email=email, password=PASSWORD)
+    calls = []
+
+    def call(endpoint, method, path, data, expected):
+        start = time.perf_counter()
+        status, _ = client.request(method, path, data)
+        calls.append((endpoint, time.perf_counter() - start, status != expected))
+        return status == expected
+
+    call('sign.api_available', 'GET', '/api/available?username={0}&email={1}'.format(name, email),
+         None, 200)
+    if not call('sign.sign_up', 'POST', '/sign-up', sign_up, 201):
+        return calls
+    call('sign.api_confirm', 'GET', '/api/confirm/{0}'.format(sendgrid.token(email)), None, 201)
+    if not call('sign.login', 'POST', '/login', {'username': name, 'password': PASSWORD}, 200):
+        return calls
+    call('sign.api_user', 'GET', '/api/user/{0}'.format(name), None, 200)
+    call('sign.user', 'POST', '/user/{0}'.format(name), dict(profile, surname='Updated'), 200)
+    call('sign.logout', 'GET', '/logout', None, 302)
+    return calls
+
+
+def summarize(calls, counts, elapsed):
+    """Return a ``dict`` of statistics by endpoint, from the client side ``(endpoint, seconds,
+    error)`` calls and the server side ``(endpoint, LDAP operations, mails)`` counts of a run
+    which took ``elapsed`` seconds."""
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    for endpoint, seconds, error in calls:
+        latencies[endpoint].append(seconds)
+        errors[endpoint] += int(error)
+    server = defaultdict(lambda: [0, 0, 0])
+    for endpoint, ldap, mails in counts:
+        totals = server[endpoint]
+        totals[0] += 1
+        totals[1] += ldap
+        totals[2] += mails
+    results = dict()
+    for endpoint in ENDPOINTS:
+        endpoint_latencies = sorted(latencies[endpoint])
+        if not endpoint_latencies:
+            continue
+        handled, ldap, mails = server[endpoint]
+        results[endpoint] = {
+            'requests': len(endpoint_latencies),
+            'errors': errors[endpoint],
+            'requests_per_sec': len(endpoint_latencies) / elapsed,
+            'p50_ms': percentile(endpoint_latencies, 0.50) * 1000,
+            'p95_ms': percentile(endpoint_latencies, 0.95) * 1000,
+            'p99_ms': percentile(endpoint_latencies, 0.99) * 1000,
+            'max_ms': endpoint_latencies[-1] * 1000,
+            'ldap_per_request': ldap / handled if handled else None,
+            'mails_per_request': mails / handled if handled else None,
+        }
+    return results
+
+
+def run(users=100, concurrency=8, people=0, sockets=False, config=None):
+    """Run the load test with the given number of virtual users, run by ``concurrency`` threads,
+    and return the results as a ``dict``, ready to be saved as JSON."""
+    sendgrid = FakeSendGrid()
+    sendgrid.start()
+    try:
+        app, counters = setup_app(config, sendgrid.url, people)
+        with send_mails_inline(counters), (serve(app) if sockets else _nothing()) as base_url:
+            local = threading.local()
+
+            def user(i):
+                if not hasattr(local, 'client'):
+                    local.client = HTTPClient(base_url) if sockets else WSGIClient(app)
+                return user_session(local.client, sendgrid, 'load{0}'.format(i))
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                sessions = list(executor.map(user, range(users)))
+            elapsed = time.perf_counter() - start
+        calls = [call for session in sessions for call in session]
+        return {
+            'transport': 'sockets' if sockets else 'wsgi',
+            'date': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'users': users,
+            'concurrency': concurrency,
+            'people': people,
+            'elapsed_sec': elapsed,
+            'mails_received': len(sendgrid.messages),
+            'endpoints': summarize(calls, app.load_test_counts, elapsed),
+        }
+    finally:
+        sendgrid.stop()
+
+
+def format_results(results):
+    """Return a table of the results by endpoint."""
+    lines = [
+        '{users} users, {concurrency} threads, {people} people, {transport} ({elapsed:.1f} '
+        's)'.format(elapsed=results['elapsed_sec'], **results),
+        '  {0:<20} {1:>8} {2:>7} {3:>9} {4:>9} {5:>9} {6:>7} {7:>7}'.format(
+            'endpoint', 'req/sec', 'errors', 'p50 ms', 'p95 ms', 'p99 ms', 'ldap/r', 'mail/r'
+        ),
+    ]
+    for endpoint in ENDPOINTS:
+        stats = results['endpoints'].get(endpoint)
+        if stats is None:
+            continue
+        lines.append('  {0:<20} {1:>8.1f} {2:>7} {3:>9.2f} {4:>9.2f} {5:>9.2f} {6:>7.1f} '
+                     '{7:>7.1f}'.format(endpoint, stats['requests_per_sec'], stats['errors'],
+                                        stats['p50_ms'], stats['p95_ms'], stats['p99_ms'],
+                                        stats['ldap_per_request'] or 0,
+                                        stats['mails_per_request'] or 0))
+    return '\n'.join(lines)
+
+
+@click.command()
+@click.option('--users', type=int, default=100, help='Number of virtual users.')
+@click.option('--concurrency', type=int, default=8,
+              help='Number of virtual users running at the same time.')
+@click.option('--people', type=int, default=0,
+              help='Number of people already in the fake directory.')
+@click.option('--sockets', is_flag=True, default=False,
+              help='Send requests through real sockets rather than the WSGI test client.')
+@click.option('--config', type=click.Path(exists=True, dir_okay=False), default=None,
+              help='Configuration file of the application (test configuration by default).')
+@click.option('--output', type=click.File('w'), default=None,
+              help='JSON file where to save the results.')
+def main(users, concurrency, people, sockets, config, output):
+    """Load test the sign blueprint endpoints."""
+    results = run(users, concurrency, people, sockets, config)
+    click.echo(format_results(results))
+    if output is not None:
+        json.dump(results, output, indent=2, sort_keys=True)
+        output.write('\n')
+
+
+if __name__ == '__main__':
+    main()
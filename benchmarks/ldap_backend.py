@@ -0,0 +1,248 @@
+"""Benchmark of the LDAP backend at realistic directory sizes.
+
+The directory is populated with as many people as asked (all of them occupants of the active role),
+then each operation is run a number of times on random people and its throughput and latency
+percentiles are reported. By default the directory is a fake one (``ldap3.MOCK_SYNC``). Given a
+configuration file (``--config``), the LDAP server it describes is used instead, e.g. a local
+slapd: benchmark people are then added to it and removed at the end.
+
+Run it from the repository root with::
+
+    python -m benchmarks.ldap_backend --sizes 1000,10000,100000 --output results.json
+"""
+
+from datetime import datetime, timezone
+import json
+import math
+import os
+import platform
+import random
+import time
+
+import click
+from ldap3 import MODIFY_ADD, MODIFY_DELETE
+
+from aliquis import create_app, read_config
+from aliquis.ldap import LDAP_ATTR_MAPPING, LDAPBackend, _chunks
+from aliquis.person import person as new_person
+
+
+TEST_CONFIG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests',
+                           'test-settings.ini')
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+
+OPERATIONS = ('person_by_username', 'person_by_email', 'username_exists', 'add_person',
+              'update_person', 'deactivate', 'activate', 'is_active')
+
+# Hash of "benchmark", so that populating does not spend its time in crypt()
+PASSWORD = ('$6$bench$rTcfBSQF1ndDOzc4k2F67XqTGlm/DZdeB3d8OS.M.PKyUJNXYNmCr.qmFLVoyjCTGEf.R8Ja5'
+            '7aXsjY1WnLt2.')
+
+# Number of occupants added to the active role with each modification of a real server
+ROLE_CHUNK_SIZE = 1000
+
+
+def _username(i):
+    return 'bench{0}'.format(i)
+
+
+def _person(i):
+    return new_person(first_name='Bench', surname=str(i), username=_username(i),
+                      email='{0}@bench.example.org'.format(_username(i)), password=PASSWORD)
+
+
+def _dn(ldap_backend, username):
+    return 'uid={0},{1}'.format(username, ldap_backend._people_basedn)
+
+
+def _active_role_dn(ldap_backend):
+    return 'cn={0},{1}'.format(ldap_backend.app.config['LDAP_ACTIVE_PERM_NAME'],
+                               ldap_backend._roles_basedn)
+
+
+def populate(ldap_backend, size):
+    """Add ``size`` people to the directory, all of them occupants of the active role."""
+    config = ldap_backend.app.config
+    perm_attr = config['LDAP_PERMISSION_ATTRIBUTE']
+    dns = [_dn(ldap_backend, _username(i)) for i in range(size)]
+    with ldap_backend.admin_connection() as ldap_conn:
+        for i, dn in enumerate(dns):
+            person = _person(i)
+            attributes = dict((LDAP_ATTR_MAPPING[attr], getattr(person, attr))
+                              for attr in ('first_name', 'surname', 'username', 'email'))
+            attributes['userPassword'] = '{{CRYPT}}{0}'.format(person.password)
+            attributes['cn'] = u'{0} {1}'.format(person.first_name, person.surname)
+            if ldap_backend.fake:
+                attributes['objectClass'] = ldap_backend._person_class
+                ldap_conn.strategy.add_entry(dn, attributes)
+            else:
+                ldap_conn.add(dn, [ldap_backend._person_class], attributes)
+        role_dn = _active_role_dn(ldap_backend)
+        if ldap_backend.fake:
+            ldap_conn.strategy.add_entry(role_dn, {
+                'objectClass': config['LDAP_PERMISSION_CLASS'],
+                'cn': config['LDAP_ACTIVE_PERM_NAME'],
+                perm_attr: dns,
+            })
+        else:
+            for chunk in _chunks(dns, ROLE_CHUNK_SIZE):
+                ldap_conn.modify(role_dn, {perm_attr: [(MODIFY_ADD, chunk)]})
+
+
+def depopulate(ldap_backend, size, added):
+    """Remove benchmark people (the ``size`` initial ones and ``added`` ones) from a real
+    directory."""
+    perm_attr = ldap_backend.app.config['LDAP_PERMISSION_ATTRIBUTE']
+    dns = ([_dn(ldap_backend, _username(i)) for i in range(size)] +
+           [_dn(ldap_backend, username) for username in added])
+    with ldap_backend.admin_connection() as ldap_conn:
+        for chunk in _chunks(dns, ROLE_CHUNK_SIZE):
+            ldap_conn.modify(_active_role_dn(ldap_backend), {perm_attr: [(MODIFY_DELETE, chunk)]})
+        for dn in dns:
+            ldap_conn.delete(dn)
+
+
+def percentile(latencies, fraction):
+    """Return the given percentile (nearest rank) of the given sorted latencies."""
+    if not latencies:
+        return None
+    rank = max(1, int(math.ceil(fraction * len(latencies))))
+    return latencies[min(rank, len(latencies)) - 1]
+
+
+def summarize(latencies):
+    """Return a ``dict`` of throughput and latency statistics of the given latencies (in
+    seconds)."""
+    latencies = sorted(latencies)
+    total = sum(latencies)
+    return {
+        'operations': len(latencies),
+        'ops_per_sec': len(latencies) / total if total else None,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'max_ms': latencies[-1] * 1000,
+    }
+
+
+def measure(func, arguments):
+    """Call ``func`` with each of the given arguments and return the list of call latencies."""
+    latencies = []
+    for argument in arguments:
+        start = time.perf_counter()
+        func(argument)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def run_size(ldap_backend, size, operations, rng):
+    """Populate the directory with ``size`` people and return statistics of each operation, run
+    ``operations`` times."""
+    populate(ldap_backend, size)
+    picked = [rng.randrange(size) for _ in range(operations)]
+    added = []
+    results = dict()
+    try:
+        with ldap_backend.admin_connection() as ldap_conn:
+
+            def add(i):
+                person = new_person(first_name='New', surname=str(i),
+                                    username='benchnew{0}'.format(i),
+                                    email='benchnew{0}@bench.example.org'.format(i),
+                                    password=PASSWORD)
+                ldap_backend.add_person(person, ldap_conn)
+                added.append(person.username)
+
+            def update(i):
+                person = _person(i)
+                person.surname = 'Updated{0}'.format(i)
+                ldap_backend.update_person(person, ldap_conn, update_password=False)
+
+            def email(i):
+                return '{0}@bench.example.org'.format(_username(i))
+
+            calls = {
+                'person_by_username': lambda i: ldap_backend.person_by_username(_username(i),
+                                                                                ldap_conn),
+                'person_by_email': lambda i: ldap_backend.person_by_email(email(i), ldap_conn),
+                'username_exists': lambda i: ldap_backend.username_exists(_username(i),
+                                                                          ldap_conn),
+                'add_person': add,
+                'update_person': update,
+                'deactivate': lambda i: ldap_backend.deactivate(_dn(ldap_backend, _username(i)),
+                                                                ldap_conn),
+                'activate': lambda i: ldap_backend.activate(_dn(ldap_backend, _username(i)),
+                                                            ldap_conn),
+                'is_active': lambda i: ldap_backend.is_active(_dn(ldap_backend, _username(i)),
+                                                              ldap_conn),
+            }
+            for operation in OPERATIONS:
+                arguments = range(operations) if operation == 'add_person' else picked
+                results[operation] = summarize(measure(calls[operation], arguments))
+    finally:
+        if not ldap_backend.fake:
+            depopulate(ldap_backend, size, added)
+    return results
+
+
+def run(sizes=DEFAULT_SIZES, operations=200, config=None, seed=0, echo=None):
+    """Run the benchmark for each of the given directory sizes and return the results as a
+    ``dict``, ready to be saved as JSON."""
+    app = create_app(read_config(config or TEST_CONFIG))
+    fake = config is None
+    rng = random.Random(seed)
+    results = {
+        'directory': 'mock' if fake else app.config['LDAP_HOST'],
+        'date': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'operations': operations,
+        'seed': seed,
+        'sizes': dict(),
+    }
+    for size in sizes:
+        # A new fake backend is a new, empty, directory
+        ldap_backend = LDAPBackend(app, fake=fake)
+        start = time.perf_counter()
+        results['sizes'][str(size)] = run_size(ldap_backend, size, operations, rng)
+        if echo is not None:
+            echo(format_results(size, results['sizes'][str(size)],
+                                time.perf_counter() - start))
+        ldap_backend.pool.clear()
+    return results
+
+
+def format_results(size, size_results, elapsed):
+    """Return a table of the results for the given directory size."""
+    lines = [
+        '{0} people ({1:.1f} s)'.format(size, elapsed),
+        '  {0:<20} {1:>12} {2:>10} {3:>10}'.format('operation', 'ops/sec', 'p50 ms', 'p99 ms'),
+    ]
+    for operation in OPERATIONS:
+        stats = size_results[operation]
+        lines.append('  {0:<20} {1:>12.1f} {2:>10.3f} {3:>10.3f}'.format(
+            operation, stats['ops_per_sec'] or 0, stats['p50_ms'], stats['p99_ms']
+        ))
+    return '\n'.join(lines)
+
+
+@click.command()
+@click.option('--sizes', default=','.join(str(size) for size in DEFAULT_SIZES),
+              help='Comma separated numbers of people in the directory.')
+@click.option('--operations', type=int, default=200,
+              help='Number of times each operation is run for each size.')
+@click.option('--config', type=click.Path(exists=True, dir_okay=False), default=None,
+              help='Configuration file of a real LDAP server to use (fake directory by default).')
+@click.option('--seed', type=int, default=0, help='Seed of the random choice of people.')
+@click.option('--output', type=click.File('w'), default=None,
+              help='JSON file where to save the results.')
+def main(sizes, operations, config, seed, output):
+    """Benchmark LDAP backend operations at various directory sizes."""
+    sizes = [int(size) for size in sizes.split(',') if size.strip()]
+    results = run(sizes, operations, config, seed, echo=click.echo)
+    if output is not None:
+        json.dump(results, output, indent=2, sort_keys=True)
+        output.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -102,6 +102,8 @@ setup(
             'bumpversion',
         ],
         'test': ['pytest'],
+        'bcrypt': ['bcrypt'],
+        'argon2': ['argon2-cffi'],
     },
     package_data={
         project_name: package_data,
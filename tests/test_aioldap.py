@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+"""Tests about the asyncio front end to the LDAP backend."""
+
+import asyncio
+import os
+import unittest
+
+from ldap3.core.exceptions import LDAPEntryAlreadyExistsResult, LDAPNoSuchObjectResult
+
+from aliquis import create_app, read_config
+from aliquis.aioldap import AsyncLDAPBackend
+from aliquis.ldap import LDAPBackend
+from aliquis.person import person as new_person
+from tests.test_ldap import clean_people_tree, setup_add_ldap_person
+
+
+TEST_CONFIG = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'test-settings.ini')
+
+
+class TestAsyncLDAPBackend(unittest.TestCase):
+    """Check person operations awaited from asyncio code."""
+
+    def setUp(self):
+        super(TestAsyncLDAPBackend, self).setUp()
+        self.app = create_app(read_config(TEST_CONFIG))
+        self.ldap_backend = LDAPBackend(self.app, fake=True)
+        self.aio_backend = AsyncLDAPBackend(self.ldap_backend)
+        self.loop = asyncio.new_event_loop()
+        self.jdoe = {
+            'first_name': 'John',
+            'surname': 'Doe',
+            'email': 'jdoe@example.org',
+            'username': 'jdoe',
+        }
+        setup_add_ldap_person(self.ldap_backend, self.jdoe)
+
+    def tearDown(self):
+        super(TestAsyncLDAPBackend, self).tearDown()
+        self.loop.close()
+        self.aio_backend.close()
+        clean_people_tree(self.ldap_backend)
+
+    def run_coroutine(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def test_lookups(self):
+        """Check that people can be found and checked concurrently."""
+        async def lookups():
+            return await asyncio.gather(
+                self.aio_backend.person_by_username('jdoe'),
+                self.aio_backend.person_by_email('jdoe@example.org'),
+                self.aio_backend.username_exists('jdoe'),
+                self.aio_backend.email_exists('john@example.org'),
+                self.aio_backend.existing_attributes(username='jdoe', email='john@example.org'),
+            )
+        results = self.run_coroutine(lookups())
+        self.assertEqual(results, [new_person(**self.jdoe), new_person(**self.jdoe), True, False,
+                                   set(['username'])])
+        with self.assertRaises(LDAPNoSuchObjectResult):
+            self.run_coroutine(self.aio_backend.person_by_username('john'))
+
+    def test_add_and_update(self):
+        """Check that people can be added and updated."""
+        jane = new_person(first_name='Jane', surname='Doe', username='jane',
+                          email='jane@example.org')
+        self.run_coroutine(self.aio_backend.add_person(jane))
+        with self.assertRaises(LDAPEntryAlreadyExistsResult):
+            self.run_coroutine(self.aio_backend.add_person(jane))
+        jane.first_name = 'Janet'
+        self.run_coroutine(self.aio_backend.update_person(jane))
+        p = self.run_coroutine(self.aio_backend.person_by_username('jane'))
+        self.assertEqual(p.first_name, 'Janet')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+"""Tests about the benchmarks, so that they keep running."""
+
+import unittest
+
+from benchmarks import http_load
+from benchmarks.ldap_backend import OPERATIONS, percentile, run
+
+
+class TestLDAPBackendBenchmark(unittest.TestCase):
+    """Check the LDAP backend benchmark on a small fake directory."""
+
+    def test_percentile(self):
+        """Check nearest rank percentiles."""
+        latencies = list(range(1, 101))
+        self.assertEqual(percentile(latencies, 0.5), 50)
+        self.assertEqual(percentile(latencies, 0.99), 99)
+        self.assertEqual(percentile([3], 0.99), 3)
+
+    def test_run(self):
+        """Check that each operation is measured for each size."""
+        results = run(sizes=[20, 40], operations=5)
+        self.assertEqual(results['directory'], 'mock')
+        self.assertEqual(set(results['sizes']), set(['20', '40']))
+        for size_results in results['sizes'].values():
+            self.assertEqual(set(size_results), set(OPERATIONS))
+            for stats in size_results.values():
+                self.assertEqual(stats['operations'], 5)
+                self.assertLessEqual(stats['p50_ms'], stats['p99_ms'])
+
+
+class TestHTTPLoadTest(unittest.TestCase):
+    """Check the end-to-end load test of the sign blueprint on a few virtual users."""
+
+    def check_run(self, sockets):
+        results = http_load.run(users=4, concurrency=2, people=10, sockets=sockets)
+        self.assertEqual(set(results['endpoints']), set(http_load.ENDPOINTS))
+        for stats in results['endpoints'].values():
+            self.assertEqual(stats['requests'], 4)
+            self.assertEqual(stats['errors'], 0)
+            self.assertLessEqual(stats['p50_ms'], stats['p99_ms'])
+        # A confirmation mail at sign up, a notification at confirmation
+        self.assertEqual(results['endpoints']['sign.sign_up']['mails_per_request'], 1)
+        self.assertEqual(results['endpoints']['sign.api_confirm']['mails_per_request'], 1)
+        self.assertEqual(results['endpoints']['sign.api_user']['mails_per_request'], 0)
+        self.assertGreater(results['endpoints']['sign.sign_up']['ldap_per_request'], 0)
+        self.assertEqual(results['mails_received'], 8)
+
+    def test_run_wsgi(self):
+        """Check that each virtual user goes through every endpoint, through the WSGI client."""
+        self.check_run(sockets=False)
+
+    def test_run_sockets(self):
+        """Check that each virtual user goes through every endpoint, through real sockets."""
+        self.check_run(sockets=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
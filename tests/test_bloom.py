@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+"""Tests about the Bloom filter."""
+
+import unittest
+
+from aliquis.bloom import BloomFilter
+
+
+class TestBloomFilter(unittest.TestCase):
+    """Check the Bloom filter of strings."""
+
+    def test_no_false_negative(self):
+        """Check that added values are always members."""
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        values = [u'user{0}@example.org'.format(i) for i in range(1000)]
+        for value in values:
+            bloom.add(value)
+        self.assertTrue(all(value in bloom for value in values))
+        self.assertEqual(len(bloom), 1000)
+
+    def test_error_rate(self):
+        """Check that few values which were not added are reported as members."""
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        for i in range(1000):
+            bloom.add(u'user{0}'.format(i))
+        false_positives = sum(1 for i in range(10000) if u'other{0}'.format(i) in bloom)
+        self.assertLess(false_positives, 300)
+
+    def test_unicode(self):
+        """Check that non ASCII values can be added."""
+        bloom = BloomFilter(capacity=10)
+        bloom.add(u'jérôme')
+        self.assertIn(u'jérôme', bloom)
+        self.assertNotIn(u'jerome', bloom)
+
+    def test_invalid_parameters(self):
+        """Check that invalid parameters are rejected."""
+        with self.assertRaises(ValueError):
+            BloomFilter(capacity=0)
+        with self.assertRaises(ValueError):
+            BloomFilter(error_rate=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
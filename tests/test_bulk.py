@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+
+"""Tests about bulk import of people."""
+
+from datetime import datetime
+import io
+import json
+import os
+import unittest
+
+from aliquis import create_app, read_config
+from aliquis.bulk import export_people, import_people, people_from_rows, read_rows
+from aliquis.hashing import create_password_hasher
+from aliquis.ldap import LDAPBackend
+
+from tests.test_ldap import clean_people_tree, setup_add_ldap_person
+
+
+TEST_CONFIG = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'test-settings.ini')
+
+
+class TestReadRows(unittest.TestCase):
+    """Check reading rows to import."""
+
+    def test_csv(self):
+        """Check that CSV rows are read with their line number."""
+        stream = io.StringIO(u'username,first_name,surname\njdoe,John,Doe\njane,Jane,Doé\n')
+        self.assertEqual(list(read_rows(stream, 'csv')), [
+            (2, {'username': 'jdoe', 'first_name': 'John', 'surname': 'Doe'}),
+            (3, {'username': 'jane', 'first_name': 'Jane', 'surname': u'Doé'}),
+        ])
+
+    def test_jsonl(self):
+        """Check that JSON lines are read with their line number, skipping blank lines."""
+        stream = io.StringIO(u'{"username": "jdoe"}\n\n{"username": "jane"}\n')
+        self.assertEqual(list(read_rows(stream, 'jsonl')),
+                         [(1, {'username': 'jdoe'}), (3, {'username': 'jane'})])
+
+    def test_unknown_format(self):
+        """Check that an unknown format is rejected."""
+        with self.assertRaises(ValueError):
+            list(read_rows(io.StringIO(u''), 'xml'))
+
+
+class TestPeopleFromRows(unittest.TestCase):
+    """Check building people from rows."""
+
+    def test_hash_in_processes(self):
+        """Check that people are built in the row order, with hashed passwords, by worker
+        processes."""
+        rows = [(i, {'first_name': 'User', 'surname': str(i), 'username': 'user{0}'.format(i),
+                     'password': 'secret{0}'.format(i), 'unknown': 'ignored'})
+                for i in range(10)]
+        results = list(people_from_rows(iter(rows), processes=2))
+        self.assertEqual([line for line, _, _ in results], list(range(10)))
+        for i, (_, person, error) in enumerate(results):
+            self.assertIsNone(error)
+            self.assertEqual(person.username, 'user{0}'.format(i))
+            self.assertTrue(person.check_password('secret{0}'.format(i)))
+
+    def test_hash_with_app_hasher(self):
+        """Check that worker processes hash passwords with the scheme and parameters of the app
+        hasher, and do not start processes of their own, in an application context."""
+        app = create_app(read_config(TEST_CONFIG))
+        app.config['PASSWORD_HASH_ROUNDS'] = 1000
+        app.password_hasher = create_password_hasher(app)
+        rows = [(i, {'first_name': 'User', 'surname': str(i), 'username': 'user{0}'.format(i),
+                     'password': 'secret{0}'.format(i)})
+                for i in range(4)]
+        with app.app_context():
+            results = list(people_from_rows(iter(rows), processes=2))
+            for i, (_, person, error) in enumerate(results):
+                self.assertIsNone(error)
+                self.assertTrue(person.password.startswith('$6$rounds=1000$'))
+                self.assertTrue(person.check_password('secret{0}'.format(i)))
+        app.password_hasher.shutdown()
+
+    def test_invalid_row(self):
+        """Check that invalid rows give an error message instead of a person."""
+        results = list(people_from_rows([(1, {'first_name': 'John', 'username': 'jdoe'}),
+                                         (2, {'first_name': 'John', 'surname': 'Doe',
+                                              'username': '2jdoe'})],
+                                        processes=1))
+        self.assertEqual([(line, person) for line, person, _ in results], [(1, None), (2, None)])
+        self.assertTrue(all(message for _, _, message in results))
+
+
+class TestImportPeople(unittest.TestCase):
+    """Check importing people in the LDAP directory."""
+
+    def setUp(self):
+        super(TestImportPeople, self).setUp()
+        self.app = create_app(read_config(TEST_CONFIG))
+        self.ldap_backend = LDAPBackend(self.app, fake=True)
+        setup_add_ldap_person(self.ldap_backend, {
+            'first_name': 'John',
+            'surname': 'Doe',
+            'email': 'jdoe@example.org',
+            'username': 'jdoe',
+        })
+
+    def tearDown(self):
+        """Empty the LDAP tree after each test function."""
+        super(TestImportPeople, self).tearDown()
+        clean_people_tree(self.ldap_backend)
+
+    def test_report(self):
+        """Check that each row gets a result."""
+        stream = io.StringIO(u'{"first_name": "Jane", "surname": "Doe", "username": "jane"}\n'
+                             u'{"first_name": "John", "surname": "Doe", "username": "jdoe"}\n'
+                             u'{"first_name": "John", "username": "john"}\n'
+                             u'{"first_name": "Jim", "surname": "Doe", "username": "jim"}\n')
+        results = sorted(import_people(self.ldap_backend, read_rows(stream, 'jsonl'),
+                                       processes=1, batch_size=2))
+        self.assertEqual([(r.line, r.username, r.status) for r in results], [
+            (1, 'jane', 'added'),
+            (2, 'jdoe', 'exists'),
+            (3, None, 'invalid'),
+            (4, 'jim', 'added'),
+        ])
+        self.assertIn('username jdoe', results[1].message)
+        with self.ldap_backend.admin_connection() as ldap_conn:
+            self.assertTrue(self.ldap_backend.username_exists('jim', ldap_conn))
+
+
+class TestExportPeople(unittest.TestCase):
+    """Check exporting people of the LDAP directory."""
+
+    def setUp(self):
+        super(TestExportPeople, self).setUp()
+        self.app = create_app(read_config(TEST_CONFIG))
+        self.ldap_backend = LDAPBackend(self.app, fake=True)
+        for username, surname, timestamp in (('jdoe', 'Doe', '20170101000000Z'),
+                                             ('jane', u'Doé', '20180601120000Z'),
+                                             ('jim', 'Doe', '20190101000000Z')):
+            setup_add_ldap_person(self.ldap_backend, {
+                'first_name': 'John',
+                'surname': surname,
+                'email': '{0}@example.org'.format(username),
+                'username': username,
+                'password': '$6$salt$hash',
+            })
+            with self.ldap_backend.admin_connection() as ldap_conn:
+                dn = 'uid={0},{1}'.format(username, self.ldap_backend._people_basedn)
+                ldap_conn.strategy.connection.server.dit[dn]['modifyTimestamp'] = [
+                    timestamp.encode('ascii')
+                ]
+
+    def tearDown(self):
+        """Empty the LDAP tree after each test function."""
+        super(TestExportPeople, self).tearDown()
+        clean_people_tree(self.ldap_backend)
+
+    def test_jsonl(self):
+        """Check that exported JSON lines can be read back by the import."""
+        stream = io.StringIO()
+        self.assertEqual(export_people(self.ldap_backend, stream, 'jsonl', page_size=2), 3)
+        stream.seek(0)
+        rows = sorted((row for _, row in read_rows(stream, 'jsonl')),
+                      key=lambda row: row['username'])
+        self.assertEqual(rows[0], {'first_name': 'John', 'surname': u'Doé', 'username': 'jane',
+                                   'display_name': u'John Doé', 'email': 'jane@example.org',
+                                   'password': '$6$salt$hash'})
+
+    def test_ldif(self):
+        """Check that people are exported as LDIF records, non ASCII values being encoded."""
+        stream = io.StringIO()
+        export_people(self.ldap_backend, stream, 'ldif')
+        ldif = stream.getvalue()
+        self.assertTrue(ldif.startswith('version: 1\n\n'))
+        self.assertEqual(ldif.count('dn: '), 3)
+        self.assertIn('dn: uid=jane,{0}\n'.format(self.ldap_backend._people_basedn), ldif)
+        self.assertIn('sn:: RG/DqQ==\n', ldif)
+        self.assertIn('userPassword: {CRYPT}$6$salt$hash\n', ldif)
+
+    def test_projection(self):
+        """Check that only requested attributes are exported."""
+        stream = io.StringIO()
+        export_people(self.ldap_backend, stream, 'jsonl', attributes=['username', 'email'])
+        for line in stream.getvalue().splitlines():
+            self.assertEqual(set(json.loads(line)), set(['username', 'email']))
+
+    def test_since(self):
+        """Check that only people modified since the given date are exported."""
+        stream = io.StringIO()
+        count = export_people(self.ldap_backend, stream, 'jsonl', attributes=['username'],
+                              since=datetime(2018, 1, 1))
+        self.assertEqual(count, 2)
+        self.assertEqual(sorted(json.loads(line)['username']
+                                for line in stream.getvalue().splitlines()), ['jane', 'jim'])
+
+
+if __name__ == '__main__':
+    unittest.main()
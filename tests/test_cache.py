@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+"""Tests about in-process caches."""
+
+import time
+import unittest
+
+from aliquis.cache import LRUCache
+
+
+class TestLRUCache(unittest.TestCase):
+    """Check the bounded LRU cache with expiration."""
+
+    def test_get_set(self):
+        """Check that cached values are returned and counted as hits."""
+        cache = LRUCache(maxsize=2, ttl=60)
+        self.assertIsNone(cache.get('jdoe'))
+        cache.set('jdoe', 1)
+        self.assertEqual(cache.get('jdoe'), 1)
+        self.assertEqual(cache.stats, {'hits': 1, 'misses': 1, 'evictions': 0, 'expirations': 0,
+                                       'size': 1})
+
+    def test_lru_eviction(self):
+        """Check that the least recently used entry is evicted when the cache is full."""
+        cache = LRUCache(maxsize=2, ttl=60)
+        cache.set('jdoe', 1)
+        cache.set('jane', 2)
+        cache.get('jdoe')
+        cache.set('john', 3)
+        self.assertIsNone(cache.get('jane'))
+        self.assertEqual(cache.get('jdoe'), 1)
+        self.assertEqual(cache.get('john'), 3)
+        self.assertEqual(cache.evictions, 1)
+        self.assertEqual(len(cache), 2)
+
+    def test_expiration(self):
+        """Check that entries expire after the time to live."""
+        cache = LRUCache(maxsize=2, ttl=0.01)
+        cache.set('jdoe', 1)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get('jdoe'))
+        self.assertEqual(cache.expirations, 1)
+        self.assertEqual(len(cache), 0)
+
+    def test_discard(self):
+        """Check that a discarded entry is not returned anymore."""
+        cache = LRUCache()
+        cache.set('jdoe', 1)
+        cache.discard('jdoe')
+        cache.discard('jane')
+        self.assertIsNone(cache.get('jdoe'))
+
+    def test_disabled(self):
+        """Check that nothing is cached when the maximum size is 0."""
+        cache = LRUCache(maxsize=0)
+        cache.set('jdoe', 1)
+        self.assertIsNone(cache.get('jdoe'))
+
+
+if __name__ == '__main__':
+    unittest.main()
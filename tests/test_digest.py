@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+"""Tests about digests of account activations."""
+
+from configparser import ParsingError
+import os
+import time
+import unittest
+
+from aliquis import create_app, read_config
+from aliquis.background_tasks import send_activation_digest
+from aliquis.digest import (ActivationDigest, MemoryDigestStore, RedisDigestStore,
+                            create_activation_digest)
+
+from tests.test_sendgrid import FakeAPI
+
+
+TEST_CONFIG = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'test-settings.ini')
+
+
+def person_dict(first_name):
+    return {
+        'first_name': first_name,
+        'surname': 'Doe',
+        'display_name': '{0} Doe'.format(first_name),
+        'email': '{0}@example.org'.format(first_name.lower()),
+        'username': first_name.lower(),
+        'description': 'Wiki access',
+    }
+
+
+class TestActivationDigest(unittest.TestCase):
+    """Check when activations waiting in a digest are sent."""
+
+    def setUp(self):
+        super(TestActivationDigest, self).setUp()
+        self.sent = []
+        self.delays = []
+        self.digest = ActivationDigest(MemoryDigestStore(), self.sent.append, self.delays.append,
+                                       interval=60, size=3)
+
+    def test_interval(self):
+        """Check that a flush is scheduled after the interval once a first activation waits."""
+        self.digest.add(person_dict('John'))
+        self.digest.add(person_dict('Jane'))
+        self.assertEqual(self.delays, [60])
+        self.digest.flush()
+        self.assertEqual([[p['username'] for p in people] for people in self.sent],
+                         [['john', 'jane']])
+        self.digest.flush()
+        self.assertEqual(len(self.sent), 1)
+        self.digest.add(person_dict('Jim'))
+        self.assertEqual(self.delays, [60, 60])
+
+    def test_size(self):
+        """Check that a flush is scheduled right away once the digest is full."""
+        for first_name in ('John', 'Jane', 'Jim'):
+            self.digest.add(person_dict(first_name))
+        self.assertEqual(self.delays, [60, 0])
+
+    def test_send_failure(self):
+        """Check that activations which cannot be sent are kept for the next flush."""
+        def send(people):
+            if not self.sent:
+                self.sent.append(None)
+                raise IOError('Cannot send the digest')
+            self.sent.append(people)
+
+        self.digest.send = send
+        self.digest.add(person_dict('John'))
+        with self.assertRaises(IOError):
+            self.digest.flush()
+        self.assertEqual(self.delays, [60, 60])
+        self.digest.add(person_dict('Jane'))
+        self.digest.flush()
+        self.assertEqual([p['username'] for p in self.sent[1]], ['john', 'jane'])
+
+
+class TestAppActivationDigest(unittest.TestCase):
+    """Check the digest of activations of the app."""
+
+    def setUp(self):
+        super(TestAppActivationDigest, self).setUp()
+        self.api = FakeAPI()
+        self.app = create_app(read_config(TEST_CONFIG))
+        self.app.config.update({
+            'SENDGRID_API_URL': self.api.url,
+            'NOTIFICATION_TO_NAME': 'Account Manager',
+            'NOTIFICATION_TO_EMAIL': 'manager@example.org',
+        })
+
+    def tearDown(self):
+        super(TestAppActivationDigest, self).tearDown()
+        self.api.stop()
+
+    def wait_messages(self, count):
+        deadline = time.time() + 5
+        while len(self.api.messages) < count and time.time() < deadline:
+            time.sleep(0.01)
+        return self.api.messages
+
+    def test_config(self):
+        """Check that the digest is configured by the app options."""
+        self.assertIsNone(self.app.activation_digest)
+        self.app.config['NOTIFICATION_DIGEST_INTERVAL'] = 60
+        self.assertIsInstance(create_activation_digest(self.app).store, MemoryDigestStore)
+        self.app.config['NOTIFICATION_DIGEST_STORAGE'] = 'redis'
+        self.assertIsInstance(create_activation_digest(self.app).store, RedisDigestStore)
+        self.app.config['NOTIFICATION_DIGEST_STORAGE'] = 'memcached'
+        with self.assertRaises(ParsingError):
+            create_activation_digest(self.app)
+
+    def test_single(self):
+        """Check that a single activation is notified like without digest."""
+        with self.app.test_request_context():
+            send_activation_digest([person_dict('John')])
+        message, = self.api.messages
+        self.assertEqual(message['subject'], 'John Doe has created or reactivated his/her ANA '
+                                             'account')
+        self.assertIn('This account was created or reactivated', message['content'][0]['value'])
+
+    def test_digest(self):
+        """Check that activations are notified in a single mail listing them."""
+        self.app.config.update({'NOTIFICATION_DIGEST_INTERVAL': 0.05,
+                                'NOTIFICATION_DIGEST_SIZE': 3})
+        digest = create_activation_digest(self.app)
+        with self.app.app_context():
+            digest.add(person_dict('John'))
+            digest.add(person_dict('Jane'))
+        message, = self.wait_messages(1)
+        self.assertEqual(message['subject'], '2 ANA accounts have been created or reactivated')
+        self.assertEqual(message['personalizations'][0]['to'][0]['email'], 'manager@example.org')
+        for content in message['content']:
+            self.assertIn('These 2 accounts were created or reactivated', content['value'])
+            self.assertIn('john@example.org', content['value'])
+            self.assertIn('jane@example.org', content['value'])
+        digest.interval = 60
+        with self.app.app_context():
+            for first_name in ('Jim', 'Joe', 'Jack'):
+                digest.add(person_dict(first_name))
+        self.assertEqual(len(self.wait_messages(2)), 2)
+        self.assertIn('3 ANA accounts', self.api.messages[1]['subject'])
+
+
+if __name__ == '__main__':
+    unittest.main()
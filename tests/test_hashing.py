@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+
+"""Tests about hashing passwords in worker processes, with various schemes."""
+
+from configparser import ParsingError
+from crypt import crypt
+import os
+import time
+import unittest
+
+from aliquis import create_app, read_config
+from aliquis.hashing import (HASH_SCHEMES, HasherBusyError, HashingTimeoutError, PasswordHasher,
+                             bcrypt, Argon2Hasher, calibrate, create_password_hasher, crypt_checks,
+                             identify_scheme)
+from aliquis.person import person as new_person
+
+from tests.test_sql import setup_sql_backend
+
+
+TEST_CONFIG = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'test-settings.ini')
+
+# A hash whose verification takes most of a second
+SLOW_HASH = '$6$rounds=1000000$slow$x'
+
+# A hash of "jdoe1234", checked quickly
+FAST_HASH = crypt('jdoe1234', '$6$salt$')
+
+
+def hasher_is_inline(_):
+    return PasswordHasher(processes=2).inline
+
+
+class TestPasswordHasher(unittest.TestCase):
+    """Check the bounded pool of processes hashing passwords."""
+
+    def setUp(self):
+        super(TestPasswordHasher, self).setUp()
+        self.hasher = PasswordHasher(processes=1, max_pending=1, timeout=5)
+
+    def tearDown(self):
+        super(TestPasswordHasher, self).tearDown()
+        self.hasher.shutdown()
+
+    def test_hash(self):
+        """Check that passwords are hashed and verified by a worker process."""
+        hashed = self.hasher.hash('jdoe1234')
+        self.assertTrue(hashed.startswith('$6$rounds=5000$'))
+        self.assertEqual(crypt('jdoe1234', hashed), hashed)
+        self.assertTrue(self.hasher.verify('jdoe1234', hashed))
+        self.assertFalse(self.hasher.verify('jane1234', hashed))
+        self.assertIsNotNone(self.hasher._executor)
+
+    def test_inline(self):
+        """Check that a hasher without processes hashes passwords in the calling thread."""
+        hasher = PasswordHasher(processes=0)
+        self.assertTrue(hasher.verify('jdoe1234', hasher.hash('jdoe1234')))
+        self.assertTrue(hasher.verify('jdoe1234', FAST_HASH))
+        self.assertIsNone(hasher._executor)
+
+    def test_busy(self):
+        """Check that hashing fails right away when the queue is full, until hashes are done."""
+        self.hasher.timeout = 0.01
+        with self.assertRaises(HashingTimeoutError):
+            self.hasher.verify('jdoe1234', SLOW_HASH)
+        # The slow hash still holds the only slot
+        with self.assertRaises(HasherBusyError):
+            self.hasher.verify('jdoe1234', FAST_HASH)
+        self.hasher.shutdown()
+        self.hasher.timeout = 5
+        self.assertTrue(self.hasher.verify('jdoe1234', FAST_HASH))
+
+    def test_map(self):
+        """Check that bulk work is run in order by the worker processes."""
+        self.assertEqual(list(self.hasher.map(abs, range(-5, 0), chunksize=2)), [5, 4, 3, 2, 1])
+
+    def test_inline_in_workers(self):
+        """Check that hashers of worker processes hash passwords themselves."""
+        self.assertFalse(hasher_is_inline(None))
+        self.assertEqual(list(self.hasher.map(hasher_is_inline, range(2))), [True, True])
+
+
+class TestAppHasher(unittest.TestCase):
+    """Check the use of the password hasher of the app."""
+
+    def setUp(self):
+        super(TestAppHasher, self).setUp()
+        self.app = create_app(read_config(TEST_CONFIG))
+        self.app.config['SECRET_KEY'] = 'secret'
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        self.app.password_hasher = PasswordHasher(processes=1, max_pending=1, timeout=5)
+        sql_backend = setup_sql_backend(self.app)
+        with self.app.app_context():
+            sql_backend.create_person(new_person(first_name='John', surname='Doe',
+                                                 username='jdoe', email='jdoe@example.org',
+                                                 password='jdoe1234'))
+            sql_backend.activate_person('jdoe')
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        super(TestAppHasher, self).tearDown()
+        self.app.password_hasher.shutdown()
+
+    def test_config(self):
+        """Check that the hasher is configured by the app options."""
+        self.assertEqual(create_app(read_config(TEST_CONFIG)).password_hasher.processes,
+                         os.cpu_count() or 1)
+
+    def test_person(self):
+        """Check that people passwords are hashed and checked by the hasher of the app."""
+        with self.app.app_context():
+            jane = new_person(first_name='Jane', surname='Doe', username='jane',
+                              password='jane1234')
+            self.assertIsNotNone(self.app.password_hasher._executor)
+            self.assertTrue(jane.check_password('jane1234'))
+            self.assertFalse(jane.check_password('jdoe1234'))
+
+    def test_overloaded(self):
+        """Check that requests needing a hash fail right away while the hasher is busy."""
+        hasher = self.app.password_hasher
+        hasher.timeout = 0.01
+        with self.assertRaises(HashingTimeoutError):
+            hasher.verify('jdoe1234', SLOW_HASH)
+        response = self.client.post('/login', data={'username': 'jdoe', 'password': 'jdoe1234'})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '1')
+        hasher.shutdown()
+        hasher.timeout = 5
+        response = self.client.post('/login', data={'username': 'jdoe', 'password': 'jdoe1234'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_upgrade_at_login(self):
+        """Check that a hash made with outdated parameters is replaced once its person logs in."""
+        self.app.password_hasher = PasswordHasher(processes=0, params={'rounds': 1000})
+        response = self.client.post('/login', data={'username': 'jdoe', 'password': 'jdoe1234'})
+        self.assertEqual(response.status_code, 200)
+        deadline = time.time() + 5
+        while True:
+            with self.app.app_context():
+                hashed = self.app.people_backend.get_person('jdoe').password
+            if hashed.startswith('$6$rounds=1000$') or time.time() > deadline:
+                break
+            time.sleep(0.01)
+        self.assertTrue(hashed.startswith('$6$rounds=1000$'))
+        with self.app.app_context():
+            self.assertIsNotNone(self.app.people_backend.authenticate('jdoe', 'jdoe1234'))
+
+
+class TestHashSchemes(unittest.TestCase):
+    """Check the password hashing schemes."""
+
+    def test_identify(self):
+        """Check that the scheme of hashes is identified, and that other values are not hashes."""
+        self.assertEqual(identify_scheme(FAST_HASH).name, 'sha512_crypt')
+        self.assertEqual(identify_scheme(crypt('jdoe1234', '$5$salt$')).name, 'crypt')
+        self.assertEqual(identify_scheme('$2b$12$' + 'a' * 53).name, 'bcrypt')
+        self.assertEqual(identify_scheme('$argon2id$v=19$m=65536,t=3,p=4$c2FsdA$aGFzaA').name,
+                         'argon2id')
+        self.assertIsNone(identify_scheme('jdoe1234'))
+
+    def test_sha512_crypt(self):
+        """Check that SHA-512 hashes have a random salt and the given number of rounds."""
+        scheme = HASH_SCHEMES['sha512_crypt']
+        hashed = scheme.hash('jdoe1234', rounds=1000)
+        self.assertRegex(hashed, r'^\$6\$rounds=1000\$[a-zA-Z0-9./]{16}\$')
+        self.assertNotEqual(scheme.hash('jdoe1234', rounds=1000), hashed)
+        self.assertTrue(scheme.verify('jdoe1234', hashed))
+        with self.assertRaises(ValueError):
+            scheme.hash('jdoe1234', rounds=999)
+
+    def test_legacy_crypt(self):
+        """Check that other crypt() hashes are verified, and need to be replaced."""
+        hasher = PasswordHasher(processes=0)
+        hashed = crypt('jdoe1234', '$5$salt$')
+        self.assertTrue(hasher.verify('jdoe1234', hashed))
+        self.assertFalse(hasher.verify('jane1234', hashed))
+        self.assertTrue(hasher.needs_update(hashed))
+
+    def test_needs_update(self):
+        """Check that hashes made with other parameters than the ones of the hasher need to be
+        replaced."""
+        hasher = PasswordHasher(processes=0)
+        self.assertFalse(hasher.needs_update(FAST_HASH))  # Default number of rounds
+        self.assertFalse(hasher.needs_update(hasher.hash('jdoe1234')))
+        self.assertTrue(hasher.needs_update(crypt('jdoe1234', '$6$rounds=6000$salt$')))
+        self.assertFalse(hasher.needs_update(None))
+        stronger = PasswordHasher(processes=0, params={'rounds': 6000})
+        self.assertTrue(stronger.needs_update(FAST_HASH))
+        self.assertFalse(stronger.needs_update(stronger.hash('jdoe1234')))
+
+    @unittest.skipIf(bcrypt is None, 'bcrypt is not installed')
+    def test_bcrypt(self):
+        """Check that passwords are hashed with bcrypt at the configured cost."""
+        hasher = PasswordHasher(processes=0, scheme='bcrypt', params={'cost': 4})
+        hashed = hasher.hash('jdoe1234')
+        self.assertTrue(hashed.startswith('$2b$04$'))
+        self.assertTrue(hasher.verify('jdoe1234', hashed))
+        self.assertFalse(hasher.verify('jane1234', hashed))
+        self.assertFalse(hasher.needs_update(hashed))
+        self.assertTrue(hasher.needs_update(FAST_HASH))
+        self.assertTrue(PasswordHasher(processes=0).needs_update(hashed))
+
+    @unittest.skipIf(Argon2Hasher is None, 'argon2-cffi is not installed')
+    def test_argon2id(self):
+        """Check that passwords are hashed with Argon2id with the configured parameters."""
+        hasher = PasswordHasher(processes=0, scheme='argon2id',
+                                params={'time_cost': 1, 'memory_cost': 1024, 'parallelism': 1})
+        hashed = hasher.hash('jdoe1234')
+        self.assertTrue(hashed.startswith('$argon2id$v=19$m=1024,t=1,p=1$'))
+        self.assertTrue(hasher.verify('jdoe1234', hashed))
+        self.assertFalse(hasher.verify('jane1234', hashed))
+        self.assertFalse(hasher.needs_update(hashed))
+        self.assertTrue(PasswordHasher(processes=0, scheme='argon2id').needs_update(hashed))
+
+    def test_calibrate(self):
+        """Check that calibration finds more rounds for a longer target time."""
+        fast = calibrate('sha512_crypt', 0.002, samples=1)['rounds']
+        slow = calibrate('sha512_crypt', 0.02, samples=1)['rounds']
+        self.assertGreaterEqual(fast, 1000)
+        self.assertGreater(slow, fast)
+
+    def test_config(self):
+        """Check that the scheme and its parameters are read from the app options."""
+        app = create_app(read_config(TEST_CONFIG))
+        app.config['PASSWORD_HASH_ROUNDS'] = 20000
+        hasher = create_password_hasher(app)
+        self.assertEqual(hasher.scheme.name, 'sha512_crypt')
+        self.assertEqual(hasher.params, {'rounds': 20000})
+        for scheme in ('crypt', 'md5'):
+            app.config['PASSWORD_HASH_SCHEME'] = scheme
+            with self.assertRaises(ParsingError):
+                create_password_hasher(app)
+
+    @unittest.skipIf(Argon2Hasher is None, 'argon2-cffi is not installed')
+    def test_ldap_storage(self):
+        """Check that schemes crypt() does not support are refused with LDAP storage."""
+        self.assertTrue(crypt_checks(HASH_SCHEMES['sha512_crypt'], {'rounds': 1000}))
+        app = create_app(read_config(TEST_CONFIG))
+        app.config['PASSWORD_HASH_SCHEME'] = 'argon2id'
+        with self.assertRaises(ParsingError) as ctx:
+            create_password_hasher(app)
+        self.assertIn('crypt()', str(ctx.exception))
+        app.config['STORAGE_BACKEND'] = 'sql'
+        self.assertEqual(create_password_hasher(app).scheme.name, 'argon2id')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,14 +2,20 @@
 
 """Tests about storing person information in an LDAP directory."""
 
+from crypt import crypt
 import os
+import time
 import unittest
 
+from flask import session
+from ldap3 import Server, ServerPool
 from ldap3.core.exceptions import LDAPEntryAlreadyExistsResult, LDAPNoSuchObjectResult
 
 from aliquis import create_app, read_config
 from aliquis.person import person as new_person
-from aliquis.ldap import LDAP_ATTR_MAPPING, LDAPBackend
+from aliquis.storage import NoSuchPersonError, PersonAlreadyExistsError
+from aliquis.ldap import (LDAP_ATTR_MAPPING, MASTER_PIN_SESSION_KEY, PERSON_ATTRIBUTES,
+                          LDAPBackend, invalidate_object_defs, ldap_server, object_def)
 
 
 TEST_CONFIG = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'test-settings.ini')
@@ -25,6 +31,31 @@ def setup_add_ldap_person(ldap_backend, person_dict):
         ), ldap_dict)
 
 
+def setup_active_role(ldap_backend, occupant_dns):
+    config = ldap_backend.app.config
+    with ldap_backend.admin_connection() as ldap_conn:
+        ldap_conn.strategy.add_entry('cn={name},{base_dn}'.format(
+            name=config['LDAP_ACTIVE_PERM_NAME'], base_dn=ldap_backend._roles_basedn
+        ), {
+            'objectClass': config['LDAP_PERMISSION_CLASS'],
+            'cn': config['LDAP_ACTIVE_PERM_NAME'],
+            config['LDAP_PERMISSION_ATTRIBUTE']: list(occupant_dns),
+        })
+
+
+def setup_role(ldap_backend, name, description, occupant_dns):
+    config = ldap_backend.app.config
+    with ldap_backend.admin_connection() as ldap_conn:
+        ldap_conn.strategy.add_entry('cn={name},{base_dn}'.format(
+            name=name, base_dn=ldap_backend._roles_basedn
+        ), {
+            'objectClass': config['LDAP_PERMISSION_CLASS'],
+            'cn': name,
+            'description': description,
+            config['LDAP_PERMISSION_ATTRIBUTE']: list(occupant_dns),
+        })
+
+
 def clean_people_tree(ldap_backend):
     with ldap_backend.admin_connection() as ldap_conn:
         for entry in ldap_backend.entries(ldap_conn, ldap_backend._person_class,
@@ -62,6 +93,7 @@ class TestSearchPersonByUsername(unittest.TestCase):
             self.assertFalse(self.ldap_backend.username_exists('john', ldap_conn))
             self.assertFalse(self.ldap_backend.username_exists('', ldap_conn))
             self.assertFalse(self.ldap_backend.username_exists(None, ldap_conn))
+            self.assertFalse(self.ldap_backend.username_exists('*', ldap_conn))
 
     def test_person_by_username(self):
         """Check that a person can be found by its username."""
@@ -135,6 +167,21 @@ class TestSearchPersonByEmail(unittest.TestCase):
             self.assertFalse(self.ldap_backend.email_exists('', ldap_conn))
             self.assertFalse(self.ldap_backend.email_exists(None, ldap_conn))
 
+    def test_existing_attributes(self):
+        """Check that username and email are checked together."""
+        with self.ldap_backend.admin_connection() as ldap_conn:
+            existing = self.ldap_backend.existing_attributes
+            self.assertEqual(existing(ldap_conn, username='jdoe', email='jdoe@example.org'),
+                             set(['username', 'email']))
+            self.assertEqual(existing(ldap_conn, username='john', email='jdoe@example.org'),
+                             set(['email']))
+            self.assertEqual(existing(ldap_conn, username='jdoe', email='john@example.org'),
+                             set(['username']))
+            self.assertEqual(existing(ldap_conn, username='john', email='john@example.org'),
+                             set())
+            self.assertEqual(existing(ldap_conn, username='*', email=None), set())
+            self.assertEqual(existing(ldap_conn, username='', email=None), set())
+
     def test_person_by_email(self):
         """Check that a person can be found by its username."""
         with self.ldap_backend.admin_connection() as ldap_conn:
@@ -168,6 +215,137 @@ class TestSearchPersonByEmail(unittest.TestCase):
                 self.ldap_backend.person_by_email('jdoe@example.org', ldap_conn)
 
 
+class TestAttributeProjection(unittest.TestCase):
+    """Check that lookups only fetch the attributes they need."""
+
+    def setUp(self):
+        super(TestAttributeProjection, self).setUp()
+        self.app = create_app(read_config(TEST_CONFIG))
+        self.ldap_backend = LDAPBackend(self.app, fake=True)
+        setup_add_ldap_person(self.ldap_backend, {
+            'first_name': 'John',
+            'surname': 'Doe',
+            'email': 'jdoe@example.org',
+            'username': 'jdoe',
+        })
+
+    def tearDown(self):
+        super(TestAttributeProjection, self).tearDown()
+        clean_people_tree(self.ldap_backend)
+
+    def test_user_attributes(self):
+        """Check that flask-ldap3-login fetches person attributes only, unless configured
+        otherwise."""
+        self.assertEqual(self.app.config['LDAP_GET_USER_ATTRIBUTES'], PERSON_ATTRIBUTES)
+        app = create_app(read_config(TEST_CONFIG))
+        app.config['LDAP_GET_USER_ATTRIBUTES'] = ['uid', 'jpegPhoto']
+        LDAPBackend(app, fake=True)
+        self.assertEqual(app.config['LDAP_GET_USER_ATTRIBUTES'], ['uid', 'jpegPhoto'])
+
+    def test_read_cursor(self):
+        """Check that a read cursor only fetches the given attributes."""
+        with self.ldap_backend.admin_connection() as ldap_conn:
+            with self.ldap_backend.read_cursor(ldap_conn, self.ldap_backend._person_class,
+                                               self.ldap_backend._people_basedn, 'uid:=jdoe',
+                                               ['uid']) as cur:
+                cur.search()
+                self.assertEqual(cur[0].entry_attributes, ['uid'])
+
+
+class TestTakenFilter(unittest.TestCase):
+    """Check the filter of usernames and email addresses already used."""
+
+    def setUp(self):
+        super(TestTakenFilter, self).setUp()
+        self.app = create_app(read_config(TEST_CONFIG))
+        self.ldap_backend = LDAPBackend(self.app, fake=True)
+        setup_add_ldap_person(self.ldap_backend, {
+            'first_name': 'John',
+            'surname': 'Doe',
+            'email': 'jdoe@example.org',
+            'username': 'jdoe',
+        })
+
+    def tearDown(self):
+        super(TestTakenFilter, self).tearDown()
+        clean_people_tree(self.ldap_backend)
+
+    def build_taken_filter(self):
+        """Start building the filter of used values and wait until it is built."""
+        self.ldap_backend.taken_filter()
+        with self.ldap_backend._taken_filter_lock:
+            return self.ldap_backend.taken_filter()
+
+    def test_built_from_directory(self):
+        """Check that the filter holds values of the directory, once built in the background."""
+        self.assertIsNone(self.ldap_backend.taken_filter())
+        taken = self.build_taken_filter()
+        self.assertIn('username:jdoe', taken)
+        self.assertIn('email:jdoe@example.org', taken)
+        self.assertNotIn('username:jane', taken)
+
+    def test_is_taken(self):
+        """Check that used values are found, whatever their case."""
+        with self.ldap_backend.admin_connection() as ldap_conn:
+            self.assertTrue(self.ldap_backend.is_taken('username', 'jdoe', ldap_conn))
+            self.build_taken_filter()
+            self.assertTrue(self.ldap_backend.is_taken('username', 'jdoe', ldap_conn))
+            self.assertTrue(self.ldap_backend.is_taken('email', 'JDoe@example.org', ldap_conn))
+            self.assertFalse(self.ldap_backend.is_taken('username', 'jane', ldap_conn))
+            self.assertFalse(self.ldap_backend.is_taken('email', 'jdoe@example.com', ldap_conn))
+
+    def test_free_value_without_search(self):
+        """Check that a value missing from the filter is free without any search, once the filter
+        is built."""
+        setup_add_ldap_person(self.ldap_backend, {
+            'first_name': 'Jane',
+            'surname': 'Doe',
+            'username': 'jane',
+        })
+        with self.ldap_backend.admin_connection() as ldap_conn:
+            self.assertTrue(self.ldap_backend.is_taken('username', 'jane', ldap_conn))
+        self.build_taken_filter()
+        setup_add_ldap_person(self.ldap_backend, {
+            'first_name': 'Jim',
+            'surname': 'Doe',
+            'username': 'jim',
+        })
+        with self.ldap_backend.admin_connection() as ldap_conn:
+            self.assertFalse(self.ldap_backend.is_taken('username', 'jim', ldap_conn))
+
+    def test_failed_build_delayed(self):
+        """Check that the filter is not built again right after a failure."""
+        def fail(ldap_conn):
+            raise RuntimeError('Cannot build')
+
+        self.ldap_backend._rebuild_taken_filter = fail
+        with self.assertLogs('aliquis.ldap', level='ERROR'):
+            self.assertIsNone(self.build_taken_filter())
+        self.assertGreater(self.ldap_backend._taken_filter_expires, time.monotonic() + 30)
+
+    def test_updated_on_add(self):
+        """Check that added people are put in the filter."""
+        jane = new_person(first_name='Jane', surname='Doe', username='jane',
+                          email='jane@example.org')
+        taken = self.build_taken_filter()
+        with self.ldap_backend.admin_connection() as ldap_conn:
+            self.ldap_backend.add_person(jane, ldap_conn)
+        self.assertIn('username:jane', taken)
+        self.assertIn('email:jane@example.org', taken)
+
+    def test_rebuilt_when_expired(self):
+        """Check that an expired filter is rebuilt in the background."""
+        old_filter = self.build_taken_filter()
+        setup_add_ldap_person(self.ldap_backend, {
+            'first_name': 'Jane',
+            'surname': 'Doe',
+            'username': 'jane',
+        })
+        self.ldap_backend._taken_filter_expires = 0
+        self.assertIs(self.ldap_backend.taken_filter(), old_filter)
+        self.assertIn('username:jane', self.build_taken_filter())
+
+
 class TestAddPerson(unittest.TestCase):
     """Check adding a person in LDAP directory."""
 
@@ -238,6 +416,67 @@ class TestAddPerson(unittest.TestCase):
                 self.ldap_backend.add_person(john, ldap_conn)
 
 
+class TestAddPeople(unittest.TestCase):
+    """Check adding many people at once in LDAP directory."""
+
+    def setUp(self):
+        super(TestAddPeople, self).setUp()
+        self.app = create_app(read_config(TEST_CONFIG))
+        self.ldap_backend = LDAPBackend(self.app, fake=True)
+        setup_add_ldap_person(self.ldap_backend, {
+            'first_name': 'John',
+            'surname': 'Doe',
+            'email': 'jdoe@example.org',
+            'username': 'jdoe',
+        })
+
+    def tearDown(self):
+        """Empty the LDAP tree after each test function."""
+        super(TestAddPeople, self).tearDown()
+        clean_people_tree(self.ldap_backend)
+
+    def test_add_people(self):
+        """Check that people are added by batches and reported in the given order."""
+        people = [new_person(first_name='User', surname=str(i), username='user{0}'.format(i),
+                             email='user{0}@example.org'.format(i), password='$6$salt$hash')
+                  for i in range(25)]
+        results = list(self.ldap_backend.add_people(iter(people), batch_size=10, workers=3))
+        self.assertEqual([person for person, _ in results], people)
+        self.assertEqual([error for _, error in results], [None] * 25)
+        with self.ldap_backend.admin_connection() as ldap_conn:
+            user = self.ldap_backend.person_by_username('user12', ldap_conn)
+        self.assertEqual(user, people[12])
+        self.assertEqual(user.password, '$6$salt$hash')
+
+    def test_duplicates(self):
+        """Check that people whose username or email address is already used, in the directory or
+        by a previous person, are reported and not added."""
+        people = [
+            new_person(first_name='John', surname='Doe', username='jdoe',
+                       email='john.doe@example.org'),
+            new_person(first_name='John', surname='Doe', username='john',
+                       email='JDoe@example.org'),
+            new_person(first_name='Jane', surname='Doe', username='jane',
+                       email='jane@example.org'),
+            new_person(first_name='Jane', surname='Doe', username='jane2',
+                       email='jane@example.org'),
+            new_person(first_name='Jane', surname='Doe', username='Jane',
+                       email='jane3@example.org'),
+        ]
+        errors = [error for _, error in self.ldap_backend.add_people(people, batch_size=2)]
+        self.assertIsInstance(errors[0], LDAPEntryAlreadyExistsResult)
+        self.assertIsInstance(errors[1], LDAPEntryAlreadyExistsResult)
+        self.assertIsNone(errors[2])
+        self.assertIsInstance(errors[3], LDAPEntryAlreadyExistsResult)
+        self.assertIsInstance(errors[4], LDAPEntryAlreadyExistsResult)
+        with self.ldap_backend.admin_connection() as ldap_conn:
+            self.assertFalse(self.ldap_backend.username_exists('john', ldap_conn))
+            self.assertFalse(self.ldap_backend.username_exists('jane2', ldap_conn))
+            self.assertEqual(self.ldap_backend.existing_values(
+                ldap_conn, username=['jdoe', 'jane', 'john'], email=['JANE@example.org']
+            ), {'username': set(['jdoe', 'jane']), 'email': set(['jane@example.org'])})
+
+
 class TestUpdatePerson(unittest.TestCase):
     """Check updating a person in LDAP directory."""
 
@@ -284,6 +523,24 @@ class TestUpdatePerson(unittest.TestCase):
             p = self.ldap_backend.person_by_username(self.jdoe['username'], ldap_conn)
         self.assertTrue(p.check_password('foobar1234'))
 
+    def test_replace_password_hash(self):
+        """Check that only the password hash is replaced, by a single modification."""
+        john = self.jdoe.copy()
+        john['password'] = '{CRYPT}' + crypt('jdoe1234', '$6$old$')
+        clean_people_tree(self.ldap_backend)
+        setup_add_ldap_person(self.ldap_backend, john)
+        new_hash = crypt('jdoe1234', '$6$new$')
+        with self.app.app_context():
+            self.assertTrue(self.ldap_backend.replace_password_hash(
+                'jdoe', crypt('jdoe1234', '$6$old$'), new_hash
+            ))
+            self.assertTrue(self.ldap_backend.pinned_to_master)
+            self.assertFalse(self.ldap_backend.replace_password_hash('jane', new_hash, new_hash))
+        with self.ldap_backend.admin_connection() as ldap_conn:
+            p = self.ldap_backend.person_by_username('jdoe', ldap_conn)
+        self.assertEqual(p.password, new_hash)
+        self.assertEqual(p.first_name, 'John')
+
     def test_cannot_update_new_person(self):
         """Check that a person cannot be updated if it does not exists in database."""
         john = self.jdoe.copy()
@@ -293,5 +550,554 @@ class TestUpdatePerson(unittest.TestCase):
                 self.ldap_backend.update_person(new_person(**john), ldap_conn)
 
 
+class TestEntries(unittest.TestCase):
+    """Check browsing entries page by page."""
+
+    def setUp(self):
+        super(TestEntries, self).setUp()
+        self.app = create_app(read_config(TEST_CONFIG))
+        self.ldap_backend = LDAPBackend(self.app, fake=True)
+        self.usernames = set('user{0}'.format(i) for i in range(7))
+        for username in self.usernames:
+            setup_add_ldap_person(self.ldap_backend, {
+                'first_name': 'John',
+                'surname': 'Doe',
+                'username': username,
+            })
+
+    def tearDown(self):
+        super(TestEntries, self).tearDown()
+        clean_people_tree(self.ldap_backend)
+
+    def test_all_pages(self):
+        """Check that entries of all pages are yielded."""
+        with self.ldap_backend.admin_connection() as ldap_conn:
+            for page_size in (1, 3, 7, 100):
+                entries = self.ldap_backend.entries(ldap_conn, self.ldap_backend._person_class,
+                                                    self.ldap_backend._people_basedn,
+                                                    page_size=page_size)
+                self.assertEqual(set(entry.uid.value for entry in entries), self.usernames)
+
+    def test_filter(self):
+        """Check that only matching entries are yielded."""
+        with self.ldap_backend.admin_connection() as ldap_conn:
+            entries = list(self.ldap_backend.entries(ldap_conn, self.ldap_backend._person_class,
+                                                     self.ldap_backend._people_basedn,
+                                                     'uid:=user3', page_size=2))
+        self.assertEqual([entry.uid.value for entry in entries], ['user3'])
+
+    def test_stop_early(self):
+        """Check that browsing can be stopped before the last page."""
+        with self.ldap_backend.admin_connection() as ldap_conn:
+            entries = self.ldap_backend.entries(ldap_conn, self.ldap_backend._person_class,
+                                                self.ldap_backend._people_basedn, page_size=3)
+            self.assertIn(next(entries).uid.value, self.usernames)
+            entries.close()
+            self.assertEqual(ldap_conn.result['description'], 'success')
+
+
+class TestActivation(unittest.TestCase):
+    """Check whether people are occupants of the active role."""
+
+    def setUp(self):
+        super(TestActivation, self).setUp()
+        self.app = create_app(read_config(TEST_CONFIG))
+        self.ldap_backend = LDAPBackend(self.app, fake=True)
+        self.jdoe_dn = 'uid=jdoe,{0}'.format(self.ldap_backend._people_basedn)
+        self.jane_dn = 'uid=jane,{0}'.format(self.ldap_backend._people_basedn)
+        self.john_dn = 'uid=john,{0}'.format(self.ldap_backend._people_basedn)
+        setup_active_role(self.ldap_backend, [self.jdoe_dn, self.john_dn])
+
+    def test_is_active(self):
+        """Check that ``is_active`` tells whether a person occupies the active role."""
+        with self.ldap_backend.admin_connection() as ldap_conn:
+            self.assertTrue(self.ldap_backend.is_active(self.jdoe_dn, ldap_conn))
+            self.assertFalse(self.ldap_backend.is_active(self.jane_dn, ldap_conn))
+
+    def test_active_dns(self):
+        """Check that many people can be checked at once, with a compare operation each."""
+        self.app.config['LDAP_METRICS'] = True
+        ldap_backend = LDAPBackend(self.app, fake=True)
+        setup_active_role(ldap_backend, [self.jdoe_dn])
+        with ldap_backend.admin_connection() as ldap_conn:
+            ldap_backend.active_role_dn(ldap_conn)
+            ldap_backend.metrics.reset()
+            self.assertEqual(ldap_backend.active_dns([self.jdoe_dn, self.jane_dn], ldap_conn),
+                             set([self.jdoe_dn]))
+            self.assertEqual(ldap_backend.active_dns([], ldap_conn), set())
+        operations = ldap_backend.metrics.snapshot()
+        self.assertEqual(list(operations), [('compare', 'active_dns')])
+        self.assertEqual(operations[('compare', 'active_dns')]['count'], 2)
+
+    def test_activate(self):
+        """Check that a person can be activated, even twice."""
+        with self.ldap_backend.admin_connection() as ldap_conn:
+            self.ldap_backend.activate(self.jane_dn, ldap_conn)
+            self.assertTrue(self.ldap_backend.is_active(self.jane_dn, ldap_conn))
+            self.ldap_backend.activate(self.jdoe_dn, ldap_conn)
+            self.assertTrue(self.ldap_backend.is_active(self.jdoe_dn, ldap_conn))
+
+    def test_deactivate(self):
+        """Check that a person can be deactivated, even twice."""
+        with self.ldap_backend.admin_connection() as ldap_conn:
+            self.ldap_backend.deactivate(self.jdoe_dn, ldap_conn)
+            self.assertFalse(self.ldap_backend.is_active(self.jdoe_dn, ldap_conn))
+            self.assertTrue(self.ldap_backend.is_active(self.john_dn, ldap_conn))
+            self.ldap_backend.deactivate(self.john_dn, ldap_conn)
+            self.ldap_backend.deactivate(self.john_dn, ldap_conn)
+            self.assertFalse(self.ldap_backend.is_active(self.john_dn, ldap_conn))
+
+    def test_no_active_role(self):
+        """Check that an error is raised if there is no active role."""
+        with self.ldap_backend.admin_connection() as ldap_conn:
+            ldap_conn.strategy.remove_entry(self.ldap_backend.active_role_dn(ldap_conn))
+            self.ldap_backend._active_role_dn = None
+            with self.assertRaises(LDAPNoSuchObjectResult):
+                self.ldap_backend.is_active(self.jdoe_dn, ldap_conn)
+            with self.assertRaises(LDAPNoSuchObjectResult):
+                self.ldap_backend.activate(self.jane_dn, ldap_conn)
+
+
+class TestReadServers(unittest.TestCase):
+    """Check routing of reads to read servers and writes to write servers."""
+
+    def setUp(self):
+        super(TestReadServers, self).setUp()
+        self.app = create_app(read_config(TEST_CONFIG))
+        self.app.config['SECRET_KEY'] = 'secret'
+        self.app.config['LDAP_READ_HOSTS'] = 'replica1.example.org, replica2.example.org'
+        self.ldap_backend = LDAPBackend(self.app, fake=True)
+        self.app.ldap_backend = self.ldap_backend
+        setup_active_role(self.ldap_backend, [])
+        self.jdoe_dn = 'uid=jdoe,{0}'.format(self.ldap_backend._people_basedn)
+
+    def test_ldap_server(self):
+        """Check that a server pool is built for several hosts."""
+        server = ldap_server(['ldap.example.org'], port=389, use_ssl=False, get_info=None)
+        self.assertIsInstance(server, Server)
+        pool = ldap_server(['ldap1.example.org', 'ldap2.example.org:1389'], port=389,
+                           use_ssl=False, get_info=None, strategy='first')
+        self.assertIsInstance(pool, ServerPool)
+        self.assertEqual([srv.port for srv in pool.servers], [389, 1389])
+        self.assertEqual(pool.strategy, 'FIRST')
+
+    def test_no_read_server(self):
+        """Check that reads go to the write servers if no read server is configured."""
+        app = create_app(read_config(TEST_CONFIG))
+        ldap_backend = LDAPBackend(app, fake=True)
+        self.assertIs(ldap_backend.read_pool, ldap_backend.pool)
+        with app.app_context():
+            self.assertIs(ldap_backend.read_connection, ldap_backend.connection)
+
+    def test_read_connection(self):
+        """Check that reads use a connection of the read pool, given back at the end of the
+        request."""
+        with self.app.test_request_context():
+            read_conn = self.ldap_backend.read_connection
+            self.assertIsNot(read_conn, self.ldap_backend.connection)
+            self.assertIs(self.ldap_backend.read_connection, read_conn)
+            self.assertEqual(self.ldap_backend.read_pool.idle, 0)
+        self.assertEqual(self.ldap_backend.read_pool.idle, 1)
+
+    def test_pinned_after_write(self):
+        """Check that reads go to the write servers after a write in the same request."""
+        with self.app.test_request_context():
+            self.assertFalse(self.ldap_backend.pinned_to_master)
+            self.ldap_backend.activate(self.jdoe_dn, self.ldap_backend.connection)
+            self.assertTrue(self.ldap_backend.pinned_to_master)
+            self.assertIs(self.ldap_backend.read_connection, self.ldap_backend.connection)
+
+    def test_pinned_session(self):
+        """Check that reads of a session go to the write servers for a while after a write."""
+        with self.app.test_request_context():
+            self.ldap_backend.pin_to_master()
+            pinned_until = session[MASTER_PIN_SESSION_KEY]
+        self.assertAlmostEqual(pinned_until,
+                               time.time() + self.app.config['LDAP_MASTER_PIN_SECONDS'], delta=1)
+        with self.app.test_request_context():
+            session[MASTER_PIN_SESSION_KEY] = pinned_until
+            self.assertTrue(self.ldap_backend.pinned_to_master)
+        with self.app.test_request_context():
+            session[MASTER_PIN_SESSION_KEY] = time.time() - 1
+            self.assertFalse(self.ldap_backend.pinned_to_master)
+            self.assertIsNot(self.ldap_backend.read_connection, self.ldap_backend.connection)
+
+
+class TestGrants(unittest.TestCase):
+    """Check the grants index built from roles."""
+
+    def setUp(self):
+        super(TestGrants, self).setUp()
+        self.app = create_app(read_config(TEST_CONFIG))
+        self.ldap_backend = LDAPBackend(self.app, fake=True)
+        for username in ('jdoe', 'jane'):
+            setup_add_ldap_person(self.ldap_backend, {
+                'first_name': 'John',
+                'surname': 'Doe',
+                'username': username,
+            })
+        self.jdoe_dn = 'uid=jdoe,{0}'.format(self.ldap_backend._people_basedn)
+        self.jane_dn = 'uid=jane,{0}'.format(self.ldap_backend._people_basedn)
+        setup_active_role(self.ldap_backend, [self.jdoe_dn, self.jane_dn])
+        setup_role(self.ldap_backend, 'wiki', 'Wiki access', [self.jdoe_dn, self.jane_dn])
+        setup_role(self.ldap_backend, 'mail', 'Mail access', [self.jdoe_dn.upper()])
+
+    def tearDown(self):
+        super(TestGrants, self).tearDown()
+        clean_people_tree(self.ldap_backend)
+
+    def test_grants(self):
+        """Check that grants are the descriptions of roles, the active role excepted."""
+        with self.ldap_backend.admin_connection() as ldap_conn:
+            self.assertEqual(sorted(self.ldap_backend.grants(self.jdoe_dn, ldap_conn)),
+                             ['Mail access', 'Wiki access'])
+            self.assertEqual(self.ldap_backend.grants(self.jane_dn, ldap_conn), ('Wiki access',))
+            self.assertEqual(self.ldap_backend.grants('uid=jim,ou=people', ldap_conn), ())
+
+    def test_index_cached(self):
+        """Check that the index is kept until it expires, even when the active role is
+        written."""
+        with self.ldap_backend.admin_connection() as ldap_conn:
+            index = self.ldap_backend.grants_index(ldap_conn)
+            setup_role(self.ldap_backend, 'chat', 'Chat access', [self.jane_dn])
+            self.ldap_backend.deactivate(self.jane_dn, ldap_conn)
+            self.assertIs(self.ldap_backend.grants_index(ldap_conn), index)
+            self.assertEqual(self.ldap_backend.grants(self.jane_dn, ldap_conn), ('Wiki access',))
+            self.ldap_backend._grants_index_expires = 0
+            self.assertEqual(sorted(self.ldap_backend.grants(self.jane_dn, ldap_conn)),
+                             ['Chat access', 'Wiki access'])
+
+    def test_user_dns(self):
+        """Check that DNs of many people are found at once."""
+        with self.ldap_backend.admin_connection() as ldap_conn:
+            self.assertEqual(self.ldap_backend.user_dns(['jdoe', 'JANE', 'jim', ''], ldap_conn),
+                             {'jdoe': self.jdoe_dn, 'JANE': self.jane_dn})
+
+
+class TestPeopleBackend(unittest.TestCase):
+    """Check the people storage backend interface of the LDAP backend."""
+
+    def setUp(self):
+        super(TestPeopleBackend, self).setUp()
+        self.app = create_app(read_config(TEST_CONFIG))
+        self.app.config['SECRET_KEY'] = 'secret'
+        self.ldap_backend = LDAPBackend(self.app, fake=True)
+        self.app.people_backend = self.app.ldap_backend = self.ldap_backend
+        setup_add_ldap_person(self.ldap_backend, {
+            'first_name': 'John',
+            'surname': 'Doe',
+            'email': 'jdoe@example.org',
+            'username': 'jdoe',
+            'password': '{CRYPT}$6$salt$hash',
+        })
+        jdoe_dn = 'uid=jdoe,{0}'.format(self.ldap_backend._people_basedn)
+        setup_active_role(self.ldap_backend, [jdoe_dn])
+        setup_role(self.ldap_backend, 'wiki', 'Wiki access', [jdoe_dn])
+
+    def tearDown(self):
+        super(TestPeopleBackend, self).tearDown()
+        clean_people_tree(self.ldap_backend)
+
+    def test_get_person(self):
+        """Check that people are found by username or email address, with their password
+        hash."""
+        with self.app.test_request_context():
+            jdoe = self.ldap_backend.get_person('jdoe')
+            self.assertEqual(jdoe.email, 'jdoe@example.org')
+            self.assertEqual(jdoe.password, '$6$salt$hash')
+            self.assertEqual(self.ldap_backend.get_person_by_email('jdoe@example.org'), jdoe)
+            self.assertIsNone(self.ldap_backend.get_person('jane'))
+            self.assertIsNone(self.ldap_backend.get_person_by_email('jane@example.org'))
+
+    def test_activation(self):
+        """Check that people are activated and deactivated by username."""
+        with self.app.test_request_context():
+            self.assertTrue(self.ldap_backend.person_is_active('jdoe'))
+            self.ldap_backend.deactivate_person('jdoe')
+            self.assertFalse(self.ldap_backend.person_is_active('jdoe'))
+        with self.app.test_request_context():
+            self.assertFalse(self.ldap_backend.person_is_active('jdoe'))
+            self.ldap_backend.activate_person('jdoe')
+        with self.app.test_request_context():
+            self.assertTrue(self.ldap_backend.person_is_active('jdoe'))
+
+    def test_grants(self):
+        """Check that grants are read by username."""
+        with self.app.test_request_context():
+            self.assertEqual(self.ldap_backend.person_grants('jdoe'), ('Wiki access',))
+            self.assertEqual(self.ldap_backend.people_grants(['jdoe', 'jim']),
+                             {'jdoe': ('Wiki access',), 'jim': None})
+
+    def test_create_and_save(self):
+        """Check that people are added and updated, errors being storage errors."""
+        jane = new_person(first_name='Jane', surname='Doe', username='jane',
+                          email='jane@example.org', password='jane1234')
+        with self.app.test_request_context():
+            self.ldap_backend.create_person(jane)
+            with self.assertRaises(PersonAlreadyExistsError):
+                self.ldap_backend.create_person(jane)
+            self.assertEqual(self.ldap_backend.used_attributes(username='JANE', email='x@y.org'),
+                             set(['username']))
+            self.assertFalse(self.ldap_backend.is_available('email', 'jane@example.org'))
+            jane.surname = 'Smith'
+            jane.password = 'smith1234'
+            self.ldap_backend.save_person(jane)
+            with self.assertRaises(NoSuchPersonError):
+                self.ldap_backend.save_person(new_person(first_name='Jim', surname='Doe',
+                                                         username='jim'))
+        with self.app.test_request_context():
+            saved = self.ldap_backend.get_person('jane')
+            self.assertEqual(saved.surname, 'Smith')
+            self.assertTrue(saved.check_password('jane1234'))
+            self.ldap_backend.save_person(jane, update_password=True)
+        with self.app.test_request_context():
+            self.assertTrue(self.ldap_backend.get_person('jane').check_password('smith1234'))
+
+
+class TestIdentityMap(unittest.TestCase):
+    """Check the request-scoped identity map of user entries."""
+
+    def setUp(self):
+        super(TestIdentityMap, self).setUp()
+        self.app = create_app(read_config(TEST_CONFIG))
+        self.app.config['LDAP_USER_CACHE_SIZE'] = 0  # Only check request-scoped memoization
+        self.ldap_backend = LDAPBackend(self.app, fake=True)
+        self.app.ldap_backend = self.ldap_backend
+        setup_add_ldap_person(self.ldap_backend, {
+            'first_name': 'John',
+            'surname': 'Doe',
+            'email': 'jdoe@example.org',
+            'username': 'jdoe',
+        })
+        self.jdoe_dn = 'uid=jdoe,{0}'.format(self.ldap_backend._people_basedn)
+
+    def tearDown(self):
+        super(TestIdentityMap, self).tearDown()
+        clean_people_tree(self.ldap_backend)
+
+    def test_memoized_in_request(self):
+        """Check that a user entry is fetched once per request, by username or DN."""
+        with self.app.test_request_context():
+            user_info = self.ldap_backend.user_info_for_username('jdoe')
+            self.assertEqual(user_info['dn'], self.jdoe_dn)
+            clean_people_tree(self.ldap_backend)
+            self.assertIs(self.ldap_backend.user_info_for_username('jdoe'), user_info)
+            self.assertIs(self.ldap_backend.user_info(self.jdoe_dn), user_info)
+        with self.app.test_request_context():
+            self.assertIsNone(self.ldap_backend.user_info_for_username('jdoe'))
+            self.assertIsNone(self.ldap_backend.user_info(self.jdoe_dn))
+
+    def test_forget_user_info(self):
+        """Check that an evicted user entry is fetched again."""
+        with self.app.test_request_context():
+            self.assertIsNone(self.ldap_backend.user_info_for_username('jane'))
+            self.assertIsNotNone(self.ldap_backend.user_info(self.jdoe_dn))
+            setup_add_ldap_person(self.ldap_backend, {
+                'first_name': 'Jane',
+                'surname': 'Doe',
+                'username': 'jane',
+            })
+            self.assertIsNone(self.ldap_backend.user_info_for_username('jane'))
+            self.ldap_backend.forget_user_info('jane')
+            self.assertIsNotNone(self.ldap_backend.user_info_for_username('jane'))
+            self.ldap_backend.forget_user_info('jdoe')
+            self.assertNotIn(self.jdoe_dn, self.ldap_backend.identity_map['dn'])
+
+
+class TestUserCache(unittest.TestCase):
+    """Check the cross-request cache of user entries."""
+
+    def setUp(self):
+        super(TestUserCache, self).setUp()
+        self.app = create_app(read_config(TEST_CONFIG))
+        self.ldap_backend = LDAPBackend(self.app, fake=True)
+        self.app.ldap_backend = self.ldap_backend
+        self.jdoe = {
+            'first_name': 'John',
+            'surname': 'Doe',
+            'email': 'jdoe@example.org',
+            'username': 'jdoe',
+        }
+        setup_add_ldap_person(self.ldap_backend, self.jdoe)
+
+    def tearDown(self):
+        super(TestUserCache, self).tearDown()
+        clean_people_tree(self.ldap_backend)
+
+    def test_cached_across_requests(self):
+        """Check that a user entry found in a request is served from the cache afterwards."""
+        with self.app.test_request_context():
+            user_info = self.ldap_backend.user_info_for_username('jdoe')
+        with self.app.test_request_context():
+            self.assertIs(self.ldap_backend.user_info_for_username('jdoe'), user_info)
+        self.assertEqual(self.ldap_backend.user_cache.hits, 1)
+        self.assertEqual(self.ldap_backend.user_cache.misses, 1)
+
+    def test_unknown_user_not_cached(self):
+        """Check that a missing user is searched again in the next request."""
+        with self.app.test_request_context():
+            self.assertIsNone(self.ldap_backend.user_info_for_username('jane'))
+        setup_add_ldap_person(self.ldap_backend, {
+            'first_name': 'Jane',
+            'surname': 'Doe',
+            'username': 'jane',
+        })
+        with self.app.test_request_context():
+            self.assertIsNotNone(self.ldap_backend.user_info_for_username('jane'))
+
+    def test_invalidated_on_update(self):
+        """Check that updating a person invalidates its cached entry."""
+        with self.app.test_request_context():
+            self.ldap_backend.user_info_for_username('jdoe')
+        john = self.jdoe.copy()
+        john['first_name'] = 'Johnny'
+        with self.ldap_backend.admin_connection() as ldap_conn:
+            self.ldap_backend.update_person(new_person(**john), ldap_conn)
+        with self.app.test_request_context():
+            user_info = self.ldap_backend.user_info_for_username('jdoe')
+        self.assertEqual(user_info['givenName'], ['Johnny'])
+
+    def test_pinned_session_bypasses_cache(self):
+        """Check that a session pinned to the write servers reads a fresh entry while the cache
+        holds a stale one."""
+        self.app.config['SECRET_KEY'] = 'secret'
+        with self.app.test_request_context():
+            stale_info = self.ldap_backend.user_info_for_username('jdoe')
+        john = self.jdoe.copy()
+        john['first_name'] = 'Johnny'
+        with self.ldap_backend.admin_connection() as ldap_conn:
+            self.ldap_backend.update_person(new_person(**john), ldap_conn)
+        # A write made by another process leaves the cache of this one stale
+        self.ldap_backend.user_cache.set('jdoe', stale_info)
+        with self.app.test_request_context():
+            session[MASTER_PIN_SESSION_KEY] = time.time() + 5
+            user_info = self.ldap_backend.user_info_for_username('jdoe')
+        self.assertEqual(user_info['givenName'], ['Johnny'])
+
+    def test_read_servers_cached(self):
+        """Check that entries read from the read servers are cached too."""
+        self.app.config['LDAP_READ_HOSTS'] = 'replica.example.org'
+        ldap_backend = LDAPBackend(self.app, fake=True)
+        self.app.ldap_backend = ldap_backend
+        setup_add_ldap_person(ldap_backend, self.jdoe)
+        with self.app.test_request_context():
+            user_info = ldap_backend.user_info_for_username('jdoe')
+        self.assertIs(ldap_backend.user_cache.get('jdoe'), user_info)
+        clean_people_tree(ldap_backend)
+
+
+class TestAuthenticate(unittest.TestCase):
+    """Check the authentication of people by a bind to the directory."""
+
+    def setUp(self):
+        super(TestAuthenticate, self).setUp()
+        self.app = create_app(read_config(TEST_CONFIG))
+        self.app.config['LDAP_METRICS'] = True
+        self.ldap_backend = LDAPBackend(self.app, fake=True)
+        self.app.people_backend = self.app.ldap_backend = self.ldap_backend
+        # The fake directory checks binds against clear text passwords
+        setup_add_ldap_person(self.ldap_backend, {
+            'first_name': 'John',
+            'surname': 'Doe',
+            'email': 'jdoe@example.org',
+            'username': 'jdoe',
+            'password': 'jdoe1234',
+        })
+        self.jdoe_dn = 'uid=jdoe,{0}'.format(self.ldap_backend._people_basedn)
+        setup_active_role(self.ldap_backend, [self.jdoe_dn])
+        with self.ldap_backend.admin_connection() as ldap_conn:
+            self.ldap_backend.active_role_dn(ldap_conn)
+        self.ldap_backend.metrics.reset()
+
+    def tearDown(self):
+        super(TestAuthenticate, self).tearDown()
+        clean_people_tree(self.ldap_backend)
+
+    def operations(self):
+        return dict((key, series['count'])
+                    for key, series in self.ldap_backend.metrics.snapshot().items())
+
+    def test_direct_bind(self):
+        """Check that people named by their username are bound to without a search, the entry
+        read once bound being reused by the rest of the login."""
+        self.assertEqual(self.ldap_backend.user_dn_for_username('jdoe'), self.jdoe_dn)
+        with self.app.test_request_context():
+            jdoe = self.ldap_backend.authenticate('jdoe', 'jdoe1234')
+            self.assertEqual(jdoe.email, 'jdoe@example.org')
+            self.assertEqual(self.operations(), {('bind', 'authenticate'): 1,
+                                                 ('search', 'authenticate'): 1})
+            self.assertTrue(jdoe.is_active)
+            self.assertEqual(self.operations()[('compare', 'person_is_active')], 1)
+            self.assertNotIn(('search', 'person_is_active'), self.operations())
+        with self.app.test_request_context():
+            self.assertIsNotNone(self.ldap_backend.get_person('jdoe'))  # Cached
+            self.assertNotIn(('search', 'get_person'), self.operations())
+
+    def test_wrong_credentials(self):
+        """Check that a wrong password, an unknown username or an empty password do not
+        authenticate, unknown people not being searched."""
+        with self.app.test_request_context():
+            self.assertIsNone(self.ldap_backend.authenticate('jdoe', 'jdoe12345'))
+            self.assertIsNone(self.ldap_backend.authenticate('jane', 'jdoe1234'))
+            self.assertIsNone(self.ldap_backend.authenticate('jdoe', ''))
+        self.assertEqual(self.operations(), {('bind', 'authenticate'): 2})
+
+    def test_search_bind(self):
+        """Check that people not named by their login attribute are searched, then bound to."""
+        self.app.config['LDAP_USER_LOGIN_ATTRIBUTE'] = 'mail'
+        self.app.config['LDAP_USER_LOGIN_ATTR'] = 'mail'
+        self.assertIsNone(self.ldap_backend.user_dn_for_username('jdoe@example.org'))
+        with self.app.test_request_context():
+            jdoe = self.ldap_backend.authenticate('jdoe@example.org', 'jdoe1234')
+            self.assertEqual(jdoe.username, 'jdoe')
+            self.assertIsNone(self.ldap_backend.authenticate('jdoe@example.org', 'jane1234'))
+            self.assertIsNone(self.ldap_backend.authenticate('jane@example.org', 'jdoe1234'))
+
+    def test_login_options(self):
+        """Check that flask-ldap3-login looks people up with the login and RDN attributes of the
+        configuration."""
+        config = read_config(TEST_CONFIG)
+        config.set('ldap', 'LDAP_USER_LOGIN_ATTRIBUTE', 'mail')
+        app = create_app(config)
+        self.assertEqual(app.config['LDAP_USER_LOGIN_ATTR'], 'mail')
+        self.assertEqual(app.config['LDAP_USER_RDN_ATTR'], 'uid')
+
+
+class TestObjectDefCache(unittest.TestCase):
+    """Check the process-wide cache of ``ObjectDef`` instances."""
+
+    def setUp(self):
+        super(TestObjectDefCache, self).setUp()
+        self.app = create_app(read_config(TEST_CONFIG))
+        self.ldap_backend = LDAPBackend(self.app, fake=True)
+        invalidate_object_defs()
+
+    def test_object_def_shared(self):
+        """Check that the same definition is returned for the same server and class."""
+        with self.ldap_backend.admin_connection() as ldap_conn:
+            person_def = object_def('inetOrgPerson', ldap_conn)
+            self.assertIs(object_def('inetOrgPerson', ldap_conn), person_def)
+            self.assertIsNot(object_def('organizationalRole', ldap_conn), person_def)
+            with self.ldap_backend.read_cursor(ldap_conn, 'inetOrgPerson',
+                                               self.ldap_backend._people_basedn) as cur:
+                self.assertIs(cur.definition, person_def)
+
+    def test_schema_version_change(self):
+        """Check that a new definition is built when the schema version changes."""
+        with self.ldap_backend.admin_connection() as ldap_conn:
+            person_def = object_def('inetOrgPerson', ldap_conn)
+            ldap_conn.server.schema.modify_time_stamp = ['20990101000000Z']
+            self.assertIsNot(object_def('inetOrgPerson', ldap_conn), person_def)
+
+    def test_invalidate(self):
+        """Check that definitions are built again after an explicit invalidation."""
+        with self.ldap_backend.admin_connection() as ldap_conn:
+            person_def = object_def('inetOrgPerson', ldap_conn)
+            invalidate_object_defs('ldap://other:389')
+            self.assertIs(object_def('inetOrgPerson', ldap_conn), person_def)
+            invalidate_object_defs(ldap_conn.server.name)
+            self.assertIsNot(object_def('inetOrgPerson', ldap_conn), person_def)
+
+
 if __name__ == '__main__':
     unittest.main()
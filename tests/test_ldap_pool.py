@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+"""Tests about the pool of LDAP connections."""
+
+import os
+import unittest
+
+from ldap3.core.exceptions import LDAPSocketOpenError
+
+from aliquis import create_app, read_config
+from aliquis.ldap import LDAPBackend
+from aliquis.ldap_pool import LDAPConnectionPool, LDAPPoolTimeoutError
+
+
+TEST_CONFIG = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'test-settings.ini')
+
+
+class TestConnectionPool(unittest.TestCase):
+    """Check checking out and giving back pooled connections."""
+
+    def setUp(self):
+        super(TestConnectionPool, self).setUp()
+        self.app = create_app(read_config(TEST_CONFIG))
+        self.ldap_backend = LDAPBackend(self.app, fake=True)
+        self.opened = []
+
+    def make_pool(self, **kwargs):
+        def factory():
+            conn = self.ldap_backend._new_admin_connection()
+            self.opened.append(conn)
+            return conn
+        return LDAPConnectionPool(factory, **kwargs)
+
+    def test_connection_reused(self):
+        """Check that a connection given back to the pool is handed out again."""
+        pool = self.make_pool(min_size=1, max_size=2)
+        with pool.connection() as conn1:
+            self.assertTrue(conn1.bound)
+        with pool.connection() as conn2:
+            self.assertIs(conn1, conn2)
+        self.assertEqual(len(self.opened), 1)
+        self.assertEqual(pool.size, 1)
+
+    def test_min_size(self):
+        """Check that the pool opens ``min_size`` connections on first use."""
+        pool = self.make_pool(min_size=3, max_size=5)
+        self.assertEqual(pool.size, 0)
+        with pool.connection():
+            self.assertEqual(pool.size, 3)
+            self.assertEqual(pool.idle, 2)
+
+    def test_checkout_timeout(self):
+        """Check that an error is raised when no connection is released in time."""
+        pool = self.make_pool(min_size=0, max_size=1, timeout=0.05)
+        conn = pool.checkout()
+        with self.assertRaises(LDAPPoolTimeoutError):
+            pool.checkout()
+        pool.checkin(conn)
+        self.assertIs(pool.checkout(), conn)
+
+    def test_idle_reaping(self):
+        """Check that connections idle for too long are closed down to ``min_size``."""
+        pool = self.make_pool(min_size=1, max_size=3, max_idle=0)
+        conns = [pool.checkout() for _ in range(3)]
+        for conn in conns:
+            pool.checkin(conn)
+        self.assertEqual(pool.size, 1)
+        self.assertEqual(sum(1 for conn in conns if conn.closed), 2)
+
+    def test_live_connection_probed(self):
+        """Check that a connection answering the liveness probe is handed out again."""
+        pool = self.make_pool(min_size=1, max_size=1, probe_after=0)
+        with pool.connection() as conn1:
+            pass
+        with pool.connection() as conn2:
+            self.assertIs(conn1, conn2)
+
+    def test_dead_connection_replaced(self):
+        """Check that a connection which does not answer anymore is replaced by a new one."""
+        pool = self.make_pool(min_size=1, max_size=1, probe_after=0)
+        with pool.connection() as conn1:
+            pass
+        conn1.unbind()
+        with pool.connection() as conn2:
+            self.assertIsNot(conn1, conn2)
+            self.assertTrue(conn2.bound)
+        self.assertEqual(pool.size, 1)
+
+    def test_discard_on_communication_error(self):
+        """Check that a connection is not given back to the pool after a communication error."""
+        pool = self.make_pool(min_size=0, max_size=1)
+        with self.assertRaises(LDAPSocketOpenError):
+            with pool.connection() as conn:
+                raise LDAPSocketOpenError('server down')
+        self.assertEqual(pool.size, 0)
+        self.assertTrue(conn.closed)
+
+    def test_request_connection(self):
+        """Check that the backend connection is shared during an application context."""
+        with self.app.app_context():
+            conn = self.ldap_backend.connection
+            self.assertIs(self.ldap_backend.connection, conn)
+            self.assertEqual(self.ldap_backend.pool.idle, 0)
+        self.assertEqual(self.ldap_backend.pool.idle, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
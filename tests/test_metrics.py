@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+"""Tests about the instrumentation of LDAP operations."""
+
+import os
+import threading
+import unittest
+
+from aliquis import create_app, read_config
+from aliquis.ldap import LDAPBackend
+from aliquis.metrics import LDAPMetrics, call_site, current_call_site
+
+from tests.test_ldap import clean_people_tree, setup_add_ldap_person
+
+
+TEST_CONFIG = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'test-settings.ini')
+
+
+@call_site
+def outer():
+    return inner()
+
+
+@call_site
+def inner():
+    return current_call_site()
+
+
+class TestLDAPMetrics(unittest.TestCase):
+    """Check recording and rendering of operation metrics."""
+
+    def test_call_site(self):
+        """Check that the outermost decorated function names the call site."""
+        self.assertEqual(current_call_site(), 'unknown')
+        self.assertEqual(inner(), 'inner')
+        self.assertEqual(outer(), 'outer')
+        self.assertEqual(current_call_site(), 'unknown')
+
+    def test_call_site_by_thread(self):
+        """Check that each thread has its own call site."""
+        sites = []
+
+        @call_site
+        def spawn():
+            thread = threading.Thread(target=lambda: sites.append(current_call_site()))
+            thread.start()
+            thread.join()
+            sites.append(current_call_site())
+
+        spawn()
+        self.assertEqual(sites, ['unknown', 'spawn'])
+
+    def test_observe(self):
+        """Check that counts, errors and cumulative buckets are recorded by operation and call
+        site."""
+        metrics = LDAPMetrics()
+        metrics.observe('search', 'load_user', 0.0004)
+        metrics.observe('search', 'load_user', 0.02, error=True)
+        metrics.observe('search', 'load_user', 20)
+        metrics.observe('bind', 'authenticate', 0.003)
+        snapshot = metrics.snapshot()
+        self.assertEqual(set(snapshot), set([('search', 'load_user'), ('bind', 'authenticate')]))
+        search = snapshot[('search', 'load_user')]
+        self.assertEqual((search['count'], search['errors']), (3, 1))
+        self.assertAlmostEqual(search['sum'], 20.0204)
+        buckets = dict(search['buckets'])
+        self.assertEqual((buckets[0.0005], buckets[0.01], buckets[0.025], buckets[10.0]),
+                         (1, 1, 2, 2))
+        metrics.reset()
+        self.assertEqual(metrics.snapshot(), dict())
+
+    def test_recent_latency(self):
+        """Check that the recent latency follows the latency of the last operations."""
+        metrics = LDAPMetrics()
+        self.assertIsNone(metrics.recent_latency)
+        metrics.observe('search', 'load_user', 0.01)
+        self.assertEqual(metrics.recent_latency, 0.01)
+        for _ in range(50):
+            metrics.observe('search', 'load_user', 1.0)
+        self.assertGreater(metrics.recent_latency, 0.9)
+        metrics.reset()
+        self.assertIsNone(metrics.recent_latency)
+
+    def test_render(self):
+        """Check the Prometheus text format."""
+        metrics = LDAPMetrics()
+        metrics.observe('compare', 'person_is_active', 0.002)
+        text = metrics.render()
+        labels = 'operation="compare",call_site="person_is_active",pid="{0}"'.format(os.getpid())
+        self.assertIn('# TYPE aliquis_ldap_operation_duration_seconds histogram\n', text)
+        self.assertIn('aliquis_ldap_operations_total{{{0}}} 1\n'.format(labels), text)
+        self.assertIn('aliquis_ldap_operation_errors_total{{{0}}} 0\n'.format(labels), text)
+        self.assertIn('aliquis_ldap_operation_duration_seconds_bucket{{{0},le="0.001"}} 0\n'
+                      .format(labels), text)
+        self.assertIn('aliquis_ldap_operation_duration_seconds_bucket{{{0},le="+Inf"}} 1\n'
+                      .format(labels), text)
+        self.assertIn('aliquis_ldap_operation_duration_seconds_count{{{0}}} 1\n'.format(labels),
+                      text)
+
+    def test_slow_operations_logged(self):
+        """Check that only operations above the threshold are logged."""
+        metrics = LDAPMetrics(slow_seconds=0.5)
+        with self.assertLogs('aliquis.metrics', level='WARNING') as logs:
+            metrics.observe('search', 'load_user', 0.1, target='ou=people')
+            metrics.observe('search', 'load_user', 0.7, target='ou=people')
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('search from load_user on ou=people: 0.700 s', logs.output[0])
+
+
+class TestInstrumentedBackend(unittest.TestCase):
+    """Check that operations of the LDAP backend are instrumented."""
+
+    def setUp(self):
+        super(TestInstrumentedBackend, self).setUp()
+        self.app = create_app(read_config(TEST_CONFIG))
+        self.app.config['LDAP_METRICS'] = True
+        self.ldap_backend = LDAPBackend(self.app, fake=True)
+        self.app.people_backend = self.app.ldap_backend = self.ldap_backend
+        setup_add_ldap_person(self.ldap_backend, {
+            'first_name': 'John',
+            'surname': 'Doe',
+            'email': 'jdoe@example.org',
+            'username': 'jdoe',
+        })
+
+    def tearDown(self):
+        super(TestInstrumentedBackend, self).tearDown()
+        clean_people_tree(self.ldap_backend)
+
+    def test_operations_recorded(self):
+        """Check that operations are recorded with their call site, failed ones as errors."""
+        self.ldap_backend.metrics.reset()
+        with self.ldap_backend.admin_connection() as ldap_conn:
+            self.ldap_backend.person_by_username('jdoe', ldap_conn)
+            self.ldap_backend.username_exists('jdoe', ldap_conn)
+            ldap_conn.delete('uid=jim,{0}'.format(self.ldap_backend._people_basedn))
+        snapshot = self.ldap_backend.metrics.snapshot()
+        self.assertEqual(snapshot[('search', 'person_by_username')]['count'], 1)
+        self.assertEqual(snapshot[('search', 'username_exists')]['count'], 1)
+        self.assertEqual(snapshot[('delete', 'unknown')]['errors'], 1)
+
+    def test_endpoint(self):
+        """Check that metrics are exposed only if enabled."""
+        client = self.app.test_client()
+        with self.app.test_request_context():
+            self.ldap_backend.get_person('jdoe')
+        response = client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        self.assertIn(b'call_site="get_person"', response.data)
+        self.app.config['LDAP_METRICS'] = False
+        self.assertEqual(client.get('/metrics').status_code, 302)  # Redirected to error page
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+"""Tests about rate limiting and load shedding."""
+
+from configparser import ParsingError
+import os
+import time
+import unittest
+
+from aliquis import create_app, read_config
+from aliquis.person import person as new_person
+from aliquis.ratelimit import (MemoryBucketStore, RateLimitExceeded, RateLimiter,
+                               RedisBucketStore, create_rate_limiter)
+
+from tests.test_sql import setup_sql_backend
+
+
+TEST_CONFIG = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'test-settings.ini')
+
+
+class TestMemoryBucketStore(unittest.TestCase):
+    """Check the in-process token buckets."""
+
+    def test_take(self):
+        """Check that a bucket gives its burst of tokens, then tells how long to wait."""
+        store = MemoryBucketStore()
+        self.assertEqual([store.take('ip', 3, 1) for _ in range(3)], [0, 0, 0])
+        wait = store.take('ip', 3, 1)
+        self.assertGreater(wait, 0.9)
+        self.assertLessEqual(wait, 1)
+        self.assertEqual(store.take('other', 3, 1), 0)
+
+    def test_refill(self):
+        """Check that buckets are refilled over time."""
+        store = MemoryBucketStore()
+        self.assertEqual(store.take('ip', 1, 100), 0)
+        self.assertGreater(store.take('ip', 1, 100), 0)
+        time.sleep(0.02)
+        self.assertEqual(store.take('ip', 1, 100), 0)
+
+    def test_bounded(self):
+        """Check that the least recently used buckets are forgotten first."""
+        store = MemoryBucketStore(maxsize=2)
+        for key in ('a', 'b', 'a', 'c'):
+            store.take(key, 1, 0.01)
+        self.assertEqual(set(store._buckets), set(['a', 'c']))
+        self.assertEqual(store.take('b', 1, 0.01), 0)
+
+
+class TestRateLimiter(unittest.TestCase):
+    """Check the limits by address and account, and load shedding."""
+
+    def test_limits(self):
+        """Check that requests take tokens from the buckets of their address and account."""
+        limiter = RateLimiter(MemoryBucketStore(), ip_limit=(3, 1), account_limit=(2, 1))
+        limiter.check('login', '10.0.0.1', 'jdoe')
+        limiter.check('login', '10.0.0.1', 'jdoe')
+        with self.assertRaises(RateLimitExceeded) as ctx:
+            limiter.check('login', '10.0.0.2', 'jdoe')
+        self.assertGreater(ctx.exception.retry_after, 0)
+        limiter.check('login', '10.0.0.1', 'jane')
+        with self.assertRaises(RateLimitExceeded):
+            limiter.check('login', '10.0.0.1', 'jim')
+        limiter.check('forget', '10.0.0.1')  # Buckets are by scope
+
+    def test_shed(self):
+        """Check that requests are refused in proportion of the excess latency of the
+        directory."""
+        latency = [None]
+        limiter = RateLimiter(MemoryBucketStore(), ip_limit=(1000, 1), shed_latency=0.1,
+                              latency=lambda: latency[0])
+        self.assertFalse(limiter.should_shed())
+        latency[0] = 0.05
+        self.assertFalse(any(limiter.should_shed() for _ in range(100)))
+        latency[0] = 1000
+        self.assertTrue(all(limiter.should_shed() for _ in range(100)))
+        with self.assertRaises(RateLimitExceeded):
+            limiter.check('login', '10.0.0.1')
+        latency[0] = 0.2
+        shed = sum(limiter.should_shed() for _ in range(1000))
+        self.assertTrue(300 < shed < 700)
+
+
+class TestRedisBucketStore(unittest.TestCase):
+    """Check the token buckets shared through Redis."""
+
+    def test_unreachable(self):
+        """Check that requests are let through when the Redis server cannot be reached."""
+        store = RedisBucketStore('redis://127.0.0.1:1/0')
+        with self.assertLogs('aliquis.ratelimit', level='WARNING'):
+            self.assertEqual(store.take('ip', 1, 1), 0)
+
+
+class TestAppRateLimiter(unittest.TestCase):
+    """Check the rate limiting of the sign views."""
+
+    def setUp(self):
+        super(TestAppRateLimiter, self).setUp()
+        self.app = create_app(read_config(TEST_CONFIG))
+        self.app.config['SECRET_KEY'] = 'secret'
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        self.app.rate_limiter = RateLimiter(MemoryBucketStore(), ip_limit=(4, 1),
+                                            account_limit=(2, 1))
+        sql_backend = setup_sql_backend(self.app)
+        with self.app.app_context():
+            sql_backend.create_person(new_person(first_name='John', surname='Doe',
+                                                 username='jdoe', email='jdoe@example.org',
+                                                 password='jdoe1234'))
+            sql_backend.activate_person('jdoe')
+        self.client = self.app.test_client()
+
+    def login(self, username, password='wrong', address='127.0.0.1'):
+        return self.client.post('/login', data={'username': username, 'password': password},
+                                environ_base={'REMOTE_ADDR': address})
+
+    def test_config(self):
+        """Check that the rate limiter is configured by the app options, and disabled by
+        default."""
+        app = create_app(read_config(TEST_CONFIG))
+        self.assertIsNone(app.rate_limiter)
+        app.config['RATE_LIMIT_ENABLED'] = True
+        app.rate_limiter = create_rate_limiter(app)
+        self.assertIsInstance(app.rate_limiter.store, MemoryBucketStore)
+        self.assertEqual(app.rate_limiter.ip_limit, (20, 10))
+        app.config['RATE_LIMIT_STORAGE'] = 'redis'
+        self.assertIsInstance(create_rate_limiter(app).store, RedisBucketStore)
+        app.config['RATE_LIMIT_STORAGE'] = 'memcached'
+        with self.assertRaises(ParsingError):
+            create_rate_limiter(app)
+        app.config['RATE_LIMIT_ENABLED'] = False
+        self.assertIsNone(create_rate_limiter(app))
+
+    def test_account_limit(self):
+        """Check that login attempts on an account are refused beyond its limit."""
+        self.assertEqual(self.login('jdoe').status_code, 401)
+        self.assertEqual(self.login('JDOE ').status_code, 401)
+        response = self.login('jdoe', 'jdoe1234')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], '60')
+        self.assertIn('message', response.get_json())
+        self.assertEqual(self.login('jane').status_code, 401)
+
+    def test_account_limit_by_address(self):
+        """Check that failed logins on an account from an address do not lock it out from other
+        addresses."""
+        for _ in range(2):
+            self.assertEqual(self.login('jdoe', address='10.0.0.66').status_code, 401)
+        self.assertEqual(self.login('jdoe', address='10.0.0.66').status_code, 429)
+        self.assertEqual(self.login('jdoe', 'jdoe1234').status_code, 200)
+
+    def test_address_limit(self):
+        """Check that requests from an address are refused beyond its limit."""
+        for username in ('jane', 'jim', 'joe', 'jack'):
+            self.assertEqual(self.login(username).status_code, 401)
+        self.assertEqual(self.login('jdoe', 'jdoe1234').status_code, 429)
+
+    def test_shed(self):
+        """Check that limited requests are refused while the directory is slow."""
+        self.app.rate_limiter.shed_latency = 0.5
+        self.app.rate_limiter.latency = lambda: 1e9
+        self.assertEqual(self.login('jdoe', 'jdoe1234').status_code, 429)
+        self.assertEqual(self.client.get('/api/confirm/token').status_code, 429)
+        self.app.rate_limiter.latency = lambda: 0.1
+        self.assertEqual(self.login('jdoe', 'jdoe1234').status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+"""Tests about sending emails with sendgrid."""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import unittest
+
+import requests
+
+from aliquis.views.mail import Contact
+from aliquis.views.mail.sendgrid import SendGridClient, get_client, send_email
+
+
+SENDER = Contact('Example Inc.', 'no-reply@example.org')
+RECIPIENT = Contact('John Doe', 'jdoe@example.org')
+
+
+class FakeAPI(object):
+    """Local HTTP server answering posted mails with the given statuses (202 when there is none
+    left), and counting connections."""
+
+    def __init__(self, statuses=(), headers=None):
+        self.statuses = list(statuses)
+        self.headers = headers or dict()
+        self.messages = []
+        self.authorizations = []
+        self.connections = 0
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super(Handler, self).setup()
+                fake.connections += 1
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                fake.messages.append(json.loads(body.decode('utf-8')))
+                fake.authorizations.append(self.headers.get('Authorization'))
+                status = fake.statuses.pop(0) if fake.statuses else 202
+                self.send_response(status)
+                for name, value in fake.headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self.url = 'http://127.0.0.1:{0}/v3'.format(self._server.server_address[1])
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class TestSendGridClient(unittest.TestCase):
+    """Check the pooled client of the sendgrid API."""
+
+    def setUp(self):
+        super(TestSendGridClient, self).setUp()
+        self.api = FakeAPI()
+
+    def tearDown(self):
+        super(TestSendGridClient, self).tearDown()
+        self.api.stop()
+
+    def client(self, **options):
+        options.setdefault('backoff', 0.001)
+        client = SendGridClient('1234', self.api.url, **options)
+        self.addCleanup(client.close)
+        return client
+
+    def test_keep_alive(self):
+        """Check that mails are sent through a single kept alive connection."""
+        client = self.client()
+        for i in range(3):
+            client.send(SENDER, RECIPIENT, 'Mail {0}'.format(i), '<p>Hello</p>', 'Hello')
+        self.assertEqual([message['subject'] for message in self.api.messages],
+                         ['Mail 0', 'Mail 1', 'Mail 2'])
+        self.assertEqual(self.api.messages[0]['personalizations'][0]['to'][0]['email'],
+                         'jdoe@example.org')
+        self.assertEqual(self.api.authorizations, ['Bearer 1234'] * 3)
+        self.assertEqual(self.api.connections, 1)
+
+    def test_retry(self):
+        """Check that mails refused with a 429 or 5xx status are sent again."""
+        self.api.statuses = [503, 429]
+        self.client().send(SENDER, RECIPIENT, 'Hello', '<p>Hello</p>', 'Hello')
+        self.assertEqual(len(self.api.messages), 3)
+
+    def test_give_up(self):
+        """Check that errors are raised after the last retry, or right away on client errors."""
+        self.api.statuses = [500, 500, 500]
+        with self.assertRaises(requests.HTTPError):
+            self.client(retries=2).send(SENDER, RECIPIENT, 'Hello', '<p>Hello</p>', 'Hello')
+        self.assertEqual(len(self.api.messages), 3)
+        self.api.statuses = [400]
+        with self.assertRaises(requests.HTTPError):
+            self.client().send(SENDER, RECIPIENT, 'Hello', '<p>Hello</p>', 'Hello')
+        self.assertEqual(len(self.api.messages), 4)
+
+    def test_retry_after(self):
+        """Check that Retry-After delays are followed, unless they are too long."""
+        client = self.client(backoff=0)
+        response = requests.Response()
+        response.headers['Retry-After'] = '2'
+        self.assertEqual(client.retry_delay(0, response), 2)
+        response.headers['Retry-After'] = '3600'
+        self.assertIsNone(client.retry_delay(0, response))
+        self.assertEqual(client.retry_delay(3), 0)
+
+    def test_connection_error(self):
+        """Check that a mail which cannot be sent raises an error once retries are exhausted."""
+        self.api.stop()
+        with self.assertRaises(requests.ConnectionError):
+            self.client(retries=1).send(SENDER, RECIPIENT, 'Hello', '<p>Hello</p>', 'Hello')
+
+    def test_connection_error_too_long_delay(self):
+        """Check that a connection error is raised right away when the next retry would come
+        too late."""
+        self.api.stop()
+        client = self.client(retries=7)
+        client.retry_delay = lambda attempt, response=None: None
+        with self.assertRaises(requests.ConnectionError):
+            client.send(SENDER, RECIPIENT, 'Hello', '<p>Hello</p>', 'Hello')
+
+    def test_shared_client(self):
+        """Check that mails sent with the same settings by a process share a client."""
+        self.assertIs(get_client('1234', self.api.url, retries=1),
+                      get_client('1234', self.api.url, retries=1))
+        self.assertIsNot(get_client('1234', self.api.url), get_client('5678', self.api.url))
+        send_email(SENDER, RECIPIENT, 'Hello', '<p>Hello</p>', 'Hello', '1234', self.api.url)
+        send_email(SENDER, RECIPIENT, 'Hello', '<p>Hello</p>', 'Hello', '1234', self.api.url)
+        self.assertEqual(self.api.connections, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
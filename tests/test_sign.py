@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+"""Tests about the sign views."""
+
+import os
+import unittest
+
+from aliquis import create_app, read_config
+from aliquis.ldap import LDAPBackend
+
+from aliquis.person import person as new_person
+
+from tests.test_ldap import clean_people_tree, setup_active_role, setup_add_ldap_person, setup_role
+from tests.test_sql import setup_sql_backend
+
+
+TEST_CONFIG = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'test-settings.ini')
+
+
+class TestAvailability(unittest.TestCase):
+    """Check the username and email address availability API view."""
+
+    def setUp(self):
+        super(TestAvailability, self).setUp()
+        self.app = create_app(read_config(TEST_CONFIG))
+        self.app.config['SECRET_KEY'] = 'secret'
+        self.app.people_backend = self.app.ldap_backend = LDAPBackend(self.app, fake=True)
+        setup_add_ldap_person(self.app.ldap_backend, {
+            'first_name': 'John',
+            'surname': 'Doe',
+            'email': 'jdoe@example.org',
+            'username': 'jdoe',
+        })
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        super(TestAvailability, self).tearDown()
+        clean_people_tree(self.app.ldap_backend)
+
+    def test_available(self):
+        """Check that free and used values are told apart."""
+        response = self.client.get('/api/available?username=jdoe&email=jane@example.org')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {'username': False, 'email': True})
+        response = self.client.get('/api/available?username=jane')
+        self.assertEqual(response.get_json(), {'username': True})
+
+    def test_nothing_to_check(self):
+        """Check that a request without values is rejected."""
+        self.assertEqual(self.client.get('/api/available?username=').status_code, 400)
+
+
+class TestGrants(unittest.TestCase):
+    """Check the grants API views."""
+
+    def setUp(self):
+        super(TestGrants, self).setUp()
+        self.app = create_app(read_config(TEST_CONFIG))
+        self.app.config['SECRET_KEY'] = 'secret'
+        self.app.config['API_GRANTS_READER'] = 'Grants reader'
+        self.app.login_manager.session_protection = None
+        self.app.people_backend = self.app.ldap_backend = ldap_backend = LDAPBackend(
+            self.app, fake=True
+        )
+        for username in ('jdoe', 'jane'):
+            setup_add_ldap_person(ldap_backend, {
+                'first_name': 'John',
+                'surname': 'Doe',
+                'username': username,
+            })
+        jdoe_dn = 'uid=jdoe,{0}'.format(ldap_backend._people_basedn)
+        jane_dn = 'uid=jane,{0}'.format(ldap_backend._people_basedn)
+        setup_active_role(ldap_backend, [jdoe_dn, jane_dn])
+        setup_role(ldap_backend, 'wiki', 'Wiki access', [jdoe_dn, jane_dn])
+        setup_role(ldap_backend, 'grants', 'Grants reader', [jdoe_dn])
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        super(TestGrants, self).tearDown()
+        clean_people_tree(self.app.ldap_backend)
+
+    def login(self, username):
+        with self.client.session_transaction() as session:
+            session['_user_id'] = username
+            session['_fresh'] = True
+
+    def assertForbidden(self, response):
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response.headers['Location'].endswith('/error/403'))
+
+    def test_own_grants(self):
+        """Check that a person can read its own grants only."""
+        self.login('jane')
+        self.assertEqual(self.client.get('/api/grants/jane').get_json(), ['Wiki access'])
+        self.assertForbidden(self.client.get('/api/grants/jdoe'))
+
+    def test_batch_grants(self):
+        """Check that grants of many people are returned at once."""
+        self.login('jdoe')
+        response = self.client.get('/api/grants?user=jane&user=jdoe&user=jim')
+        self.assertEqual(response.status_code, 200)
+        grants = response.get_json()
+        self.assertEqual(grants['jane'], ['Wiki access'])
+        self.assertEqual(sorted(grants['jdoe']), ['Grants reader', 'Wiki access'])
+        self.assertIsNone(grants['jim'])
+
+    def test_batch_grants_forbidden(self):
+        """Check that only grants readers can read grants of other people."""
+        self.login('jane')
+        self.assertForbidden(self.client.get('/api/grants?user=jdoe'))
+
+
+class TestSQLStorage(unittest.TestCase):
+    """Check views with people stored in an SQL database."""
+
+    def setUp(self):
+        super(TestSQLStorage, self).setUp()
+        self.app = create_app(read_config(TEST_CONFIG))
+        self.app.config['SECRET_KEY'] = 'secret'
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        self.app.login_manager.session_protection = None
+        sql_backend = setup_sql_backend(self.app)
+        with self.app.app_context():
+            sql_backend.create_person(new_person(first_name='John', surname='Doe',
+                                                 username='jdoe', email='jdoe@example.org',
+                                                 password='jdoe1234'))
+            sql_backend.activate_person('jdoe')
+            sql_backend.add_grant('jdoe', 'Wiki access')
+        self.client = self.app.test_client()
+
+    def test_login(self):
+        """Check that people log in with their password and can then read their data."""
+        response = self.client.post('/login', data={'username': 'jdoe', 'password': 'wrong'})
+        self.assertEqual(response.status_code, 401)
+        response = self.client.post('/login', data={'username': 'jdoe', 'password': 'jdoe1234'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {'id': 'jdoe'})
+        user = self.client.get('/api/user/jdoe').get_json()
+        self.assertEqual(user['email'], 'jdoe@example.org')
+        self.assertTrue(user['is_active'])
+        self.assertEqual(self.client.get('/api/grants/jdoe').get_json(), ['Wiki access'])
+
+    def test_available(self):
+        """Check that free and used values are told apart."""
+        response = self.client.get('/api/available?username=JDOE&email=jane@example.org')
+        self.assertEqual(response.get_json(), {'username': False, 'email': True})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+
+"""Tests about storing person information in an SQL database."""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from aliquis import create_app, read_config
+from aliquis.person import person as new_person
+from aliquis.sql import SQLBackend, SQLConnectionPool, SQLPoolTimeoutError
+from aliquis.storage import NoSuchPersonError, PersonAlreadyExistsError
+
+
+TEST_CONFIG = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'test-settings.ini')
+
+
+def setup_sql_backend(app, database=':memory:'):
+    """Return a new ``SQLBackend`` of the given app, which becomes its people backend."""
+    app.config['SQL_DATABASE'] = database
+    app.people_backend = SQLBackend(app)
+    return app.people_backend
+
+
+SQL_CONFIG = u"""
+[aliquis]
+STORAGE_BACKEND = sql
+
+[sql]
+SQL_DATABASE = :memory:
+SQL_POOL_SIZE = 2
+
+[celery]
+CELERY_BROKER_URL = redis://localhost:6379
+
+[mail-sendgrid]
+SENDGRID_API_KEY = 1234
+
+[babel]
+BABEL_LANGUAGES = en
+"""
+
+
+class TestSQLConfig(unittest.TestCase):
+    """Check the selection of the SQL backend by configuration."""
+
+    def test_create_app(self):
+        """Check that an app storing people in an SQL database needs no LDAP configuration."""
+        with tempfile.NamedTemporaryFile('w', suffix='.ini') as config_file:
+            config_file.write(SQL_CONFIG)
+            config_file.flush()
+            app = create_app(read_config(config_file.name))
+        self.assertIsInstance(app.people_backend, SQLBackend)
+        self.assertEqual(app.people_backend.pool.max_size, 2)
+        self.assertIsNone(app.ldap_backend)
+
+
+class TestSQLConnectionPool(unittest.TestCase):
+    """Check the bounded pool of SQL connections."""
+
+    def setUp(self):
+        super(TestSQLConnectionPool, self).setUp()
+        self.app = create_app(read_config(TEST_CONFIG))
+        self.sql_backend = setup_sql_backend(self.app)
+
+    def test_connection_reused(self):
+        """Check that a released connection is handed out again."""
+        pool = self.sql_backend.pool
+        with pool.connection() as conn:
+            pass
+        with pool.connection() as conn2:
+            self.assertIs(conn2, conn)
+        self.assertEqual(pool.size, 1)
+
+    def test_checkout_timeout(self):
+        """Check that an exhausted pool raises an error after its timeout."""
+        pool = SQLConnectionPool(self.sql_backend._new_connection, max_size=1, timeout=0.05)
+        conn = pool.checkout()
+        with self.assertRaises(SQLPoolTimeoutError):
+            pool.checkout()
+        pool.checkin(conn)
+        self.assertIs(pool.checkout(), conn)
+
+    def test_request_connection(self):
+        """Check that a request uses a single connection, given back at teardown."""
+        with self.app.app_context():
+            conn = self.sql_backend.connection
+            self.assertIs(self.sql_backend.connection, conn)
+        self.assertEqual(self.sql_backend.pool._idle, [conn])
+
+
+class TestSQLBackend(unittest.TestCase):
+    """Check the SQL people storage backend."""
+
+    def setUp(self):
+        super(TestSQLBackend, self).setUp()
+        self.app = create_app(read_config(TEST_CONFIG))
+        self.sql_backend = setup_sql_backend(self.app)
+        with self.app.app_context():
+            self.sql_backend.create_person(new_person(
+                first_name='John', surname='Doe', username='jdoe', email='jdoe@example.org',
+                password='jdoe1234'
+            ))
+
+    def test_get_person(self):
+        """Check that people are found by username or email address, case insensitively."""
+        with self.app.app_context():
+            jdoe = self.sql_backend.get_person('JDoe')
+            self.assertEqual(jdoe.username, 'jdoe')
+            self.assertEqual(jdoe.display_name, 'John Doe')
+            self.assertTrue(jdoe.check_password('jdoe1234'))
+            self.assertEqual(self.sql_backend.get_person_by_email('JDOE@example.org'), jdoe)
+            self.assertIsNone(self.sql_backend.get_person('jane'))
+            self.assertIsNone(self.sql_backend.get_person_by_email('jane@example.org'))
+
+    def test_authenticate(self):
+        """Check that only the right clear text password authenticates a person."""
+        with self.app.app_context():
+            self.assertEqual(self.sql_backend.authenticate('jdoe', 'jdoe1234').username, 'jdoe')
+            self.assertIsNone(self.sql_backend.authenticate('jdoe', 'jdoe12345'))
+            self.assertIsNone(self.sql_backend.authenticate('jdoe', ''))
+            hashed = self.sql_backend.get_person('jdoe').password
+            self.assertIsNone(self.sql_backend.authenticate('jdoe', hashed))
+            self.assertIsNone(self.sql_backend.authenticate('jane', 'jdoe1234'))
+
+    def test_used_values(self):
+        """Check that used usernames and email addresses are told apart from free ones."""
+        with self.app.app_context():
+            self.assertEqual(self.sql_backend.used_attributes(username='JDOE',
+                                                              email='jane@example.org'),
+                             set(['username']))
+            self.assertEqual(self.sql_backend.used_attributes(username='jane',
+                                                              email='jdoe@example.org'),
+                             set(['email']))
+            self.assertEqual(self.sql_backend.used_attributes(username=''), set())
+            self.assertFalse(self.sql_backend.is_available('username', 'jdoe'))
+            self.assertTrue(self.sql_backend.is_available('email', 'jane@example.org'))
+            with self.assertRaises(ValueError):
+                self.sql_backend.is_available('password', 'jdoe1234')
+
+    def test_create_person(self):
+        """Check that a username or email address cannot be used twice."""
+        with self.app.app_context():
+            with self.assertRaises(PersonAlreadyExistsError) as ctx:
+                self.sql_backend.create_person(new_person(
+                    first_name='Jane', surname='Doe', username='jane', email='JDOE@example.org'
+                ))
+            self.assertIn('email JDOE@example.org', str(ctx.exception))
+            with self.assertRaises(PersonAlreadyExistsError):
+                self.sql_backend.create_person(new_person(first_name='John', surname='Doe',
+                                                          username='JDOE'))
+            self.sql_backend.create_person(new_person(first_name='Jane', surname='Doe',
+                                                      username='jane'))
+            self.assertIsNone(self.sql_backend.get_person('jane').email)
+            self.assertFalse(self.sql_backend.person_is_active('jane'))
+
+    def test_save_person(self):
+        """Check that people are updated, their password only if asked."""
+        with self.app.app_context():
+            jdoe = self.sql_backend.get_person('jdoe')
+            jdoe.surname = 'Smith'
+            jdoe.password = 'smith1234'
+            self.sql_backend.save_person(jdoe)
+            saved = self.sql_backend.get_person('jdoe')
+            self.assertEqual(saved.surname, 'Smith')
+            self.assertTrue(saved.check_password('jdoe1234'))
+            self.sql_backend.save_person(jdoe, update_password=True)
+            self.assertTrue(self.sql_backend.get_person('jdoe').check_password('smith1234'))
+            with self.assertRaises(NoSuchPersonError):
+                self.sql_backend.save_person(new_person(first_name='Jim', surname='Doe',
+                                                        username='jim'))
+
+    def test_replace_password_hash(self):
+        """Check that a password hash is replaced only if it is still the given one."""
+        with self.app.app_context():
+            old_hash = self.sql_backend.get_person('jdoe').password
+            jdoe = self.sql_backend.get_person('jdoe')
+            jdoe.password = 'smith1234'
+            self.assertTrue(self.sql_backend.replace_password_hash('jdoe', old_hash,
+                                                                   jdoe.password))
+            self.assertTrue(self.sql_backend.get_person('jdoe').check_password('smith1234'))
+            # The password changed since the old hash was read
+            self.assertFalse(self.sql_backend.replace_password_hash('jdoe', old_hash, old_hash))
+            self.assertTrue(self.sql_backend.get_person('jdoe').check_password('smith1234'))
+            self.assertFalse(self.sql_backend.replace_password_hash('jane', old_hash, old_hash))
+
+    def test_activation(self):
+        """Check that people are activated and deactivated."""
+        with self.app.app_context():
+            self.assertFalse(self.sql_backend.person_is_active('jdoe'))
+            self.sql_backend.activate_person('jdoe')
+            self.assertTrue(self.sql_backend.person_is_active('jdoe'))
+            self.assertTrue(self.sql_backend.get_person('jdoe').is_active)
+            self.sql_backend.deactivate_person('jdoe')
+            self.assertFalse(self.sql_backend.person_is_active('jdoe'))
+            self.assertFalse(self.sql_backend.person_is_active('jim'))
+            with self.assertRaises(NoSuchPersonError):
+                self.sql_backend.activate_person('jim')
+
+    def test_grants(self):
+        """Check that grants of one or many people are read."""
+        with self.app.app_context():
+            self.sql_backend.create_person(new_person(first_name='Jane', surname='Doe',
+                                                      username='jane'))
+            self.sql_backend.add_grant('jdoe', 'Wiki access')
+            self.sql_backend.add_grant('jdoe', 'Mail access')
+            self.sql_backend.add_grant('jdoe', 'Mail access')
+            self.assertEqual(self.sql_backend.person_grants('jdoe'),
+                             ('Mail access', 'Wiki access'))
+            self.assertEqual(self.sql_backend.people_grants(['JDOE', 'jane', 'jim']), {
+                'JDOE': ('Mail access', 'Wiki access'),
+                'jane': (),
+                'jim': None,
+            })
+            self.sql_backend.remove_grant('jdoe', 'Mail access')
+            self.assertEqual(self.sql_backend.person_grants('jdoe'), ('Wiki access',))
+
+
+class TestSQLDatabaseFile(unittest.TestCase):
+    """Check the SQL backend with a database file shared by threads."""
+
+    def setUp(self):
+        super(TestSQLDatabaseFile, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.app = create_app(read_config(TEST_CONFIG))
+        self.database = os.path.join(self.tmpdir, 'aliquis.db')
+
+    def tearDown(self):
+        super(TestSQLDatabaseFile, self).tearDown()
+        self.app.people_backend.pool.clear()
+        shutil.rmtree(self.tmpdir)
+
+    def test_concurrent_writes(self):
+        """Check that people added by many threads are all stored, and kept by the file."""
+        sql_backend = setup_sql_backend(self.app, self.database)
+
+        def add_people(start):
+            for i in range(start, start + 10):
+                with self.app.app_context():
+                    sql_backend.create_person(new_person(first_name='User', surname=str(i),
+                                                         username='user{0}'.format(i)))
+
+        threads = [threading.Thread(target=add_people, args=(i * 10,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertLessEqual(sql_backend.pool.size, self.app.config['SQL_POOL_SIZE'])
+        sql_backend.pool.clear()
+        sql_backend = setup_sql_backend(self.app, self.database)
+        with self.app.app_context():
+            self.assertEqual(sql_backend.connection.execute(
+                'SELECT COUNT(*) FROM people'
+            ).fetchone()[0], 40)
+
+
+if __name__ == '__main__':
+    unittest.main()